@@ -1,7 +1,10 @@
 """
 Basic post-processor worker - should be inherited by workers to post-process results
 """
+import concurrent.futures
+import collections
 import traceback
+import functools
 import zipfile
 import typing
 import shutil
@@ -10,11 +13,14 @@ import abc
 import csv
 import os
 
-from pathlib import Path, PurePath
+from pathlib import Path, PurePath, PurePosixPath
 
 import backend
 from backend.abstract.worker import BasicWorker
+from backend.lib.process_pool import get_process_pool, get_process_pool_size, stop_process_pool
 from common.lib.dataset import DataSet
+from common.lib.dataset_index import DataSetIndex
+from common.lib.result_writer import ResultWriter
 from common.lib.fourcat_module import FourcatModule
 from common.lib.helpers import get_software_version
 from common.lib.exceptions import WorkerInterruptedException, ProcessorInterruptedException, ProcessorException
@@ -22,6 +28,42 @@ from common.lib.exceptions import WorkerInterruptedException, ProcessorInterrupt
 csv.field_size_limit(1024 * 1024 * 1024)
 
 
+def _process_chunk(task):
+	"""
+	Process a chunk of a file, in a process in the shared process pool
+
+	:param tuple task:  Path of the file, chunk (either a `(start, end)` byte
+	  range or, for Parquet files, an `(offset, limit)` row range), chunk
+	  function, item mapper and columns to include
+	:return:  Return value of the chunk function
+	"""
+	path, chunk, function, item_mapper, columns = task
+
+	if path.suffix.lower() == ".parquet":
+		items = DataSetIndex.load(path).iterate_rows(*chunk, columns=columns if not item_mapper else None)
+	else:
+		items = DataSetIndex.iterate_ranges(path, [chunk])
+
+	if item_mapper:
+		items = (item_mapper(item) for item in items)
+
+	if columns is not None:
+		items = ({column: item[column] for column in columns if column in item} for item in items)
+
+	return function(items)
+
+
+def _process_items(function, items):
+	"""
+	Call a function for each item in a chunk
+
+	:param callable function:  Function to call
+	:param items:  Iterable of items
+	:return list:  Return values, one per item
+	"""
+	return [function(item) for item in items]
+
+
 class BasicProcessor(FourcatModule, BasicWorker, metaclass=abc.ABCMeta):
 	"""
 	Abstract processor class
@@ -84,6 +126,19 @@ class BasicProcessor(FourcatModule, BasicWorker, metaclass=abc.ABCMeta):
 	#: no need to override manually
 	filepath = None
 
+	#: Amount of rows to read from a Parquet file at once when iterating
+	#: through it
+	parquet_batch_size = 10000
+
+	#: Maximum amount of tasks (e.g. chunks of a file) to have processed at
+	#: the same time when working in parallel with `map_parallel()`; `None`
+	#: to use as many as there are processes in the shared process pool
+	parallel_processes = None
+
+	#: Approximate size, in bytes, of the chunks a file is split into when
+	#: processing it in parallel
+	parallel_chunk_size = 8 * 1024 * 1024
+
 	def work(self):
 		"""
 		Process a dataset
@@ -305,9 +360,9 @@ class BasicProcessor(FourcatModule, BasicWorker, metaclass=abc.ABCMeta):
 			# cancel job
 			self.job.finish()
 
-	def iterate_items(self, path, bypass_map_item=False):
+	def iterate_items(self, path, bypass_map_item=False, columns=None, byte_ranges=None):
 		"""
-		A generator that iterates through a CSV or NDJSON file
+		A generator that iterates through a CSV, NDJSON or Parquet file
 
 		With every iteration, the processor's 'interrupted' flag is checked,
 		and if set a ProcessorInterruptedException is raised, which by default
@@ -321,28 +376,74 @@ class BasicProcessor(FourcatModule, BasicWorker, metaclass=abc.ABCMeta):
 		that are easier to store as a JSON file than as a flat CSV file, and
 		it would be a shame to throw away that data
 
-		There are two file types that can be iterated (currently): CSV files
-		and NDJSON (newline-delimited JSON) files. In the future, one could
-		envision adding a pathway to retrieve items from e.g. a MongoDB
-		collection directly instead of from a static file
+		There are three file types that can be iterated (currently): CSV
+		files, NDJSON (newline-delimited JSON) files and Parquet files. The
+		latter is a columnar format, which means that if only a few columns
+		are requested via `columns`, only those are read from disk. In the
+		future, one could envision adding a pathway to retrieve items from
+		e.g. a MongoDB collection directly instead of from a static file
 
 		:param Path path: 	Path to file to read
+		:param bool bypass_map_item:  Do not map items, even if the processor
+		  that created the dataset defines a `map_item` method
+		:param list columns:  Only include these columns in the yielded
+		  items. Columns that do not exist in the dataset are left out. If
+		  `None`, all columns are included.
+		:param list byte_ranges:  Only read items from these byte ranges of
+		  a CSV or NDJSON file, as `(start, end)` tuples. Can be used with the
+		  ranges returned by `DataSetIndex.get_byte_ranges()` to skip parts of
+		  the file that are known to be irrelevant.
 		:return generator:  A generator that yields each item as a dictionary
 		"""
 
 		# see if an item mapping function has been defined
-		# open question if 'source_dataset' shouldn't be an attribute of the dataset
-		# instead of the processor...
-		item_mapper = None
-		if hasattr(self, "source_dataset") and self.source_dataset and not bypass_map_item:
-			parent_processor = self.all_modules.processors.get(self.source_dataset.type)
-			if parent_processor:
-				if hasattr(parent_processor, "map_item"):
-					item_mapper = parent_processor.map_item
+		item_mapper = self.get_item_mapper() if not bypass_map_item else None
+
+		# items need to be complete before they can be mapped, so if a mapper
+		# is used columns can only be selected after mapping
+		if columns is not None:
+			columns = list(columns)
+			project_after_mapping = bool(item_mapper)
+		else:
+			project_after_mapping = False
+
+		if byte_ranges is not None and path.suffix.lower() in (".csv", ".ndjson"):
+			# only read the given parts of the file
+			for item in DataSetIndex.iterate_ranges(path, byte_ranges):
+				if self.interrupted:
+					raise ProcessorInterruptedException("Processor interrupted while iterating through file")
+
+				if item_mapper:
+					item = item_mapper(item)
+
+				if columns is not None:
+					item = {column: item[column] for column in columns if column in item}
+
+				yield item
+
+			return
 
 		# go through items one by one, optionally mapping them
 		if path.suffix.lower() == ".csv":
 			with path.open(encoding="utf-8") as input:
+				if columns is not None and not project_after_mapping:
+					# with a plain reader we can skip creating a full
+					# dictionary for each row and only keep what is needed
+					reader = csv.reader(input)
+					try:
+						header = next(reader)
+					except StopIteration:
+						return
+
+					selected = [(column, header.index(column)) for column in columns if column in header]
+					for row in reader:
+						if self.interrupted:
+							raise ProcessorInterruptedException("Processor interrupted while iterating through CSV file")
+
+						yield {column: row[index] if index < len(row) else None for column, index in selected}
+
+					return
+
 				reader = csv.DictReader(input)
 
 				for item in reader:
@@ -352,6 +453,9 @@ class BasicProcessor(FourcatModule, BasicWorker, metaclass=abc.ABCMeta):
 					if item_mapper:
 						item = item_mapper(item)
 
+					if project_after_mapping:
+						item = {column: item[column] for column in columns if column in item}
+
 					yield item
 
 		elif path.suffix.lower() == ".ndjson":
@@ -366,11 +470,362 @@ class BasicProcessor(FourcatModule, BasicWorker, metaclass=abc.ABCMeta):
 					if item_mapper:
 						item = item_mapper(item)
 
+					if columns is not None:
+						item = {column: item[column] for column in columns if column in item}
+
+					yield item
+
+		elif path.suffix.lower() == ".parquet":
+			# columnar file - read in record batches, and only read the
+			# requested columns from disk
+			import pyarrow.parquet as pq
+
+			parquet_file = pq.ParquetFile(str(path))
+			read_columns = None
+			if columns is not None and not project_after_mapping:
+				available = set(parquet_file.schema_arrow.names)
+				read_columns = [column for column in columns if column in available]
+
+			for batch in parquet_file.iter_batches(batch_size=self.parquet_batch_size, columns=read_columns):
+				batch_columns = batch.schema.names
+				batch_values = [column.to_pylist() for column in batch.columns]
+				rows = zip(*batch_values) if batch_values else [()] * batch.num_rows
+
+				for row in rows:
+					if self.interrupted:
+						raise ProcessorInterruptedException("Processor interrupted while iterating through Parquet file")
+
+					item = dict(zip(batch_columns, row))
+					if item_mapper:
+						item = item_mapper(item)
+
+					if project_after_mapping:
+						item = {column: item[column] for column in columns if column in item}
+
 					yield item
 
 		else:
 			raise NotImplementedError("Cannot iterate through %s file" % path.suffix)
 
+	def iterate_batches(self, path, batch_size=None, columns=None, bypass_map_item=False, as_columns=False):
+		"""
+		A generator that iterates through a dataset file in batches of items
+
+		This works like `iterate_items()`, but instead of yielding items one
+		by one, it yields lists of (at most) `batch_size` items. This is
+		useful for processors that only do a little work per item, for which
+		the overhead of iterating item by item is significant. The
+		'interrupted' flag is checked once per batch, and the `map_item`
+		method of the processor that created the dataset, if any, is applied
+		to the batch as a whole.
+
+		If `as_columns` is set, each batch is yielded as a dictionary with a
+		list of values for each column instead, which is convenient for
+		processors that work with columns of values (e.g. via numpy).
+
+		:param Path path: 	Path to file to read
+		:param int batch_size:  Amount of items per batch. Defaults to the
+		  processor's `parquet_batch_size`.
+		:param list columns:  Only include these columns in the yielded
+		  items. Columns that do not exist in the dataset are left out. If
+		  `None`, all columns are included.
+		:param bool bypass_map_item:  Do not map items, even if the processor
+		  that created the dataset defines a `map_item` method
+		:param bool as_columns:  Yield a `column => values` dictionary per
+		  batch rather than a list of items
+		:return generator:  A generator that yields batches of items
+		"""
+		if not batch_size:
+			batch_size = self.parquet_batch_size
+
+		item_mapper = self.get_item_mapper() if not bypass_map_item else None
+
+		if columns is not None:
+			columns = list(columns)
+
+		# columns can only be selected while reading if items do not need to
+		# be mapped first
+		read_columns = columns if not item_mapper else None
+
+		def finalise(batch):
+			if self.interrupted:
+				raise ProcessorInterruptedException("Processor interrupted while iterating through %s file" % path.suffix)
+
+			if item_mapper:
+				batch = [item_mapper(item) for item in batch]
+				if columns is not None:
+					batch = [{column: item[column] for column in columns if column in item} for item in batch]
+
+			if as_columns:
+				keys = columns if columns is not None else (list(batch[0].keys()) if batch else [])
+				return {key: [item.get(key) for item in batch] for key in keys}
+
+			return batch
+
+		suffix = path.suffix.lower()
+		if suffix == ".parquet":
+			# record batches map directly to item batches here
+			import pyarrow.parquet as pq
+
+			parquet_file = pq.ParquetFile(str(path))
+			if read_columns is not None:
+				available = set(parquet_file.schema_arrow.names)
+				read_columns = [column for column in read_columns if column in available]
+
+			for record_batch in parquet_file.iter_batches(batch_size=batch_size, columns=read_columns):
+				if as_columns and not item_mapper:
+					# no need to go through items at all
+					if self.interrupted:
+						raise ProcessorInterruptedException("Processor interrupted while iterating through Parquet file")
+
+					yield {name: column.to_pylist() for name, column in zip(record_batch.schema.names, record_batch.columns)}
+					continue
+
+				if record_batch.num_columns:
+					yield finalise(record_batch.to_pylist())
+				else:
+					yield finalise([{} for i in range(record_batch.num_rows)])
+
+			return
+
+		if suffix == ".csv":
+			infile = path.open(encoding="utf-8")
+			if read_columns is not None:
+				reader = csv.reader(infile)
+				header = next(reader, [])
+				selected = [(column, header.index(column)) for column in read_columns if column in header]
+				items = ({column: row[index] if index < len(row) else None for column, index in selected} for row in reader)
+			else:
+				items = csv.DictReader(infile)
+
+		elif suffix == ".ndjson":
+			infile = path.open(encoding="utf-8")
+			items = (json.loads(line) for line in infile)
+			if read_columns is not None:
+				items = ({column: item[column] for column in read_columns if column in item} for item in items)
+
+		else:
+			raise NotImplementedError("Cannot iterate through %s file" % path.suffix)
+
+		with infile:
+			batch = []
+			for item in items:
+				batch.append(item)
+				if len(batch) >= batch_size:
+					yield finalise(batch)
+					batch = []
+
+			if batch:
+				yield finalise(batch)
+
+	def get_item_mapper(self):
+		"""
+		Get the function with which items in the source dataset are mapped
+
+		Processors can define a `map_item` method to map items from the
+		datasets they create to a flat dictionary; see `iterate_items()`.
+
+		:return callable|None:  The `map_item` method of the processor that
+		  created the source dataset, or `None` if there is none
+		"""
+		# open question if 'source_dataset' shouldn't be an attribute of the dataset
+		# instead of the processor...
+		if not hasattr(self, "source_dataset") or not self.source_dataset:
+			return None
+
+		parent_processor = self.all_modules.processors.get(self.source_dataset.type)
+		if parent_processor and hasattr(parent_processor, "map_item"):
+			return parent_processor.map_item
+
+		return None
+
+	def map_parallel(self, function, tasks, processes=None):
+		"""
+		Call a function for each of a number of tasks, in parallel
+
+		The tasks are processed by the backend's shared process pool (see
+		`backend.lib.process_pool`), which limits the amount of processes
+		doing parallel work regardless of how many processors are running.
+		Return values are yielded in the order of the tasks. Only a few tasks
+		are submitted to the pool at a time, so other processors get their
+		turn as well, and so tasks do not need to be kept in memory for long.
+
+		Both `function` and the tasks are sent to another process, so they
+		need to be picklable: `function` should be defined at the top level
+		of a module (or be a `functools.partial` of such a function, or an
+		instance of such a class). Since it runs in another process, it
+		should also be *pure*: changes it makes to e.g. the processor object
+		are lost, and it cannot use the database or the dataset object.
+
+		The 'interrupted' flag is checked while waiting for tasks to finish,
+		and when set, tasks that have not started yet are cancelled and a
+		ProcessorInterruptedException is raised.
+
+		If there is no process pool (e.g. because parallel processing is
+		disabled in the configuration), the function is called for each task
+		in the worker's own thread instead.
+
+		:param callable function:  Function to call for each task
+		:param Iterable tasks:  Tasks, each passed to `function` as its only
+		  argument
+		:param int processes:  Maximum amount of tasks to process at the same
+		  time. Defaults to the processor's `parallel_processes`, or the
+		  amount of processes in the pool.
+		:return generator:  Yields the return value of `function` per task
+		"""
+		pool = get_process_pool()
+		if not pool:
+			for task in tasks:
+				if self.interrupted:
+					raise ProcessorInterruptedException("Processor interrupted while processing tasks")
+
+				yield function(task)
+			return
+
+		if not processes:
+			processes = self.parallel_processes if self.parallel_processes else get_process_pool_size()
+
+		tasks = iter(tasks)
+		pending = collections.deque()
+		try:
+			while True:
+				# keep a few tasks queued, so no process has to wait for the
+				# next task while we are handling a result
+				for task in tasks:
+					pending.append(pool.submit(function, task))
+					if len(pending) >= processes + 1:
+						break
+
+				if not pending:
+					break
+
+				while True:
+					if self.interrupted:
+						raise ProcessorInterruptedException("Processor interrupted while processing tasks")
+
+					try:
+						result = pending[0].result(timeout=1)
+						break
+					except concurrent.futures.TimeoutError:
+						continue
+
+				pending.popleft()
+				yield result
+
+		except concurrent.futures.process.BrokenProcessPool:
+			# a process in the pool was terminated abruptly, e.g. because it
+			# ran out of memory; the pool cannot be used anymore
+			stop_process_pool()
+			raise ProcessorException("A process in the process pool was terminated abruptly. Parallel processing "
+									 "is disabled until the backend is restarted.")
+
+		finally:
+			for future in pending:
+				future.cancel()
+
+	def iterate_parallel(self, path, function, columns=None, bypass_map_item=False, chunk_size=None, processes=None):
+		"""
+		Process the items in a file in parallel, in chunks
+
+		The file is split into chunks of about `chunk_size` bytes (for CSV and
+		NDJSON files, using the dataset index to find row boundaries) or
+		`parquet_batch_size` * 10 rows (for Parquet files). Each chunk is then
+		passed to `function` in the shared process pool, with
+		`map_parallel()`; the function receives an iterator of (mapped) items
+		and can return anything that can be pickled. These return values are
+		yielded in the order of the chunks, i.e. in the same order one would
+		get by processing the file from start to end.
+
+		The same caveats apply to `function` as for `map_parallel()`: it
+		needs to be picklable, and should be pure.
+
+		If the file fits in a single chunk, or there is no process pool, the
+		function is called for batches of items in the worker's own thread
+		instead.
+
+		:param Path path: 	Path to file to read
+		:param callable function:  Function to call for each chunk
+		:param list columns:  Only include these columns in the items passed
+		  to `function`
+		:param bool bypass_map_item:  Do not map items, even if the processor
+		  that created the dataset defines a `map_item` method
+		:param int chunk_size:  Approximate chunk size, in bytes. Defaults to
+		  the processor's `parallel_chunk_size`.
+		:param int processes:  Maximum amount of chunks to process at the
+		  same time; see `map_parallel()`
+		:return generator:  Yields the return value of `function` per chunk
+		"""
+		if not chunk_size:
+			chunk_size = self.parallel_chunk_size
+
+		item_mapper = self.get_item_mapper() if not bypass_map_item else None
+		if columns is not None:
+			columns = list(columns)
+
+		# determine chunks; for CSV and NDJSON files these are byte ranges
+		# starting at the start of a row, which the index provides
+		chunks = []
+		suffix = path.suffix.lower()
+		if suffix in (".csv", ".ndjson", ".parquet") and get_process_pool():
+			index = DataSetIndex.load(path)
+			if not index and self.source_dataset and path == self.source_file:
+				index = self.source_dataset.build_index()
+
+			if index and suffix == ".parquet":
+				rows_per_chunk = self.parquet_batch_size * 10
+				chunks = [(offset, rows_per_chunk) for offset in range(0, index.num_rows, rows_per_chunk)]
+			elif index:
+				# combine blocks of rows into chunks of roughly the right size
+				offsets = [block["offset"] for block in index.data["blocks"]]
+				for offset in offsets:
+					if not chunks or offset - chunks[-1][0] >= chunk_size:
+						if chunks:
+							chunks[-1] = (chunks[-1][0], offset)
+						chunks.append((offset, None))
+
+		if len(chunks) < 2:
+			# not worth the overhead of using other processes; process the
+			# file in batches in this thread instead
+			for batch in self.iterate_batches(path, columns=columns, bypass_map_item=bypass_map_item):
+				yield function(iter(batch))
+			return
+
+		self.log.debug("Processing %s in %i chunks" % (path.name, len(chunks)))
+		tasks = [(path, chunk, function, item_mapper, columns) for chunk in chunks]
+		yield from self.map_parallel(_process_chunk, tasks, processes=processes)
+
+	def iterate_items_parallel(self, path, function, columns=None, bypass_map_item=False, chunk_size=None, processes=None):
+		"""
+		Process each item in a file in parallel
+
+		Like `iterate_parallel()`, but `function` is called for each item
+		rather than for each chunk of items. The return values are yielded one
+		by one, in the order of the items they were returned for, so this can
+		mostly be used as a drop-in replacement for `iterate_items()` in
+		processors that do a lot of work per item. The same caveats apply to
+		`function` as for `iterate_parallel()`.
+
+		:param Path path: 	Path to file to read
+		:param callable function:  Function to call for each item
+		:param list columns:  Only include these columns in the items passed
+		  to `function`
+		:param bool bypass_map_item:  Do not map items, even if the processor
+		  that created the dataset defines a `map_item` method
+		:param int chunk_size:  Approximate chunk size, in bytes
+		:param int processes:  Maximum amount of chunks to process at the
+		  same time
+		:return generator:  Yields the return value of `function` per item
+		"""
+		process_items = functools.partial(_process_items, function)
+
+		for results in self.iterate_parallel(path, process_items, columns=columns, bypass_map_item=bypass_map_item,
+											 chunk_size=chunk_size, processes=processes):
+			for result in results:
+				if self.interrupted:
+					raise ProcessorInterruptedException("Processor interrupted while processing %s file" % path.suffix)
+
+				yield result
+
 	def get_item_keys(self, path=None):
 		"""
 		Get item attribute names
@@ -390,6 +845,13 @@ class BasicProcessor(FourcatModule, BasicWorker, metaclass=abc.ABCMeta):
 		if not path:
 			path = self.dataset.get_results_path()
 
+		# if items are not mapped, the keys are simply the file's columns,
+		# which may be known without opening the file
+		mapped = bool(self.get_item_mapper())
+		index = DataSetIndex.load(path)
+		if index and index.columns is not None and (not mapped or index.data["format"] == "ndjson"):
+			return list(index.columns)
+
 		items = self.iterate_items(path)
 		try:
 			keys = list(items.__next__().keys())
@@ -448,6 +910,39 @@ class BasicProcessor(FourcatModule, BasicWorker, metaclass=abc.ABCMeta):
 			shutil.rmtree(self.staging_area)
 			del self.staging_area
 
+	def iterate_archive_members(self, path):
+		"""
+		A generator that iterates through files in an archive, without
+		extracting them
+
+		Like `iterate_archive_contents()`, but rather than extracting each
+		file to a staging area first, a binary file-like object is yielded
+		that reads the file straight from the archive. Result archives are
+		stored uncompressed, so this is little more than reading part of the
+		archive file. The file object is closed when the next file is
+		requested.
+
+		Token sets can be read from the yielded file objects with
+		`iterate_json_list()`, which parses the token lists one by one.
+
+		:param Path path: 	Path to zip file to read
+		:return:  An iterator with a `(PurePosixPath, file)` tuple for each
+		  file, the first item being the file's name within the archive
+		"""
+		if not path.exists():
+			return
+
+		with zipfile.ZipFile(path, "r") as archive_file:
+			for member in sorted(archive_file.infolist(), key=lambda member: member.filename):
+				if self.interrupted:
+					raise ProcessorInterruptedException("Interrupted while iterating zip file contents")
+
+				if member.is_dir():
+					continue
+
+				with archive_file.open(member) as member_file:
+					yield PurePosixPath(member.filename), member_file
+
 	def unpack_archive_contents(self, path, staging_area=None):
 		"""
 		Unpack all files in an archive to a staging area
@@ -492,6 +987,65 @@ class BasicProcessor(FourcatModule, BasicWorker, metaclass=abc.ABCMeta):
 
 		return staging_area
 
+	def write_items(self, fieldnames=None, path=None, format=None):
+		"""
+		Get a writer to write result items with incrementally
+
+		Returns a `ResultWriter`, to be used as a context manager, that writes
+		items to the results file one by one, so processors do not need to
+		keep all their results in memory. The writer counts the items written
+		to it, which can be passed on to `DataSet.finish()`:
+
+		.. code-block:: python
+
+			with self.write_items() as writer:
+				for item in items:
+					writer.write(item)
+
+			self.dataset.finish(writer.num_rows)
+
+		:param list fieldnames:  Columns of the results file. If `None`, the
+		  keys of the first item written are used.
+		:param Path path:  File to write to; defaults to the dataset's results
+		  file
+		:param str format:  `csv`, `ndjson` or `parquet`; by default this is
+		  determined from the file's extension
+		:return ResultWriter:  Writer
+		"""
+		if not path:
+			path = self.dataset.get_results_path()
+
+		return ResultWriter(path, fieldnames=fieldnames, format=format, batch_size=self.parquet_batch_size)
+
+	def write_items_and_finish(self, items, fieldnames=None, format=None):
+		"""
+		Write items to results file and finish dataset
+
+		Like `write_csv_items_and_finish()`, but `items` may be any iterable,
+		e.g. a generator, so results can be written while they are being
+		generated. Will raise a ProcessorInterruptedException if the
+		interrupted flag for this processor is set while iterating.
+
+		:param Iterable items:  Items to write, as dictionaries
+		:param list fieldnames:  Columns of the results file. If `None`, the
+		  keys of the first item are used.
+		:param str format:  `csv`, `ndjson` or `parquet`; by default this is
+		  determined from the extension of the results file
+		:return int:  Amount of items written
+		"""
+		self.dataset.update_status("Writing results file")
+		with self.write_items(fieldnames=fieldnames, format=format) as writer:
+			for item in items:
+				if self.interrupted:
+					raise ProcessorInterruptedException("Interrupted while writing results file")
+
+				writer.write(item)
+
+		self.dataset.update_status("Finished")
+		self.dataset.finish(writer.num_rows)
+
+		return writer.num_rows
+
 	def write_csv_items_and_finish(self, data):
 		"""
 		Write data as csv to results file and finish dataset
@@ -501,29 +1055,21 @@ class BasicProcessor(FourcatModule, BasicWorker, metaclass=abc.ABCMeta):
 		raise a ProcessorInterruptedException if the interrupted flag for this
 		processor is set while iterating.
 
-		:param data: A list or tuple of dictionaries, all with the same keys
+		:param data: A list or tuple of dictionaries, all with the same keys.
+		  May also be another iterable, e.g. a generator, in which case items
+		  are written as they are generated.
 		"""
-		if not (isinstance(data, typing.List) or isinstance(data, typing.Tuple)) or isinstance(data, str):
-			raise TypeError("write_csv_items requires a list or tuple of dictionaries as argument")
-
-		if not data:
-			raise ValueError("write_csv_items requires a dictionary with at least one item")
-
-		if not isinstance(data[0], dict):
+		if isinstance(data, (str, dict)):
 			raise TypeError("write_csv_items requires a list or tuple of dictionaries as argument")
 
-		self.dataset.update_status("Writing results file")
-		with self.dataset.get_results_path().open("w", encoding="utf-8", newline='') as results:
-			writer = csv.DictWriter(results, fieldnames=data[0].keys())
-			writer.writeheader()
+		if isinstance(data, (typing.List, typing.Tuple)):
+			if not data:
+				raise ValueError("write_csv_items requires a dictionary with at least one item")
 
-			for row in data:
-				if self.interrupted:
-					raise ProcessorInterruptedException("Interrupted while writing results file")
-				writer.writerow(row)
+			if not isinstance(data[0], dict):
+				raise TypeError("write_csv_items requires a list or tuple of dictionaries as argument")
 
-		self.dataset.update_status("Finished")
-		self.dataset.finish(len(data))
+		self.write_items_and_finish(data, format="csv")
 
 	def write_archive_and_finish(self, files, num_items=None, compression=zipfile.ZIP_STORED):
 		"""
@@ -575,7 +1121,7 @@ class BasicProcessor(FourcatModule, BasicWorker, metaclass=abc.ABCMeta):
 
 		standalone = self.dataset.copy(shallow=False)
 		standalone.body_match = "(Filtered) " + top_parent.query
-		standalone.datasource = top_parent.parameters.get("datasource", "custom")
+		standalone.set_datasource(top_parent.parameters.get("datasource", "custom"))
 
 		try:
 			standalone.board = top_parent.board
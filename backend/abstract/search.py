@@ -5,6 +5,7 @@ import json
 import math
 import csv
 import copy
+import os
 
 from pathlib import Path
 from abc import ABC, abstractmethod
@@ -12,6 +13,7 @@ from abc import ABC, abstractmethod
 import config
 
 from common.lib.dataset import DataSet
+from common.lib.search_cache import SearchCache
 from backend.abstract.processor import BasicProcessor
 from common.lib.helpers import strip_tags, dict_search_and_update
 from common.lib.exceptions import WorkerInterruptedException, ProcessorInterruptedException
@@ -49,6 +51,24 @@ class Search(BasicProcessor, ABC):
 	# Mandatory columns: ['thread_id', 'body', 'subject', 'timestamp']
 	return_cols = ['thread_id', 'body', 'subject', 'timestamp']
 
+	#: Amount of IDs to match per query when collecting items for a (large)
+	#: set of IDs from a local database, e.g. after a Sphinx search. See
+	#: `iterate_by_ids()`.
+	id_chunk_size = 50000
+
+	#: Whether results can be reused for later searches with the same
+	#: parameters, rather than running the search again. Only enable this for
+	#: data sources whose data does not change over time, or that invalidate
+	#: the cache when data is added (see `SearchCache.invalidate()`).
+	cache_results = False
+
+	#: Cached results older than this amount of seconds are not reused
+	cache_max_age = 86400
+
+	#: Parameters that do not influence the search results, and are ignored
+	#: when determining whether cached results can be reused
+	uncached_parameters = ("user", "datasource", "type", "next", "copy_to", "label", "job")
+
 	def process(self):
 		"""
 		Create 4CAT dataset from a data source
@@ -63,9 +83,16 @@ class Search(BasicProcessor, ABC):
 
 		self.log.info("Querying: %s" % str(query_parameters))
 
+		# see if an earlier search with the same parameters can be reused
+		cache = SearchCache(self.db)
+		cache_key = self.get_cache_key(query_parameters)
+		num_cached = self.get_cached_results(cache, cache_key) if cache_key else None
+
 		# Execute the relevant query (string-based, random, countryflag-based)
 		try:
-			if query_parameters.get("file"):
+			if num_cached is not None:
+				posts = None
+			elif query_parameters.get("file"):
 				posts = self.import_from_file(query_parameters.get("file"))
 			else:
 				posts = self.search(query_parameters)
@@ -74,16 +101,26 @@ class Search(BasicProcessor, ABC):
 
 		# Write posts to csv and update the DataBase status to finished
 		num_posts = 0
-		if posts:
+		if num_cached is not None:
+			num_posts = num_cached
+			self.dataset.update_status("Query finished, results are available (reused from an earlier identical query).")
+		elif posts:
 			self.dataset.update_status("Writing posts to result file")
 			if not hasattr(self, "extension") or self.extension == "csv":
 				num_posts = self.items_to_csv(posts, results_file)
 			elif self.extension == "ndjson":
 				num_posts = self.items_to_ndjson(posts, results_file)
+			elif self.extension == "parquet":
+				num_posts = self.items_to_parquet(posts, results_file)
 			else:
 				raise NotImplementedError("Datasource query cannot be saved as %s file" % self.extension)
 
-			self.dataset.update_status("Query finished, results are available.")
+			# posts may be a generator, in which case it is only known whether
+			# there were any results after writing them
+			if num_posts > 0:
+				self.dataset.update_status("Query finished, results are available.")
+			else:
+				self.dataset.update_status("Query finished, no results found.")
 		elif posts is not None:
 			self.dataset.update_status("Query finished, no results found.")
 
@@ -115,6 +152,85 @@ class Search(BasicProcessor, ABC):
 
 		self.dataset.finish(num_rows=num_posts)
 
+		# make results available for later identical searches
+		if cache_key and num_cached is None and num_posts > 0:
+			cache.add(cache_key, self.dataset.key, query_parameters.get("datasource", self.prefix),
+					  board=query_parameters.get("board", ""), min_date=query_parameters.get("min_date", 0),
+					  max_date=query_parameters.get("max_date", 0))
+
+	def get_cache_key(self, query):
+		"""
+		Get the key under which results for a query are cached
+
+		Parameters that do not influence the results are ignored, and the
+		others are normalised, so that e.g. surrounding whitespace or the
+		order of selected options does not matter.
+
+		:param dict query:  Query parameters
+		:return str|None:  Cache key, or `None` if the results of this query
+		cannot be cached
+		"""
+		if not self.cache_results or query.get("file"):
+			return None
+
+		parameters = {}
+		for parameter, value in query.items():
+			if parameter in self.uncached_parameters:
+				continue
+
+			if type(value) is str:
+				value = value.strip()
+			elif type(value) in (list, tuple) and all([type(item) is str for item in value]):
+				value = sorted([item.strip() for item in value])
+
+			parameters[parameter] = value
+
+		return SearchCache.get_cache_key(self.type, parameters)
+
+	def get_cached_results(self, cache, cache_key):
+		"""
+		Reuse cached results for this dataset
+
+		If a finished dataset with results for the same query exists, its
+		result file is hard-linked to this dataset's result path (or copied,
+		if a link cannot be made, e.g. because the file system does not
+		support it).
+
+		:param SearchCache cache:  Search result cache
+		:param str cache_key:  Cache key, see `get_cache_key()`
+		:return int|None:  Amount of items in the reused results, or `None`
+		if no cached results are available
+		"""
+		cached_key = cache.get(cache_key, max_age=self.cache_max_age)
+		if not cached_key or cached_key == self.dataset.key:
+			return None
+
+		try:
+			cached = DataSet(key=cached_key, db=self.db)
+		except TypeError:
+			# dataset has been deleted since
+			cache.delete(cache_key)
+			return None
+
+		source = cached.get_results_path()
+		if not cached.is_finished() or not source.exists() or source.suffix != self.dataset.get_results_path().suffix:
+			cache.delete(cache_key)
+			return None
+
+		self.dataset.update_status("Reusing results of an earlier identical query")
+		results_file = self.dataset.get_results_path()
+		try:
+			os.link(source, results_file)
+		except OSError:
+			shutil.copyfile(source, results_file)
+
+		# a hard-linked file has the same size and modification time, so the
+		# index of the original file remains valid for it
+		if cached.get_index_path().exists():
+			shutil.copyfile(cached.get_index_path(), self.dataset.get_index_path())
+
+		return cached.data["num_rows"]
+
 	def search(self, query):
 		"""
 		Search for items matching the given query
@@ -151,6 +267,41 @@ class Search(BasicProcessor, ABC):
 		"""
 		pass
 
+	def iterate_by_ids(self, query, ids, replacements=None, status=None):
+		"""
+		Iterate over the results of a database query for a set of IDs
+
+		Rather than passing all IDs to the database in a single (potentially
+		huge) `IN` clause, the IDs are sorted and matched in chunks of
+		`id_chunk_size` IDs, each of which is passed as a single array
+		parameter. Results are streamed from the database per chunk, so if the
+		query orders its results by the ID column, the results of all chunks
+		together are ordered by it as well.
+
+		:param str query:  SQL query. Should contain a `= ANY(%s)` clause
+		(or similar) as its *last* parameter, which will be replaced with an
+		array of IDs.
+		:param Iterable ids:  IDs to match
+		:param list replacements:  Values for any other parameters in the
+		query, preceding the ID array
+		:param str status:  Status message to show while collecting items;
+		will be formatted with the amount of IDs processed and the total
+		amount of IDs.
+		:return Generator:  Yields rows, as dictionaries
+		"""
+		ids = sorted(set(ids))
+		replacements = list(replacements) if replacements else []
+
+		for offset in range(0, len(ids), self.id_chunk_size):
+			if self.interrupted:
+				raise ProcessorInterruptedException("Interrupted while fetching data from database")
+
+			if status:
+				self.dataset.update_status(status % (offset, len(ids)))
+
+			chunk = ids[offset:offset + self.id_chunk_size]
+			yield from self.db.iterate_interruptable(self.queue, query, replacements + [chunk])
+
 	def import_from_file(self, path):
 		"""
 		Import items from an external file
@@ -203,6 +354,88 @@ class Search(BasicProcessor, ABC):
 		if not isinstance(filepath, Path):
 			filepath = Path(filepath)
 
+		processed = 0
+		header_written = False
+		with filepath.open("w", encoding="utf-8") as csvfile:
+			for row in self.flatten_items(results):
+				if not header_written:
+					writer = csv.DictWriter(csvfile, fieldnames=list(row.keys()), lineterminator='\n')
+					writer.writeheader()
+					header_written = True
+
+				processed += 1
+				writer.writerow(row)
+
+		return processed
+
+	def items_to_parquet(self, results, filepath):
+		"""
+		Save retrieved items as a Parquet file
+
+		Items are processed exactly like they would be for a CSV file, but
+		are saved in a columnar format instead. This allows processors to only
+		read the columns they need when iterating through the file, which is
+		a lot faster than parsing a full CSV file for large datasets. Like in
+		CSV files, all values are stored as strings.
+
+		Items are written in row groups of `parquet_batch_size` rows, so the
+		full result set never needs to be kept in memory.
+
+		:param Iterable results:  List of dict rows from data source.
+		:param Path filepath:  Filepath for the resulting Parquet file
+
+		:return int:  Amount of items that were processed
+		"""
+		import pyarrow
+		import pyarrow.parquet as pq
+
+		if not filepath:
+			raise ResourceWarning("No result file for query")
+
+		if not isinstance(filepath, Path):
+			filepath = Path(filepath)
+
+		processed = 0
+		schema = None
+		writer = None
+		batch = []
+
+		def write_batch(rows):
+			columns = {field: [None if row.get(field) is None else str(row.get(field)) for row in rows] for field in schema.names}
+			writer.write_table(pyarrow.Table.from_pydict(columns, schema=schema))
+
+		try:
+			for row in self.flatten_items(results):
+				if not writer:
+					schema = pyarrow.schema([(field, pyarrow.string()) for field in row.keys()])
+					writer = pq.ParquetWriter(str(filepath), schema)
+
+				batch.append(row)
+				processed += 1
+
+				if len(batch) >= self.parquet_batch_size:
+					write_batch(batch)
+					batch = []
+
+			if batch:
+				write_batch(batch)
+		finally:
+			if writer:
+				writer.close()
+
+		return processed
+
+	def flatten_items(self, results):
+		"""
+		Prepare items for saving in a flat, tabular file
+
+		Some specific processing is done on the "body" key to strip HTML from
+		it, and a human-readable timestamp is provided next to the UNIX
+		timestamp. Author names are pseudonymised if requested.
+
+		:param Iterable results:  List of dict rows from data source.
+		:return Generator:  Yields processed items, item for item
+		"""
 		# cache hashed author names, so the hashing function (which is
 		# relatively expensive) is not run too often
 		pseudonymise_author = bool(self.parameters.get("pseudonymise", None))
@@ -215,67 +448,55 @@ class Search(BasicProcessor, ABC):
 		hasher = hashlib.blake2b(digest_size=24)
 		hasher.update(str(config.ANONYMISATION_SALT).encode("utf-8"))
 
-		processed = 0
-		header_written = False
-		with filepath.open("w", encoding="utf-8") as csvfile:
-			# Parsing: remove the HTML tags, but keep the <br> as a newline
-			# Takes around 1.5 times longer
-			for row in results:
-				if self.interrupted:
-					raise ProcessorInterruptedException("Interrupted while writing results to file")
-
-				if not header_written:
-					fieldnames = list(row.keys())
-					fieldnames.append("unix_timestamp")
-					writer = csv.DictWriter(csvfile, fieldnames=fieldnames, lineterminator='\n')
-					writer.writeheader()
-					header_written = True
-
-				processed += 1
-
-				# Create human dates from timestamp
-				from datetime import datetime, timezone
-
-				if "timestamp" in row:
-					# Data sources should have "timestamp" as a unix epoch integer,
-					# but do some conversion if this is not the case.
-					timestamp = row["timestamp"]
-					if not isinstance(timestamp, int):
-						if isinstance(timestamp,
-									  str) and "-" not in timestamp:  # String representation of epoch timestamp
-							timestamp = int(timestamp)
-						elif isinstance(timestamp, str) and "-" in timestamp:  # Date string
-							try:
-								timestamp = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S").replace(
-									tzinfo=timezone.utc).timestamp()
-							except ValueError:
-								timestamp = "undefined"
-						else:
+		# Parsing: remove the HTML tags, but keep the <br> as a newline
+		# Takes around 1.5 times longer
+		for row in results:
+			if self.interrupted:
+				raise ProcessorInterruptedException("Interrupted while writing results to file")
+
+			# Create human dates from timestamp
+			from datetime import datetime, timezone
+
+			if "timestamp" in row:
+				# Data sources should have "timestamp" as a unix epoch integer,
+				# but do some conversion if this is not the case.
+				timestamp = row["timestamp"]
+				if not isinstance(timestamp, int):
+					if isinstance(timestamp,
+								  str) and "-" not in timestamp:  # String representation of epoch timestamp
+						timestamp = int(timestamp)
+					elif isinstance(timestamp, str) and "-" in timestamp:  # Date string
+						try:
+							timestamp = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S").replace(
+								tzinfo=timezone.utc).timestamp()
+						except ValueError:
 							timestamp = "undefined"
-
-					# Add a human-readable date format as well, if we have a valid timestamp.
-					row["unix_timestamp"] = timestamp
-					if timestamp != "undefined":
-						row["timestamp"] = datetime.utcfromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
 					else:
-						row["timestamp"] = timestamp
+						timestamp = "undefined"
+
+				# Add a human-readable date format as well, if we have a valid timestamp.
+				row["unix_timestamp"] = timestamp
+				if timestamp != "undefined":
+					row["timestamp"] = datetime.utcfromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
 				else:
-					row["timestamp"] = "undefined"
+					row["timestamp"] = timestamp
+			else:
+				row["timestamp"] = "undefined"
+				row["unix_timestamp"] = "undefined"
 
-				# Parse html to text
-				if row["body"]:
-					row["body"] = strip_tags(row["body"])
+			# Parse html to text
+			if row["body"]:
+				row["body"] = strip_tags(row["body"])
 
-				# replace author column with salted hash of the author name, if
-				# pseudonymisation is enabled
-				if pseudonymise_author:
-					check_cache = CheckCache(hash_cache, hasher)
-					author_fields = [field for field in row.keys() if "author" in field]
-					for author_field in author_fields:
-						row[author_field] = check_cache.update_cache(row[author_field])
-				writer.writerow(row)
+			# replace author column with salted hash of the author name, if
+			# pseudonymisation is enabled
+			if pseudonymise_author:
+				check_cache = CheckCache(hash_cache, hasher)
+				author_fields = [field for field in row.keys() if "author" in field]
+				for author_field in author_fields:
+					row[author_field] = check_cache.update_cache(row[author_field])
 
-		return processed
+			yield row
 
 	def items_to_ndjson(self, items, filepath):
 		"""
@@ -355,6 +576,22 @@ class SearchWithScope(Search, ABC):
 	- All posts in a thread containing at least x% matching posts
 	"""
 
+	def get_cache_key(self, query):
+		"""
+		Get the key under which results for a query are cached
+
+		Random samples are never cached, since the point of those is that they
+		are different every time.
+
+		:param dict query:  Query parameters
+		:return str|None:  Cache key, or `None` if the results of this query
+		cannot be cached
+		"""
+		if query.get("search_scope", None) == "random-sample":
+			return None
+
+		return super().get_cache_key(query)
+
 	def search(self, query):
 		"""
 		Complex search
@@ -378,12 +615,27 @@ class SearchWithScope(Search, ABC):
 
 		# handle the various search scope options after retrieving initial post
 		# list
+		# posts may be a generator that streams them from the database, so
+		# they can only be iterated over once, and without keeping them all in
+		# memory
 		if query.get("search_scope", None) == "dense-threads":
 			# dense threads - all posts in all threads in which the requested
 			# proportion of posts matches
-			# first, get amount of posts for all threads in which matching
+			# first, determine how many matching posts occur per thread in the
+			# initial data set
+			posts_per_thread = {}
+			for post in posts:
+				if post["thread_id"] not in posts_per_thread:
+					posts_per_thread[post["thread_id"]] = 0
+
+				posts_per_thread[post["thread_id"]] += 1
+
+			if not posts_per_thread:
+				return None
+
+			# then, get amount of posts for all threads in which matching
 			# posts occur and that are long enough
-			thread_ids = tuple([post["thread_id"] for post in posts])
+			thread_ids = tuple(posts_per_thread.keys())
 			self.dataset.update_status("Retrieving thread metadata for %i threads" % len(thread_ids))
 			try:
 				min_length = int(query.get("scope_length", 30))
@@ -392,15 +644,6 @@ class SearchWithScope(Search, ABC):
 
 			thread_sizes = self.get_thread_sizes(thread_ids, min_length)
 
-			# determine how many matching posts occur per thread in the initial
-			# data set
-			posts_per_thread = {}
-			for post in posts:
-				if post["thread_id"] not in posts_per_thread:
-					posts_per_thread[post["thread_id"]] = 0
-
-				posts_per_thread[post["thread_id"]] += 1
-
 			# keep all thread IDs where that amount is more than the requested
 			# density
 			qualifying_thread_ids = set()
@@ -435,6 +678,9 @@ class SearchWithScope(Search, ABC):
 		elif query.get("search_scope", None) == "full-threads":
 			# get all post in threads containing at least one matching post
 			thread_ids = tuple(set([post["thread_id"] for post in posts]))
+			if not thread_ids:
+				return None
+
 			if len(thread_ids) > 25000:
 				self.dataset.update_status(
 					"Too many matching threads (%i) to get full thread data for, aborting. Please try again with a narrower query." % len(
@@ -452,11 +698,23 @@ class SearchWithScope(Search, ABC):
 				try:
 					self.dataset.update_status("Creating random sample")
 					sample_size = int(query.get("sample_size", 5000))
-					posts = list(posts)
-					random.shuffle(posts)
-					return posts[0:sample_size]
 				except ValueError:
-					pass
+					sample_size = None
+
+				if sample_size is not None:
+					# reservoir sampling, so only the sample needs to be kept
+					# in memory
+					sample = []
+					for i, post in enumerate(posts):
+						if i < sample_size:
+							sample.append(post)
+						else:
+							replace = random.randint(0, i)
+							if replace < sample_size:
+								sample[replace] = post
+
+					random.shuffle(sample)
+					return sample
 
 		# search workers may define an 'after_search' hook that is called after
 		# the query is first completed
@@ -129,6 +129,11 @@ class BasicWorker(threading.Thread, metaclass=abc.ABCMeta):
 			self.log.error("Worker %s raised exception %s and will abort: %s at %s" % (self.type, e.__class__.__name__, str(e), location))
 			self.job.add_status("Crash during execution")
 
+		# a worker slot has freed up, so the manager may be able to start a
+		# new worker
+		if self.manager:
+			self.manager.wake()
+
 	def abort(self):
 		"""
 		Called when the application shuts down
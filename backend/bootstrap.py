@@ -7,6 +7,7 @@ import os
 from common.lib.queue import JobQueue
 from common.lib.database import Database
 from backend.lib.manager import WorkerManager
+from backend.lib.process_pool import start_process_pool, stop_process_pool
 from common.lib.logger import Logger
 
 import config
@@ -38,6 +39,10 @@ def run(as_daemon=True):
 		print(indent + "|                 shut down the backend as well.                |")
 		print(indent + "+---------------------------------------------------------------+\n\n")
 
+	# processes for parallel work are forked before anything else is set up,
+	# so they do not inherit threads, connections or open files
+	start_process_pool(config.PARALLEL_PROCESSES if hasattr(config, "PARALLEL_PROCESSES") else 2)
+
 	# load everything
 	if hasattr(config, "DOCKER_CONFIG_FILE") and os.path.exists(config.DOCKER_CONFIG_FILE):
 		# Rename log if Docker setup
@@ -53,4 +58,5 @@ def run(as_daemon=True):
 
 	# make it happen
 	WorkerManager(logger=log, database=db, queue=queue, as_daemon=as_daemon)
+	stop_process_pool()
 	log.info("4CAT Backend shut down.")
@@ -26,6 +26,14 @@ CREATE UNIQUE INDEX IF NOT EXISTS unique_job
   );
 
 
+-- backend heartbeat, to check if the backend is running without access to
+-- its process
+CREATE TABLE IF NOT EXISTS heartbeat (
+  component  text UNIQUE PRIMARY KEY,
+  pid        integer DEFAULT 0,
+  timestamp  integer DEFAULT 0
+);
+
 -- queries
 CREATE TABLE IF NOT EXISTS datasets (
   id                SERIAL PRIMARY KEY,
@@ -34,6 +42,8 @@ CREATE TABLE IF NOT EXISTS datasets (
   key_parent        text DEFAULT '',
   query             text,
   job               integer DEFAULT 0,
+  owner             text DEFAULT '',
+  datasource        text DEFAULT '',
   parameters        text,
   result_file       text DEFAULT '',
   timestamp         integer,
@@ -45,6 +55,47 @@ CREATE TABLE IF NOT EXISTS datasets (
   annotation_fields text DEFAULT ''
 );
 
+CREATE INDEX IF NOT EXISTS datasets_key
+  ON datasets (
+    key
+  );
+
+CREATE INDEX IF NOT EXISTS datasets_key_parent
+  ON datasets (
+    key_parent
+  );
+
+CREATE INDEX IF NOT EXISTS datasets_job
+  ON datasets (
+    job
+  );
+
+CREATE INDEX IF NOT EXISTS datasets_owner
+  ON datasets (
+    owner,
+    timestamp,
+    id
+  );
+
+CREATE INDEX IF NOT EXISTS datasets_datasource
+  ON datasets (
+    datasource,
+    timestamp
+  );
+
+CREATE INDEX IF NOT EXISTS datasets_timestamp
+  ON datasets (
+    timestamp,
+    id
+  );
+
+-- trigram index, for filtering datasets by (part of) their query
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS datasets_query
+  ON datasets
+  USING gin (query gin_trgm_ops);
+
 -- annotations
 CREATE TABLE IF NOT EXISTS annotations (
   key               text UNIQUE PRIMARY KEY,
@@ -98,3 +149,72 @@ CREATE FUNCTION count_estimate(query text) RETURNS bigint AS $$
     RETURN rec."QUERY PLAN"->0->'Plan'->'Plan Rows';
   END;
   $$ LANGUAGE plpgsql VOLATILE STRICT;
+
+-- cached search results, to reuse for identical queries
+CREATE TABLE IF NOT EXISTS search_cache (
+  cache_key   TEXT UNIQUE PRIMARY KEY,
+  dataset     TEXT,
+  datasource  TEXT,
+  board       TEXT DEFAULT '',
+  min_date    INTEGER DEFAULT 0,
+  max_date    INTEGER DEFAULT 0,
+  timestamp   INTEGER
+);
+
+CREATE INDEX IF NOT EXISTS search_cache_datasource
+  ON search_cache (
+    datasource,
+    board
+  );
+
+-- metrics for local data sources, e.g. posts per day
+CREATE TABLE IF NOT EXISTS metrics (
+  metric      text,
+  datasource  text,
+  board       text,
+  date        text,
+  count       integer
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS unique_metrics
+  ON metrics (
+    metric,
+    datasource,
+    board,
+    date
+  );
+
+-- up to which timestamp metrics have been calculated
+CREATE TABLE IF NOT EXISTS metrics_watermarks (
+  datasource  text,
+  board       text,
+  metric      text,
+  watermark   integer DEFAULT 0
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS unique_metrics_watermarks
+  ON metrics_watermarks (
+    datasource,
+    board,
+    metric
+  );
+
+-- daily metrics summed per week, month, etc, per board and for all boards
+-- (board '*')
+CREATE TABLE IF NOT EXISTS metrics_rollups (
+  datasource   text,
+  board        text,
+  granularity  text,
+  metric       text,
+  date         text,
+  count        bigint
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS unique_metrics_rollups
+  ON metrics_rollups (
+    datasource,
+    board,
+    granularity,
+    metric,
+    date
+  );
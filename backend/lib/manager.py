@@ -1,12 +1,16 @@
 """
 The heart of the app - manages jobs and workers
 """
+import psycopg2
+import select
 import signal
 import time
+import os
 
 from backend import all_modules
 from backend.lib.keyboard import KeyPoller
-from common.lib.exceptions import JobClaimedException
+from common.lib.database import Database
+from common.lib.job import Job
 
 
 class WorkerManager:
@@ -22,6 +26,23 @@ class WorkerManager:
 	pool = []
 	looping = True
 
+	#: Database connection on which job notifications are received
+	listener = None
+
+	#: Pipe that can be written to to wake up the manager from within the
+	#: backend, e.g. when a worker finishes and a worker slot frees up
+	wake_pipe = None
+
+	#: Maximum amount of seconds to wait between checks for new jobs. New and
+	#: released jobs are announced via the database, and the manager knows
+	#: when timed jobs become claimable, so this is only a fallback.
+	poll_interval = 10
+
+	#: Minimum amount of seconds between updates of the backend's heartbeat,
+	#: which the frontend uses to determine whether the backend is running
+	heartbeat_interval = 10
+	last_heartbeat = 0
+
 	def __init__(self, queue, database, logger, as_daemon=True):
 		"""
 		Initialize manager
@@ -45,6 +66,17 @@ class WorkerManager:
 
 		self.validate_datasources()
 
+		# listen for jobs becoming available, rather than constantly checking
+		# the database for them
+		self.wake_pipe = os.pipe()
+		os.set_blocking(self.wake_pipe[1], False)
+		try:
+			self.listener = Database(logger=self.log, appname="job-listener")
+			self.listener.listen(Job.notify_channel)
+		except psycopg2.Error as e:
+			self.log.warning("Could not listen for job notifications (%s), checking for jobs every second instead" % e)
+			self.listener = None
+
 		# queue a job for the api handler so it will be run
 		self.queue.add_job("api", remote_id="localhost")
 
@@ -63,11 +95,9 @@ class WorkerManager:
 		"""
 		Delegate work
 
-		Checks for open jobs, and then passes those to dedicated workers, if
-		slots are available for those workers.
+		Claims open jobs for which worker slots are available, and passes
+		those to dedicated workers.
 		"""
-		jobs = self.queue.get_all_jobs()
-
 		num_active = sum([len(self.worker_pool[jobtype]) for jobtype in self.worker_pool])
 		self.log.debug("Running workers: %i" % num_active)
 
@@ -81,29 +111,81 @@ class WorkerManager:
 
 			del all_workers
 
-		# check if workers are available for unclaimed jobs
-		for job in jobs:
+		# determine for which known job types there are open worker slots,
+		# and claim as many jobs of those types as there are slots
+		slots = {}
+		for jobtype, worker_class in all_modules.workers.items():
+			if jobtype not in self.worker_pool:
+				self.worker_pool[jobtype] = []
+
+			slots[jobtype] = worker_class.max_workers - len(self.worker_pool[jobtype])
+
+		# start a new worker for each claimed job
+		for job in self.queue.claim_jobs(slots):
 			jobtype = job.data["jobtype"]
+			self.log.debug("Starting new worker for job %s" % jobtype)
+			worker = all_modules.workers[jobtype](logger=self.log, manager=self, job=job, modules=all_modules)
+			worker.start()
+			self.worker_pool[jobtype].append(worker)
+
+	def wait_for_jobs(self):
+		"""
+		Wait until there may be new jobs to delegate
+
+		Returns when a job is added or released (which is announced via a
+		database notification), when a worker finishes, when the next job
+		with a `claim_after` time or interval becomes claimable, or after
+		`poll_interval` seconds, whichever comes first.
+		"""
+		if not self.listener:
+			# no notifications, fall back to frequent polling
+			timeout = 1
+		else:
+			timeout = self.poll_interval
+			next_claim = self.queue.get_next_claim_time()
+			if next_claim is not None:
+				# jobs are claimable *after* the claim time, hence the + 1
+				timeout = max(0, min(timeout, next_claim + 1 - time.time()))
+
+		waitables = [self.wake_pipe[0]]
+		if self.listener:
+			waitables.append(self.listener.connection)
 
-			if jobtype in all_modules.workers:
-				worker_class = all_modules.workers[jobtype]
-				if jobtype not in self.worker_pool:
-					self.worker_pool[jobtype] = []
-
-				# if a job is of a known type, and that job type has open
-				# worker slots, start a new worker to run it
-				if len(self.worker_pool[jobtype]) < worker_class.max_workers:
-					try:
-						self.log.debug("Starting new worker for job %s" % jobtype)
-						job.claim()
-						worker = worker_class(logger=self.log, manager=self, job=job, modules=all_modules)
-						worker.start()
-						self.worker_pool[jobtype].append(worker)
-					except JobClaimedException:
-						# it's fine
-						pass
-
-		time.sleep(1)
+		readable, writable, exceptional = select.select(waitables, [], [], timeout)
+
+		if self.wake_pipe[0] in readable:
+			os.read(self.wake_pipe[0], 1024)
+
+		if self.listener and self.listener.connection in readable:
+			notifications = self.listener.get_notifications()
+			self.log.debug("Woken up by %i job notification(s)" % len(notifications))
+
+	def heartbeat(self):
+		"""
+		Record that the backend is alive
+
+		Updates the backend's row in the `heartbeat` table, at most once every
+		`heartbeat_interval` seconds.
+		"""
+		now = int(time.time())
+		if now - self.last_heartbeat < self.heartbeat_interval:
+			return
+
+		self.db.upsert("heartbeat", data={"component": "backend", "pid": os.getpid(), "timestamp": now},
+					   constraints=("component",))
+		self.last_heartbeat = now
+
+	def wake(self):
+		"""
+		Wake up the manager, to make it check for jobs to delegate
+
+		Can safely be called from other threads.
+		"""
+		try:
+			os.write(self.wake_pipe[1], b"\0")
+		except BlockingIOError:
+			# pipe is full, so the manager will wake up anyway
+			pass
 
 	def loop(self):
 		"""
@@ -115,6 +197,8 @@ class WorkerManager:
 		"""
 		while self.looping:
 			self.delegate()
+			self.heartbeat()
+			self.wait_for_jobs()
 
 		self.log.info("Telling all workers to stop doing whatever they're doing...")
 		for jobtype in self.worker_pool:
@@ -133,6 +217,12 @@ class WorkerManager:
 
 		time.sleep(3)
 
+		if self.listener:
+			self.listener.close()
+
+		# the backend is no longer live
+		self.db.delete("heartbeat", where={"component": "backend"})
+
 		# abort
 		self.log.info("Bye!")
 
@@ -174,6 +264,7 @@ class WorkerManager:
 
 		# now stop looping (i.e. accepting new jobs)
 		self.looping = False
+		self.wake()
 
 	def request_interrupt(self, interrupt_level, job=None, remote_id=None, jobtype=None):
 		"""
@@ -0,0 +1,96 @@
+"""
+Pool of processes shared by all workers
+"""
+import concurrent.futures
+import multiprocessing
+import signal
+
+#: The shared pool, if it has been started
+_pool = None
+
+#: Amount of processes in the shared pool
+_pool_size = 0
+
+
+def start_process_pool(processes):
+	"""
+	Start the shared process pool
+
+	The processes are forked immediately, so this should be called when the
+	backend starts, before any threads are started or database connections
+	are opened. Forking a process that runs multiple threads can leave the
+	child with locks that are held by threads that do not exist in the child
+	(e.g. those of logging handlers), and child processes would otherwise
+	inherit open connections they should not use.
+
+	Since all workers share the same pool, the amount of processes doing
+	parallel work is limited to `processes` regardless of how many
+	processors are running at the same time.
+
+	:param int processes:  Amount of processes to start. With fewer than two
+	  processes, no pool is started and work is done in the workers' own
+	  threads instead.
+	"""
+	global _pool, _pool_size
+
+	if _pool or processes < 2 or "fork" not in multiprocessing.get_all_start_methods():
+		return
+
+	_pool = concurrent.futures.ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("fork"),
+												   initializer=_init_process)
+	_pool_size = processes
+
+	# the executor only starts its processes when the first task is
+	# submitted; make sure that happens now, rather than later, when there
+	# are threads
+	_pool.submit(int).result()
+
+
+def get_process_pool():
+	"""
+	Get the shared process pool
+
+	:return concurrent.futures.ProcessPoolExecutor|None:  The pool, or `None`
+	  if it has not been started or can no longer be used
+	"""
+	return _pool
+
+
+def get_process_pool_size():
+	"""
+	Get the amount of processes in the shared process pool
+
+	:return int:  Amount of processes; 0 if there is no pool
+	"""
+	return _pool_size if _pool else 0
+
+
+def stop_process_pool():
+	"""
+	Stop the shared process pool
+
+	Tasks that are still running are left to finish in the background. Once
+	stopped, the pool is not restarted: new processes would be forked from a
+	process that by then runs multiple threads. Work is done in the workers'
+	own threads instead.
+	"""
+	global _pool, _pool_size
+
+	if not _pool:
+		return
+
+	pool = _pool
+	_pool = None
+	_pool_size = 0
+	pool.shutdown(wait=False)
+
+
+def _init_process():
+	"""
+	Prepare a process in the pool
+
+	Interrupting the backend (e.g. with Ctrl+C in interactive mode) should
+	make the backend shut down, which stops the pool; the pool's processes
+	should not be interrupted themselves.
+	"""
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
@@ -1,3 +1,4 @@
+import threading
 import socket
 import time
 import json
@@ -9,6 +10,13 @@ from backend.abstract.worker import BasicWorker
 class InternalAPI(BasicWorker):
 	"""
 	Offer a local server that listens on a port for API calls and answers them
+
+	Requests and responses are UTF-8 encoded JSON objects, one per line.
+	Clients may keep their connection open and send multiple requests over
+	it; each connection is handled in its own thread, so a slow client does
+	not hold up other callers. Clients that send a single JSON object without
+	a trailing newline (as older clients do) get a response after which the
+	connection is closed.
 	"""
 	type = "api"
 	max_workers = 1
@@ -16,12 +24,22 @@ class InternalAPI(BasicWorker):
 	host = config.API_HOST
 	port = config.API_PORT
 
+	# seconds after which idle connections are closed
+	idle_timeout = 60
+	# maximum size of a single request, in bytes
+	max_request_size = 1024 * 1024
+	# maximum amount of simultaneously open connections
+	max_connections = 64
+
+	connections = None
+	db_lock = None
+
 	def work(self):
 		"""
 		Listen for API requests
 
 		Opens a socket that continuously listens for requests, and passes a
-		client object on to a handling method if a connection is established
+		client object on to a handling thread if a connection is established
 
 		:return:
 		"""
@@ -58,84 +76,154 @@ class InternalAPI(BasicWorker):
 				self.manager.log.error("OS refused listening at port %i! Local API not available." % self.port)
 				return
 
-		server.listen(5)
-		server.settimeout(5)
+		server.listen(self.max_connections)
+		server.settimeout(1)
 		self.manager.log.info("Local API listening for requests at %s:%s" % (self.host, self.port))
 
+		# the database connection is shared between connection handlers, and
+		# psycopg2 cursors are not thread-safe
+		self.db_lock = threading.Lock()
+		self.connections = threading.BoundedSemaphore(self.max_connections)
+		handlers = []
+
 		# continually listen for new connections
 		while not self.interrupted:
 			try:
 				client, address = server.accept()
 			except (socket.timeout, TimeoutError) as e:
-				if self.interrupted:
-					break
 				# no problemo, just listen again - this only times out so it won't hang the entire app when
 				# trying to exit, as there's no other way to easily interrupt accept()
+				handlers = [handler for handler in handlers if handler.is_alive()]
 				continue
 
-			self.api_response(client, address)
-			client.close()
+			if not self.connections.acquire(blocking=False):
+				self.manager.log.warning("Too many open connections to local API, refusing connection from %s:%s" % address)
+				client.close()
+				continue
+
+			handler = threading.Thread(target=self.handle_connection, args=(client, address), daemon=True)
+			handler.start()
+			handlers.append(handler)
 
 		self.manager.log.info("Shutting down local API server")
+		server.close()
 
-	def api_response(self, client, address):
+		# handlers check for the interrupt at least once per second
+		for handler in handlers:
+			handler.join(timeout=5)
+
+	def handle_connection(self, client, address):
 		"""
-		Respond to API requests
+		Handle a client connection
 
-		Gets the request, parses it as JSON, and if it is indeed JSON and of
-		the proper format, a response is generated and returned as JSON via
-		the client object
+		Reads requests from the connection and answers them, until the client
+		closes the connection, it has been idle for too long, or the API is
+		shut down.
 
 		:param client:  Client object representing the connection
-		:param tuple address:  (IP, port) of the request
-		:return: Response
+		:param tuple address:  (IP, port) of the client
 		"""
-		client.settimeout(2)  # should be plenty
+		client.settimeout(1)
+		buffer = b""
+		idle_since = time.time()
 
 		try:
-			buffer = ""
-			while True:
-				# receive data in 1k chunks
+			while not self.interrupted:
+				# answer all complete requests received so far
+				while b"\n" in buffer:
+					line, buffer = buffer.split(b"\n", 1)
+					if line.strip():
+						self.api_response(client, address, line)
+						idle_since = time.time()
+
 				try:
-					data = client.recv(1024).decode("ascii")
-				except UnicodeDecodeError:
-					raise InternalAPIException
+					data = client.recv(4096)
+				except (socket.timeout, TimeoutError):
+					if time.time() - idle_since > self.idle_timeout:
+						break
+					continue
+
+				if not data:
+					# client closed the connection, but may have sent a
+					# request without a newline before that
+					if buffer.strip():
+						self.api_response(client, address, buffer)
+					break
 
 				buffer += data
-				if not data or data.strip() == "" or len(data) > 2048:
+				if len(buffer) > self.max_request_size and b"\n" not in buffer:
+					self.manager.log.info("Oversized API request from %s:%s - closing" % address)
+					self.send(client, {"error": "Request too large"})
 					break
 
-				# start processing as soon as we have valid json
-				try:
-					test = json.loads(buffer)
+				if b"\n" not in buffer and self.is_complete(buffer):
+					# a complete request without a newline - this is what
+					# older clients send, and they wait for the connection
+					# to be closed after the response
+					self.api_response(client, address, buffer)
 					break
-				except json.JSONDecodeError:
-					pass
+		except (BrokenPipeError, ConnectionError, OSError):
+			pass
+		finally:
+			try:
+				client.close()
+			except OSError:
+				pass
+			self.connections.release()
 
-			if not buffer:
-				raise InternalAPIException
-		except (socket.timeout, TimeoutError, ConnectionError, InternalAPIException):
-			# this means that no valid request was sent
-			self.manager.log.info("No input on API call from %s:%s - closing" % address)
+	@staticmethod
+	def is_complete(buffer):
+		"""
+		Check if a buffer contains a complete JSON request
+
+		:param bytes buffer:  Received data
+		:return bool:  Whether the buffer can be parsed as a JSON object
+		"""
+		try:
+			return isinstance(json.loads(buffer.decode("utf-8")), dict)
+		except (UnicodeDecodeError, json.JSONDecodeError):
 			return False
 
+	def api_response(self, client, address, request):
+		"""
+		Respond to API requests
+
+		Parses the request as JSON, and if it is indeed JSON and of the proper
+		format, a response is generated and returned as JSON via the client
+		object
+
+		:param client:  Client object representing the connection
+		:param tuple address:  (IP, port) of the request
+		:param bytes request:  Request, as received
+		:return: Response
+		"""
 		self.manager.log.debug("Received API request from %s:%s" % address)
 
 		try:
-			payload = json.loads(buffer)
-			if "request" not in payload:
+			payload = json.loads(request.decode("utf-8"))
+			if not isinstance(payload, dict) or "request" not in payload:
 				raise InternalAPIException
 
 			response = self.process_request(payload["request"], payload)
 			if not response:
 				raise InternalAPIException
 
-			response = json.dumps({"error": False, "response": response})
-		except (json.JSONDecodeError, InternalAPIException):
-			response = json.dumps({"error": "Invalid JSON"})
+			response = {"error": False, "response": response}
+		except (UnicodeDecodeError, json.JSONDecodeError, InternalAPIException):
+			response = {"error": "Invalid JSON"}
+
+		return self.send(client, response)
 
+	def send(self, client, response):
+		"""
+		Send a response to a client
+
+		:param client:  Client object representing the connection
+		:param dict response:  Response to send, will be encoded as JSON
+		:return:  Response, or `None` if it could not be sent
+		"""
 		try:
-			response = client.sendall(response.encode("ascii"))
+			client.sendall(json.dumps(response).encode("utf-8") + b"\n")
 		except (BrokenPipeError, ConnectionError, socket.timeout):
 			response = None
 
@@ -174,7 +262,8 @@ class InternalAPI(BasicWorker):
 
 		if request == "jobs":
 			# return queued jobs, sorted by type
-			jobs = self.db.fetchall("SELECT * FROM jobs")
+			with self.db_lock:
+				jobs = self.db.fetchall("SELECT * FROM jobs")
 			if jobs is None:
 				return {"error": "Database unavailable"}
 
@@ -193,7 +282,8 @@ class InternalAPI(BasicWorker):
 			week = 86400 * 7
 			now = int(time.time())
 
-			items = self.db.fetchall("SELECT * FROM datasets WHERE timestamp > %s ORDER BY timestamp ASC", (now - week,))
+			with self.db_lock:
+				items = self.db.fetchall("SELECT * FROM datasets WHERE timestamp > %s ORDER BY timestamp ASC", (now - week,))
 
 			response = {
 				"1h": 0,
@@ -215,7 +305,8 @@ class InternalAPI(BasicWorker):
 			# all jobs plus, for those that are currently active, some worker
 			# info as well as related datasets. useful to monitor server
 			# activity and judge whether 4CAT can safely be interrupted
-			open_jobs = self.db.fetchall("SELECT jobtype, timestamp, timestamp_claimed, timestamp_lastclaimed, interval, remote_id FROM jobs ORDER BY jobtype ASC, timestamp ASC, remote_id ASC")
+			with self.db_lock:
+				open_jobs = self.db.fetchall("SELECT jobtype, timestamp, timestamp_claimed, timestamp_lastclaimed, interval, remote_id FROM jobs ORDER BY jobtype ASC, timestamp ASC, remote_id ASC")
 			running = []
 			queue = {}
 
@@ -3,132 +3,233 @@ Save metrics for local datasources.
 This is used for both processors (e.g. to calculate relative )
 and to show how many posts a local datasource contains.
 """
+import datetime
+import time
 
-from datetime import datetime, time, timezone
+from psycopg2 import sql
 
 from backend.abstract.worker import BasicWorker
-from common.lib.dataset import DataSet
 
-import config
 
 class DatasourceMetrics(BasicWorker):
 	"""
 	Calculate metrics for local datasources
 
 	This will be stored in a separate PostgreSQL table.
+
+	Metrics are calculated incrementally: for each combination of data
+	source, board and metric, a watermark is stored that marks up to which
+	point in time the metric has been calculated. Each run only counts posts
+	after the earliest watermark for the data source, with one grouped query
+	per metric that covers all boards at once. Only complete intervals (e.g.
+	days before the current one) are counted.
 	"""
 	type = "datasource-metrics"
 	max_workers = 1
 
+	# Metrics to calculate. 'interval' is the length of the intervals counted
+	# per, 'value' the aggregate SQL expression that is calculated per
+	# interval, and 'columns' the columns the posts table needs to have for
+	# the metric to be calculated. Daily metrics that can be summed may have
+	# 'rollups' calculated, see update_rollups()
+	metrics = {
+		"posts_per_day": {
+			"interval": "day",
+			"value": "COUNT(*)",
+			"columns": (),
+			"rollups": True
+		},
+		"posts_per_hour": {
+			"interval": "hour",
+			"value": "COUNT(*)",
+			"columns": ()
+		},
+		"unique_authors_per_day": {
+			"interval": "day",
+			"value": "COUNT(DISTINCT author)",
+			"columns": ("author",)
+		}
+	}
+
+	# length (in seconds) and date format per interval
+	intervals = {
+		"day": (86400, "YYYY-MM-DD"),
+		"hour": (3600, "YYYY-MM-DD HH24:00")
+	}
+
+	# granularities rollups are calculated for, and their date format. These
+	# match the interval descriptors of get_interval_descriptor()
+	rollups = {
+		"day": "YYYY-MM-DD",
+		"week": "IYYY-IW",
+		"month": "YYYY-MM",
+		"year": "YYYY",
+		"all": None
+	}
+
 	def work(self):
 		"""
-		Go through all local datasources, and update the posts per day
-		if they haven't been calculated yet. These data can then be used
-		to calculate e.g. posts per month.
+		Go through all local datasources, and update their metrics for the
+		intervals that haven't been calculated yet. These data can then be
+		used to calculate e.g. posts per month.
+
 		:return:
 		"""
-
-		# Get a list of all database tables
 		all_tables = [row["tablename"] for row in self.db.fetchall("SELECT tablename FROM pg_catalog.pg_tables WHERE schemaname != 'pg_catalog' AND schemaname != 'information_schema';")]
 
-		# Check if the metrics table is already present
-		metrics_exists = True if "metrics" in all_tables else False
-
-		# If not, make it.
-		if not metrics_exists:
-			self.db.execute("""
-				CREATE TABLE IF NOT EXISTS metrics (
-				  metric             text,
-				  datasource         text,
-				  board              text,
-				  date               text,
-				  count              integer
-				);
+		for datasource_id in self.all_modules.datasources:
+			datasource = self.all_modules.datasources[datasource_id]
 
-			""")
+			# Only update local datasources
+			if not datasource.get("is_local"):
+				continue
 
-		added_datasources = [row["datasource"] for row in self.db.fetchall("SELECT DISTINCT(datasource) FROM metrics")]
+			# Get the name of the posts table for this datasource
+			posts_table = datasource_id if "posts_" + datasource_id not in all_tables else "posts_" + datasource_id
+			columns = [row["column_name"] for row in self.db.fetchall(
+				"SELECT column_name FROM information_schema.columns WHERE table_name = %s", (posts_table,))]
 
-		for datasource_id in self.all_modules.datasources:
+			for metric, definition in self.metrics.items():
+				if self.interrupted:
+					return
 
-			datasource = self.all_modules.datasources[datasource_id]
+				if not all([column in columns for column in definition["columns"]]):
+					continue
 
-			# Only update local datasources
-			if datasource.get("is_local"):
-
-				boards = config.DATASOURCES[datasource_id].get("boards")
-
-				if not boards:
-					boards = [""]
-				
-				# If a datasource is static (so not updated) and it
-				# is already present in the metrics table, we don't
-				# need to update its metrics anymore.
-				if datasource.get("is_static") and datasource_id in added_datasources:
-						continue
-				else:
-
-					# -------------------------
-					#   Posts per day metric
-					# -------------------------
-
-					# Get the name of the posts table for this datasource
-					posts_table = datasource_id if "posts_" + datasource_id not in all_tables else "posts_" + datasource_id
-
-					# Count and update for every board individually
-					for board in boards:
-
-						if not board:
-							board_sql = " board = '' OR board = NULL"
-						else:
-							board_sql = " board='" + board + "'"
-
-						# Midnight of this day in UTC epoch timestamp
-						midnight = int(datetime.combine(datetime.today(), time.min).replace(tzinfo=timezone.utc).timestamp())
-
-						# We only count passed days
-						time_sql = "timestamp < " + str(midnight)
-
-						# If the datasource is dynamic, we also only update days
-						# that haven't been added yet - these are heavy queries.
-						if not datasource.get("is_static"):
-							
-							days_added = self.db.fetchall("SELECT date FROM metrics WHERE datasource = '%s' AND board = '%s' AND metric = 'posts_per_day';" % (datasource_id, board))
-
-							if days_added:
-
-								last_day_added = max([row["date"] for row in days_added])
-								last_day_added = datetime.strptime(last_day_added, '%Y-%m-%d').replace(tzinfo=timezone.utc)
-
-								# If the last day added is today, there's no need to update yet
-								if last_day_added.date() == datetime.today().replace(tzinfo=timezone.utc).date():
-									self.log.info("No new posts per day to count for %s%s" % (datasource_id, "/" + board))
-									continue
-
-								# Change to UTC epoch timestamp for postgres query
-								after_timestamp = int(last_day_added.timestamp())
-
-								time_sql += " AND timestamp > " + str(after_timestamp) + " "
-						
-						self.log.info("Calculating metric posts_per_day for datasource %s%s" % (datasource_id, "/" + board))
-
-						# Get those counts
-						query = """
-							SELECT 'posts_per_day' AS metric, '%s' AS datasource, board, to_char(to_timestamp(timestamp), 'YYYY-MM-DD') AS date, count(*)COUNT
-							FROM %s
-							WHERE %s AND %s
-							GROUP BY metric, datasource, board, date;
-							""" % (datasource_id, posts_table, board_sql, time_sql)
-						
-						# Add to metrics table
-						rows = [dict(row) for row in self.db.fetchall(query)]
-						
-						if rows:
-							for row in rows:
-								self.db.insert("metrics", row)
-
-					# -------------------------------
-					#   no other metrics added yet 
-					# -------------------------------
+				self.update_metric(datasource_id, posts_table, "board" in columns, metric, definition,
+								   is_static=datasource.get("is_static"))
 
 		self.job.finish()
+
+	def update_metric(self, datasource_id, posts_table, has_boards, metric, definition, is_static=False):
+		"""
+		Calculate a metric for all boards of a data source
+
+		:param str datasource_id:  Data source ID
+		:param str posts_table:  Name of the table containing the data source's
+		posts
+		:param bool has_boards:  Whether the posts table has a `board` column
+		:param str metric:  Metric name
+		:param dict definition:  Metric definition, see `metrics`
+		:param bool is_static:  Whether the data source is static, i.e. not
+		updated. Metrics for static data sources are only calculated once.
+		"""
+		watermarks = self.db.fetchall("SELECT board, watermark FROM metrics_watermarks WHERE datasource = %s AND metric = %s",
+									  (datasource_id, metric))
+
+		# Rollups need to be calculated from scratch if there are none yet,
+		# e.g. because the metric was calculated before they were introduced
+		rollups_missing = definition.get("rollups") and not self.db.fetchone(
+			"SELECT metric FROM metrics_rollups WHERE datasource = %s AND metric = %s LIMIT 1", (datasource_id, metric))
+
+		# If a datasource is static (so not updated) and its metrics have
+		# been calculated, we don't need to update them anymore.
+		if is_static and watermarks and not rollups_missing:
+			return
+
+		# We only count passed intervals, and only intervals that haven't
+		# been counted yet
+		interval_length, _ = self.intervals[definition["interval"]]
+		now = int(time.time())
+		until = now - (now % interval_length)
+		since = min([row["watermark"] for row in watermarks]) if watermarks else 0
+
+		has_new_intervals = since < until and not (is_static and watermarks)
+		if has_new_intervals:
+			self.log.info("Calculating metric %s for datasource %s" % (metric, datasource_id))
+			self.count_metric(datasource_id, posts_table, has_boards, metric, definition, watermarks, since, until)
+		else:
+			self.log.info("No new intervals to count for metric %s for datasource %s" % (metric, datasource_id))
+
+		if definition.get("rollups") and (has_new_intervals or rollups_missing):
+			self.log.info("Updating rollups of metric %s for datasource %s" % (metric, datasource_id))
+			self.update_rollups(datasource_id, metric, 0 if rollups_missing else since)
+
+		self.db.commit()
+
+	def count_metric(self, datasource_id, posts_table, has_boards, metric, definition, watermarks, since, until):
+		"""
+		Count a metric for all boards of a data source within a time window
+
+		The results are stored in the `metrics` table, and the watermarks of
+		all boards are moved to the end of the time window. Changes are not
+		committed.
+
+		:param str datasource_id:  Data source ID
+		:param str posts_table:  Name of the table containing the data source's
+		posts
+		:param bool has_boards:  Whether the posts table has a `board` column
+		:param str metric:  Metric name
+		:param dict definition:  Metric definition, see `metrics`
+		:param list watermarks:  Current watermarks for the metric
+		:param int since:  Start of time window (inclusive)
+		:param int until:  End of time window (exclusive)
+		"""
+		_, date_format = self.intervals[definition["interval"]]
+		board = sql.SQL("COALESCE(board, '')") if has_boards else sql.Literal("")
+		query = sql.SQL(
+			"SELECT {board} AS board, to_char(to_timestamp(timestamp) AT TIME ZONE 'UTC', %s) AS date, "
+			+ definition["value"] + " AS count"
+			"  FROM {table}"
+			" WHERE timestamp >= %s AND timestamp < %s"
+			" GROUP BY 1, 2").format(board=board, table=sql.Identifier(posts_table))
+
+		rows = self.db.fetchall(query, (date_format, since, until))
+
+		self.db.upsert_many("metrics", [{
+			"metric": metric,
+			"datasource": datasource_id,
+			"board": row["board"],
+			"date": row["date"],
+			"count": row["count"]
+		} for row in rows], commit=False, constraints=("metric", "datasource", "board", "date"))
+
+		# Move the watermarks of all boards, including boards that had no
+		# posts in this period
+		boards = set([row["board"] for row in rows]) | set([row["board"] for row in watermarks])
+		self.db.upsert_many("metrics_watermarks", [{
+			"datasource": datasource_id,
+			"board": board,
+			"metric": metric,
+			"watermark": until
+		} for board in boards], commit=False, constraints=("datasource", "board", "metric"))
+
+	def update_rollups(self, datasource_id, metric, since):
+		"""
+		Update rollups of a daily metric
+
+		Sums the daily values of the metric per week, month, year and overall,
+		per board and across all boards (with board `*`), and stores these in
+		the `metrics_rollups` table, so they can be retrieved without
+		aggregating daily values. Only periods that contain days on or after
+		`since` are recalculated. Changes are not committed.
+
+		:param str datasource_id:  Data source ID
+		:param str metric:  Metric name
+		:param int since:  Timestamp from which daily values have changed
+		"""
+		since = datetime.datetime.fromtimestamp(since, tz=datetime.timezone.utc).date()
+
+		for granularity, date_format in self.rollups.items():
+			# periods are recalculated as a whole, so start at the first day
+			# of the period that contains the first changed day
+			if granularity == "day":
+				start = since
+			elif granularity == "week":
+				start = since - datetime.timedelta(days=since.weekday())
+			elif granularity == "month":
+				start = since.replace(day=1)
+			elif granularity == "year":
+				start = since.replace(month=1, day=1)
+			else:
+				start = datetime.date(1, 1, 1)
+
+			period = sql.SQL("to_char(to_date(date, 'YYYY-MM-DD'), {})").format(sql.Literal(date_format)) if date_format else sql.Literal("all")
+			self.db.query(sql.SQL(
+				"INSERT INTO metrics_rollups (datasource, board, granularity, metric, date, count)"
+				"     SELECT datasource, CASE WHEN GROUPING(board) = 1 THEN '*' ELSE board END, %s, metric, period, SUM(count)"
+				"       FROM (SELECT datasource, board, metric, {period} AS period, count FROM metrics"
+				"              WHERE datasource = %s AND metric = %s AND date >= %s) AS days"
+				"   GROUP BY datasource, metric, GROUPING SETS ((board, period), (period))"
+				" ON CONFLICT (datasource, board, granularity, metric, date) DO UPDATE SET count = EXCLUDED.count"
+			).format(period=period), (granularity, datasource_id, metric, start.isoformat()))
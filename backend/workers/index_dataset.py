@@ -0,0 +1,35 @@
+"""
+Build an index for a dataset's result file
+"""
+from backend.abstract.worker import BasicWorker
+from common.lib.dataset import DataSet
+
+
+class DatasetIndexer(BasicWorker):
+	"""
+	Build an index for a dataset's result file
+
+	Datasets are indexed when they are finished, but small result files and
+	datasets created before indexes existed have none. Indexing a large file
+	means reading all of it, which is done here rather than in e.g. a web
+	request that needs the index.
+	"""
+	type = "index-dataset"
+	max_workers = 1
+
+	def work(self):
+		"""
+		Build the index, if the dataset does not have one yet
+		"""
+		try:
+			dataset = DataSet(key=self.job.data["remote_id"], db=self.db)
+		except TypeError:
+			# dataset was deleted in the meantime
+			self.job.finish()
+			return
+
+		if dataset.is_finished() and not dataset.get_index():
+			self.log.info("Building index for dataset %s" % dataset.key)
+			dataset.build_index()
+
+		self.job.finish()
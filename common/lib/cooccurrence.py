@@ -0,0 +1,500 @@
+"""
+Accumulate co-occurrence networks with a small memory footprint
+"""
+import array
+
+import networkx as nx
+import numpy as np
+
+from common.lib.network_writer import NetworkWriter
+
+
+class CooccurrenceNetwork:
+	"""
+	Weighted co-occurrence network
+
+	Rather than building a NetworkX graph edge by edge, which takes up a lot
+	of memory and time for large networks, node labels are mapped to integer
+	IDs and edges are stored as pairs of IDs in NumPy arrays. This is
+	essentially a sparse adjacency matrix; for undirected networks only the
+	upper triangle is stored. Edges are buffered and periodically merged, at
+	which point the weights of identical edges are summed.
+
+	Edges can be recorded per interval (e.g. per month) to make dynamic
+	networks. Once all edges have been added, the network can be read with
+	`nodes()` and `edges()`, written to a file with `write()`, or turned into
+	a NetworkX graph with `to_networkx()`. Only nodes that are part of at
+	least one edge are included. Large networks can be made smaller with
+	`prune()` first.
+
+	.. code-block:: python
+
+		network = CooccurrenceNetwork()
+		for post in posts:
+			network.add_clique([network.add_node(tag) for tag in post["tags"]])
+
+		network.write(path)
+	"""
+	#: Whether edges are directed
+	directed = False
+
+	#: Whether edges from a node to itself are recorded
+	allow_loops = False
+
+	#: Amount of buffered edges at which they are merged
+	buffer_size = 1000000
+
+	#: Maximum amount of nodes to calculate a layout for when writing the
+	#: network to a file
+	max_layout_nodes = 500000
+
+	def __init__(self, directed=False, allow_loops=False, buffer_size=None):
+		"""
+		Set up network
+
+		:param bool directed:  Whether edges are directed
+		:param bool allow_loops:  Whether edges from a node to itself are
+		  recorded
+		:param int buffer_size:  Amount of buffered edges at which they are
+		  merged
+		"""
+		self.directed = directed
+		self.allow_loops = allow_loops
+		if buffer_size:
+			self.buffer_size = buffer_size
+
+		self.node_ids = {}
+		self.node_keys = []
+		self.node_attributes = []
+
+		self.interval_ids = {}
+		self.interval_labels = []
+
+		# per interval, a sorted array of edges and an array of their weights
+		# edges are stored as 64-bit integers, with the ID of the source node
+		# in the upper and the ID of the target node in the lower 32 bits
+		self.edges_per_interval = {}
+		self.buffer = {}
+		self.buffered = 0
+		self.node_weights = None
+
+	@property
+	def num_nodes(self):
+		"""
+		Amount of nodes added so far, including nodes without edges
+
+		:return int:
+		"""
+		return len(self.node_keys)
+
+	@property
+	def num_edges(self):
+		"""
+		Amount of unique edges
+
+		:return int:
+		"""
+		self.merge()
+		return len(np.unique(np.concatenate([edges for edges, weights in self.edges_per_interval.values()]))) \
+			if self.edges_per_interval else 0
+
+	def add_node(self, key, **attributes):
+		"""
+		Get the ID of a node, adding it if it does not exist yet
+
+		:param str key:  Node key, e.g. the tag or URL the node represents
+		:param attributes:  Node attributes, e.g. `label`. Only used when the
+		  node is added; attributes of existing nodes are not updated.
+		:return int:  Node ID
+		"""
+		if key not in self.node_ids:
+			self.node_ids[key] = len(self.node_keys)
+			self.node_keys.append(key)
+			self.node_attributes.append(attributes)
+
+		return self.node_ids[key]
+
+	def add_clique(self, nodes, interval="overall"):
+		"""
+		Add edges between all nodes that co-occur, e.g. in the same post
+
+		Each pair of different nodes is added once, regardless of how often
+		the nodes occur in `nodes`. Edges are undirected.
+
+		:param list nodes:  Node IDs, as returned by `add_node()`
+		:param str interval:  Interval the nodes co-occur in
+		"""
+		nodes = np.unique(np.asarray(nodes, dtype=np.uint64))
+		if len(nodes) < 2 and not self.allow_loops:
+			return
+
+		sources, targets = np.triu_indices(len(nodes), k=0 if self.allow_loops else 1)
+		self.add_pairs(nodes[sources], nodes[targets], interval)
+
+	def add_edges(self, sources, targets, interval="overall"):
+		"""
+		Add edges from each of a number of nodes to each of another
+
+		:param list sources:  Node IDs of edge sources
+		:param list targets:  Node IDs of edge targets
+		:param str interval:  Interval the edges occur in
+		"""
+		sources = np.asarray(sources, dtype=np.uint64)
+		targets = np.asarray(targets, dtype=np.uint64)
+		sources, targets = np.repeat(sources, len(targets)), np.tile(targets, len(sources))
+
+		if not self.directed:
+			sources, targets = np.minimum(sources, targets), np.maximum(sources, targets)
+
+		if not self.allow_loops:
+			different = sources != targets
+			sources, targets = sources[different], targets[different]
+
+		self.add_pairs(sources, targets, interval)
+
+	def add_pairs(self, sources, targets, interval):
+		"""
+		Buffer edges
+
+		:param np.ndarray sources:  Node IDs of edge sources
+		:param np.ndarray targets:  Node IDs of edge targets
+		:param str interval:  Interval the edges occur in
+		"""
+		if not len(sources):
+			return
+
+		if interval not in self.interval_ids:
+			self.interval_ids[interval] = len(self.interval_labels)
+			self.interval_labels.append(interval)
+
+		interval_id = self.interval_ids[interval]
+		if interval_id not in self.buffer:
+			self.buffer[interval_id] = array.array("Q")
+
+		self.buffer[interval_id].frombytes(((sources << np.uint64(32)) | targets).astype(np.uint64).tobytes())
+		self.buffered += len(sources)
+
+		if self.buffered >= self.buffer_size:
+			self.merge()
+
+	def merge(self):
+		"""
+		Merge buffered edges with the stored edges, summing their weights
+		"""
+		if self.buffer:
+			self.node_weights = None
+
+		for interval_id, buffered in self.buffer.items():
+			edges, weights = self.edges_per_interval.get(interval_id, (np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.uint64)))
+			new_edges = np.frombuffer(buffered, dtype=np.uint64)
+
+			edges, index = np.unique(np.concatenate((edges, new_edges)), return_inverse=True)
+			weights = np.bincount(index.ravel(), weights=np.concatenate((weights, np.ones(len(new_edges), dtype=np.uint64))),
+								  minlength=len(edges)).astype(np.uint64)
+
+			self.edges_per_interval[interval_id] = (edges, weights)
+
+		self.buffer = {}
+		self.buffered = 0
+
+	def get_node_weights(self):
+		"""
+		Get the weight of each node per interval
+
+		The weight of a node is the sum of the weights of its edges, with
+		loops counted twice. Weights are calculated once and not updated
+		after pruning, so they reflect the full network.
+
+		:return dict:  Per interval ID, an array with the weight per node ID
+		"""
+		self.merge()
+
+		if self.node_weights is None:
+			self.node_weights = {}
+			for interval_id, (edges, weights) in self.edges_per_interval.items():
+				self.node_weights[interval_id] = (
+					np.bincount((edges >> np.uint64(32)).astype(np.int64), weights=weights, minlength=self.num_nodes) +
+					np.bincount((edges & np.uint64(0xFFFFFFFF)).astype(np.int64), weights=weights, minlength=self.num_nodes)
+				).astype(np.uint64)
+
+		return self.node_weights
+
+	def get_edge_weights(self):
+		"""
+		Get all edges and their weights, combined over intervals
+
+		:return tuple:  Sorted array of unique edges, their total weights, and
+		  for each stored (edge, interval) combination the index of the edge
+		  in the array of unique edges, the interval ID and its weight
+		"""
+		self.merge()
+
+		if not self.edges_per_interval:
+			empty = np.zeros(0, dtype=np.uint64)
+			return empty, empty, empty.astype(np.int64), empty.astype(np.int64), empty
+
+		all_edges = np.concatenate([edges for edges, weights in self.edges_per_interval.values()])
+		unique_edges, index = np.unique(all_edges, return_inverse=True)
+		index = index.ravel()
+		interval_ids = np.concatenate([np.full(len(edges), interval_id) for interval_id, (edges, weights) in self.edges_per_interval.items()])
+		interval_weights = np.concatenate([weights for edges, weights in self.edges_per_interval.values()])
+		total_weights = np.bincount(index, weights=interval_weights, minlength=len(unique_edges)).astype(np.uint64)
+
+		return unique_edges, total_weights, index, interval_ids, interval_weights
+
+	def nodes(self):
+		"""
+		Get nodes that are part of at least one edge
+
+		:return generator:  Yields (key, attributes, weight, weight per
+		  interval) tuples
+		"""
+		weights_per_interval = self.get_node_weights()
+		total_weights = sum(weights_per_interval.values()) if weights_per_interval else np.zeros(self.num_nodes, dtype=np.uint64)
+
+		edges, _, _, _, _ = self.get_edge_weights()
+		for node_id in np.unique(np.concatenate((edges >> np.uint64(32), edges & np.uint64(0xFFFFFFFF)))):
+			node_id = int(node_id)
+			yield (
+				self.node_keys[node_id],
+				self.node_attributes[node_id],
+				int(total_weights[node_id]),
+				{self.interval_labels[interval_id]: int(weights[node_id]) for interval_id, weights in
+				 weights_per_interval.items() if weights[node_id]}
+			)
+
+	def edges(self):
+		"""
+		Get edges
+
+		:return generator:  Yields (source key, target key, weight, weight per
+		  interval) tuples
+		"""
+		unique_edges, total_weights, index, interval_ids, interval_weights = self.get_edge_weights()
+
+		# sort by edge, so the intervals per edge are consecutive
+		order = np.argsort(index, kind="stable")
+		boundaries = np.searchsorted(index[order], np.arange(len(unique_edges) + 1))
+
+		for edge_index, edge in enumerate(unique_edges):
+			edge = int(edge)
+			intervals = order[boundaries[edge_index]:boundaries[edge_index + 1]]
+			yield (
+				self.node_keys[edge >> 32],
+				self.node_keys[edge & 0xFFFFFFFF],
+				int(total_weights[edge_index]),
+				{self.interval_labels[interval_ids[i]]: int(interval_weights[i]) for i in intervals}
+			)
+
+	def prune(self, min_weight=None, max_edges_per_node=None, k_core=None):
+		"""
+		Remove edges to make the network smaller
+
+		Edges are removed in the following order, with each step applied to
+		the edges that remain after the previous:
+
+		- Edges with a weight (over all intervals) lower than `min_weight`
+		- Edges that are not among the `max_edges_per_node` heaviest edges of
+		  either of their nodes
+		- Edges of nodes that are not in the `k_core`-core of the network,
+		  i.e. the largest subnetwork in which all nodes have at least
+		  `k_core` neighbours
+
+		Nodes without remaining edges are no longer included in the network.
+
+		:param int min_weight:  Minimum edge weight
+		:param int max_edges_per_node:  Maximum amount of edges per node
+		:param int k_core:  Minimum amount of neighbours per node
+		:return int:  Amount of edges removed
+		"""
+		# make sure node weights reflect the full network
+		self.get_node_weights()
+
+		edges, weights, _, _, _ = self.get_edge_weights()
+		sources = (edges >> np.uint64(32)).astype(np.int64)
+		targets = (edges & np.uint64(0xFFFFFFFF)).astype(np.int64)
+		keep = np.ones(len(edges), dtype=bool)
+
+		if min_weight:
+			keep &= weights >= min_weight
+
+		if max_edges_per_node:
+			# list each edge once for both of its nodes, and rank the edges
+			# per node by weight, heaviest first
+			candidates = np.flatnonzero(keep)
+			nodes = np.concatenate((sources[candidates], targets[candidates]))
+			edge_index = np.tile(np.arange(len(candidates)), 2)
+			order = np.lexsort((-np.tile(weights[candidates].astype(np.int64), 2), nodes))
+			sorted_nodes = nodes[order]
+			rank = np.arange(len(order)) - np.searchsorted(sorted_nodes, sorted_nodes)
+
+			is_top = np.zeros(len(candidates), dtype=bool)
+			is_top[edge_index[order[rank < max_edges_per_node]]] = True
+			keep[candidates[~is_top]] = False
+
+		if k_core:
+			while True:
+				candidates = np.flatnonzero(keep)
+				candidate_sources = sources[candidates]
+				candidate_targets = targets[candidates]
+				not_loop = candidate_sources != candidate_targets
+				degree = np.bincount(candidate_sources[not_loop], minlength=self.num_nodes) + \
+						 np.bincount(candidate_targets[not_loop], minlength=self.num_nodes)
+
+				outside_core = (degree[candidate_sources] < k_core) | (degree[candidate_targets] < k_core)
+				if not outside_core.any():
+					break
+
+				keep[candidates[outside_core]] = False
+
+		kept = edges[keep]
+		for interval_id, (interval_edges, interval_weights) in self.edges_per_interval.items():
+			kept_in_interval = np.isin(interval_edges, kept, assume_unique=True)
+			self.edges_per_interval[interval_id] = (interval_edges[kept_in_interval], interval_weights[kept_in_interval])
+
+		return int(len(edges) - len(kept))
+
+	def layout(self, iterations=50, seed=None):
+		"""
+		Calculate a layout for the network
+
+		See `force_layout()`.
+
+		:param int iterations:  Amount of iterations
+		:param int seed:  Seed for the random initial positions
+		:return np.ndarray:  Array with an (x, y) position per node ID
+		"""
+		edges, weights, _, _, _ = self.get_edge_weights()
+		return force_layout(self.num_nodes, (edges >> np.uint64(32)).astype(np.int64),
+							(edges & np.uint64(0xFFFFFFFF)).astype(np.int64), weights, iterations=iterations, seed=seed)
+
+	def write(self, path, layout=True, interval_attributes=None, **graph_attributes):
+		"""
+		Write the network to a GEXF or GraphML file
+
+		Nodes and edges get a `weight` attribute, and nodes are sized by their
+		weight. Uses a `NetworkWriter`, so the network does not need to be
+		converted to a NetworkX graph first.
+
+		:param Path path:  File to write to
+		:param bool layout:  Calculate a layout and save node positions; not
+		  done for networks with more than `max_layout_nodes` nodes
+		:param callable interval_attributes:  Optional; function that is
+		  called with the weights per interval of each node and edge, and
+		  returns a dictionary of additional attributes for it, e.g. to make
+		  a dynamic network
+		:param graph_attributes:  Attributes of the graph
+		:return int:  Amount of nodes written
+		"""
+		positions = self.layout() if layout and self.num_nodes <= self.max_layout_nodes else None
+
+		with NetworkWriter(path, directed=self.directed, graph_attributes=graph_attributes) as writer:
+			for key, attributes, weight, intervals in self.nodes():
+				viz = {"size": weight}
+				if positions is not None:
+					x, y = positions[self.node_ids[key]]
+					viz["position"] = {"x": round(float(x), 2), "y": round(float(y), 2)}
+
+				writer.add_node(key, **attributes, weight=weight, viz=viz,
+								**(interval_attributes(intervals) if interval_attributes else {}))
+
+			for source, target, weight, intervals in self.edges():
+				writer.add_edge(source, target, weight=weight,
+								**(interval_attributes(intervals) if interval_attributes else {}))
+
+		return writer.num_nodes
+
+	def to_networkx(self, dynamic=False, **graph_attributes):
+		"""
+		Create a NetworkX graph of the network
+
+		Nodes and edges get a `weight` attribute. For dynamic networks, they
+		also get an `intervals` attribute with the weight per interval.
+
+		:param bool dynamic:  Add weights per interval
+		:param graph_attributes:  Attributes of the graph
+		:return nx.Graph:  Graph, or a DiGraph for directed networks
+		"""
+		network = nx.DiGraph(**graph_attributes) if self.directed else nx.Graph(**graph_attributes)
+
+		for key, attributes, weight, intervals in self.nodes():
+			network.add_node(key, **attributes, weight=weight, **({"intervals": intervals} if dynamic else {}))
+
+		for source, target, weight, intervals in self.edges():
+			network.add_edge(source, target, weight=weight, **({"intervals": intervals} if dynamic else {}))
+
+		return network
+
+
+def force_layout(num_nodes, sources, targets, weights, iterations=50, seed=None, max_exact=2000, num_pivots=50):
+	"""
+	Calculate a force-directed layout
+
+	A variant of the Fruchterman-Reingold algorithm, vectorised with NumPy.
+	Connected nodes attract each other (more so for heavier edges) and all
+	nodes repel each other. For networks with more than `max_exact` nodes,
+	repulsion is approximated by only calculating it from a random sample of
+	`num_pivots` nodes per iteration, so each iteration takes time linear in
+	the amount of nodes and edges rather than quadratic.
+
+	The result is not as refined as e.g. ForceAtlas2 in Gephi, but it is a
+	much better starting point than random positions, and can be calculated
+	for networks that are too large to lay out in the browser.
+
+	:param int num_nodes:  Amount of nodes
+	:param np.ndarray sources:  Node IDs of edge sources
+	:param np.ndarray targets:  Node IDs of edge targets
+	:param np.ndarray weights:  Edge weights
+	:param int iterations:  Amount of iterations
+	:param int seed:  Seed for the random initial positions
+	:param int max_exact:  Maximum amount of nodes for which repulsion is
+	  calculated between all nodes
+	:param int num_pivots:  Amount of nodes to calculate repulsion from per
+	  iteration for larger networks
+	:return np.ndarray:  Array with an (x, y) position per node, between -1000
+	  and 1000
+	"""
+	random = np.random.default_rng(seed)
+	positions = random.uniform(-1, 1, (num_nodes, 2))
+	if num_nodes < 2 or not len(sources):
+		return positions * 1000
+
+	# optimal distance between nodes, for a layout within a 2x2 square
+	distance = np.sqrt(4.0 / num_nodes)
+	attraction = np.log1p(weights.astype(np.float64))
+	temperature = 0.1
+	cooling = temperature / (iterations + 1)
+
+	for iteration in range(iterations):
+		displacement = np.zeros((num_nodes, 2))
+
+		# repulsion, from all nodes or from a sample of pivot nodes
+		if num_nodes <= max_exact:
+			pivots = positions
+			scale = 1.0
+		else:
+			pivots = positions[random.choice(num_nodes, num_pivots, replace=False)]
+			scale = num_nodes / num_pivots
+
+		for chunk in range(0, num_nodes, 1024):
+			delta = positions[chunk:chunk + 1024, np.newaxis, :] - pivots[np.newaxis, :, :]
+			squared = np.maximum((delta ** 2).sum(axis=2), 1e-6)
+			displacement[chunk:chunk + 1024] += scale * (delta * (distance ** 2 / squared)[:, :, np.newaxis]).sum(axis=1)
+
+		# attraction along edges
+		delta = positions[sources] - positions[targets]
+		length = np.sqrt((delta ** 2).sum(axis=1))
+		force = delta * (length * attraction / distance)[:, np.newaxis]
+		for axis in (0, 1):
+			displacement[:, axis] -= np.bincount(sources, weights=force[:, axis], minlength=num_nodes)
+			displacement[:, axis] += np.bincount(targets, weights=force[:, axis], minlength=num_nodes)
+
+		# move nodes, but no further than the current temperature
+		length = np.maximum(np.sqrt((displacement ** 2).sum(axis=1)), 1e-9)
+		positions += displacement * (np.minimum(length, temperature) / length)[:, np.newaxis]
+		temperature -= cooling
+
+	# scale to a fixed range
+	positions -= positions.mean(axis=0)
+	extent = np.abs(positions).max()
+	return positions / extent * 1000 if extent else positions
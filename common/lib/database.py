@@ -2,6 +2,7 @@
 Database wrapper
 """
 import itertools
+import uuid
 import psycopg2.extras
 import psycopg2
 import time
@@ -30,6 +31,7 @@ class Database:
 	interrupted = False
 	interruptable_timeout = 86400  # if a query takes this long, it should be cancelled. see also fetchall_interruptable()
 	interruptable_job = None
+	upsert_batch_size = 1000  # amount of rows per query in upsert_many()
 
 	def __init__(self, logger, dbname=None, user=None, password=None, host=None, port=None, appname=None):
 		"""
@@ -239,6 +241,78 @@ class Database:
 		cursor.close()
 		return result
 
+	def insert_many(self, table, data, commit=True, safe=False, constraints=None, return_field=""):
+		"""
+		Create multiple database records in one query
+
+		Like `insert()`, but for a list of records, which are inserted with a
+		single multi-row `INSERT` query.
+
+		:param string table:  Table to insert records into
+		:param list data:   Data to insert, a list of dictionaries which
+		should all have the same keys
+		:param bool commit: Whether to commit after executing the query
+		:param bool safe: If set to `True`, "ON CONFLICT DO NOTHING" is added to the insert query, so rows that would
+						  violate a unique index or other constraint are skipped
+		:param tuple constraints: If `safe` is `True`, this tuple may contain the columns that should be used as a
+								  constraint, e.g. ON CONFLICT (name, lastname) DO NOTHING
+		:param return_field: If not empty or None, this makes the method
+		return this field of the inserted rows, instead of the number of
+		affected rows, with `RETURNING`. This may also be a list of fields,
+		in which case a dictionary with those fields is returned per row.
+		Skipped rows are not included.
+		:return int|list: Number of affected rows, or a list of returned
+		values
+		"""
+		if not data:
+			return [] if return_field else 0
+
+		if constraints is None:
+			constraints = []
+
+		# escape identifiers
+		columns = list(data[0].keys())
+		identifiers = [sql.Identifier(column) for column in columns]
+		identifiers.insert(0, sql.Identifier(table))
+
+		# construct ON NOTHING bit of query
+		if safe:
+			safe_bit = " ON CONFLICT "
+			if constraints:
+				safe_bit += "(" + ", ".join(["{}" for each in constraints]) + ")"
+				identifiers.extend([sql.Identifier(column) for column in constraints])
+			safe_bit += " DO NOTHING"
+		else:
+			safe_bit = ""
+
+		protoquery = "INSERT INTO {} (%s) VALUES %%s" % ", ".join(["{}" for column in columns]) + safe_bit
+
+		return_fields = [return_field] if type(return_field) is str else list(return_field or [])
+		return_fields = [field for field in return_fields if field]
+		if return_fields:
+			protoquery += " RETURNING " + ", ".join(["{}" for field in return_fields])
+			identifiers.extend([sql.Identifier(field) for field in return_fields])
+
+		query = sql.SQL(protoquery).format(*identifiers)
+		replacements = [tuple([row[column] for column in columns]) for row in data]
+
+		cursor = self.get_cursor()
+		self.log.debug("Executing query: %s (%i rows)" % (query.as_string(cursor), len(replacements)))
+		returned = execute_values(cursor, query, replacements, page_size=len(replacements), fetch=bool(return_fields))
+
+		if commit:
+			self.commit()
+
+		if not return_fields:
+			result = cursor.rowcount
+		elif type(return_field) is str:
+			result = [row[return_field] for row in returned]
+		else:
+			result = [dict(row) for row in returned]
+
+		cursor.close()
+		return result
+
 	def upsert(self, table, data, commit=True, constraints=None):
 		"""
 		Create or update database record
@@ -286,6 +360,63 @@ class Database:
 		cursor.close()
 		return result
 
+	def upsert_many(self, table, data, commit=True, constraints=None):
+		"""
+		Create or update multiple database records in one query
+
+		Like `upsert()`, but for a list of records, which are upserted with a
+		single multi-row `INSERT` query. The records should not conflict with
+		each other.
+
+		:param string table:  Table to upsert records into
+		:param list data:   Data to upsert, a list of dictionaries which
+		should all have the same keys
+		:param bool commit: Whether to commit after executing the query
+		:param tuple constraints: This tuple may contain the columns that should be used as a
+								  constraint, e.g. ON CONFLICT (name, lastname) DO UPDATE
+		:return int: Number of affected rows
+		"""
+		if not data:
+			return 0
+
+		if constraints is None:
+			constraints = []
+
+		# escape identifiers
+		columns = list(data[0].keys())
+		identifiers = [sql.Identifier(column) for column in columns]
+		identifiers.insert(0, sql.Identifier(table))
+
+		protoquery = "INSERT INTO {} (%s) VALUES %%s" % ", ".join(["{}" for column in columns])
+		protoquery += " ON CONFLICT"
+
+		if constraints:
+			protoquery += "(" + ", ".join(["{}" for each in constraints]) + ")"
+			identifiers.extend([sql.Identifier(column) for column in constraints])
+
+		protoquery += " DO UPDATE SET "
+		protoquery += ", ".join(["{} = EXCLUDED.{}" for column in columns])
+		identifiers.extend(itertools.chain.from_iterable([[sql.Identifier(column)] * 2 for column in columns]))
+
+		query = sql.SQL(protoquery).format(*identifiers)
+		replacements = [tuple([row[column] for column in columns]) for row in data]
+
+		cursor = self.get_cursor()
+		self.log.debug("Executing query: %s (%i rows)" % (query.as_string(cursor), len(replacements)))
+
+		# upsert in batches, to keep individual queries manageable
+		result = 0
+		for offset in range(0, len(replacements), self.upsert_batch_size):
+			batch = replacements[offset:offset + self.upsert_batch_size]
+			execute_values(cursor, query, batch, page_size=len(batch))
+			result += cursor.rowcount
+
+		if commit:
+			self.commit()
+
+		cursor.close()
+		return result
+
 	def fetchall(self, query, *args):
 		"""
 		Fetch all rows for a query
@@ -333,6 +464,23 @@ class Database:
 
 		return result
 
+	def count_estimate(self, query, *args):
+		"""
+		Estimate the amount of rows a query would return
+
+		Uses the query planner's estimate (via the `count_estimate` database
+		function), which is much faster than actually counting the rows with
+		`COUNT(*)` for large tables, but may be quite a bit off.
+
+		:param string query:  Query to estimate the amount of rows for
+		:param args:  Replacement values
+		:return int:  Estimated amount of rows
+		"""
+		query = self.cursor.mogrify(query, *args).decode("utf-8")
+		estimate = self.fetchone("SELECT count_estimate(%s) AS num", (query,))
+
+		return int(estimate["num"]) if estimate and estimate["num"] else 0
+
 	def fetchall_interruptable(self, queue, query, *args):
 		"""
 		Fetch all rows for a query, allowing for interruption
@@ -389,6 +537,112 @@ class Database:
 		return result
 
 
+	def iterate_interruptable(self, queue, query, *args, itersize=10000):
+		"""
+		Iterate through rows for a query, allowing for interruption
+
+		Like `fetchall_interruptable()`, but rather than fetching all rows at
+		once, this uses a named (server-side) cursor to fetch rows from the
+		database in batches of `itersize` rows as they are iterated over. This
+		allows processing result sets that are much larger than would fit in
+		memory.
+
+		As with `fetchall_interruptable()`, a job is queued to cancel the
+		query; if it is run while the query is executing or a batch of rows is
+		being fetched, a DatabaseQueryInterruptedException is raised. The
+		cursor is declared `WITH HOLD`, so other queries may be committed via
+		the same connection while iterating.
+
+		:param JobQueue queue:  A job queue object, required to schedule the
+		query cancellation job
+		:param str query:  SQL query
+		:param list args:  Replacement variables
+		:param int itersize:  Amount of rows to fetch from the database at once
+		:return Generator:  Yields rows, as dictionaries
+		"""
+		# schedule a job that will cancel the query we're about to make
+		self.interruptable_job = queue.add_job("cancel-pg-query", details={}, remote_id=self.appname, claim_after=time.time() + self.interruptable_timeout)
+
+		cursor = self.connection.cursor(name="interruptable-%s" % uuid.uuid4().hex, cursor_factory=psycopg2.extras.RealDictCursor, withhold=True)
+		cursor.itersize = itersize
+		self.log.debug("Executing interruptable query: %s" % self.cursor.mogrify(query, *args))
+
+		try:
+			cursor.execute(query, *args)
+			for row in cursor:
+				yield row
+
+		except psycopg2.extensions.QueryCanceledError:
+			# interrupted with cancellation worker (or manually)
+			self.log.debug("Query in connection %s was interrupted..." % self.appname)
+			self.rollback()
+			self.interruptable_job = None
+			raise DatabaseQueryInterruptedException("Interrupted while querying database")
+
+		finally:
+			# this is also reached if iteration was stopped early, e.g.
+			# because the worker was interrupted
+			try:
+				cursor.close()
+				self.commit()
+			except psycopg2.Error:
+				self.rollback()
+
+			# clean up cancelling job, unless it has been run already
+			if self.interruptable_job:
+				self.interruptable_job.finish()
+				self.interruptable_job = None
+
+	def notify(self, channel, payload="", commit=True):
+		"""
+		Send a notification to a channel
+
+		Connections that `listen()` to the channel will receive it. Note that
+		notifications are only delivered once the transaction they are sent
+		in is committed.
+
+		:param str channel:  Channel to notify
+		:param str payload:  Notification payload
+		:param bool commit:  Commit transaction after sending?
+		"""
+		cursor = self.get_cursor()
+		cursor.execute("SELECT pg_notify(%s, %s)", (channel, str(payload)))
+		cursor.close()
+
+		if commit:
+			self.commit()
+
+	def listen(self, channel):
+		"""
+		Start listening for notifications on a channel
+
+		This puts the connection in autocommit mode, since notifications are
+		only received outside of transactions. It is therefore best to use a
+		separate database object for this. Use `get_notifications()` to
+		collect the received notifications; the connection can be passed to
+		`select.select()` to wait for them efficiently.
+
+		:param str channel:  Channel to listen to
+		"""
+		self.connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+
+		cursor = self.get_cursor()
+		cursor.execute(sql.SQL("LISTEN {}").format(sql.Identifier(channel)))
+		cursor.close()
+
+	def get_notifications(self):
+		"""
+		Get notifications received since the last call to this method
+
+		:return list:  List of `Notify` objects, with `channel` and `payload`
+		attributes
+		"""
+		self.connection.poll()
+		notifications = list(self.connection.notifies)
+		del self.connection.notifies[:]
+
+		return notifications
+
 	def commit(self):
 		"""
 		Commit the current transaction
@@ -2,6 +2,7 @@ import collections
 import datetime
 import hashlib
 import random
+import io
 import shutil
 import json
 import time
@@ -13,6 +14,7 @@ from pathlib import Path
 import config
 import backend
 from common.lib.job import Job, JobNotFoundException
+from common.lib.dataset_index import DataSetIndex
 from common.lib.helpers import get_software_version
 from common.lib.fourcat_module import FourcatModule
 
@@ -34,7 +36,7 @@ class DataSet(FourcatModule):
 	data = {}
 	key = ""
 
-	children = []
+	_children = None
 	available_processors = {}
 	genealogy = []
 	preset_parent = None
@@ -46,6 +48,10 @@ class DataSet(FourcatModule):
 	no_status_updates = False
 	staging_area = None
 
+	#: Result files smaller than this many bytes are not indexed when the
+	#: dataset is finished
+	index_min_size = 8 * 1024 * 1024
+
 	def __init__(self, parameters={}, key=None, job=None, data=None, db=None, parent=None, extension="csv",
 				 type=None):
 		"""
@@ -68,7 +74,7 @@ class DataSet(FourcatModule):
 
 			query = current["query"]
 		elif job is not None:
-			current = self.db.fetchone("SELECT * FROM datasets WHERE parameters::json->>'job' = %s", (job,))
+			current = self.db.fetchone("SELECT * FROM datasets WHERE job = %s", (job,))
 			if not current:
 				raise TypeError("DataSet() requires a valid job ID for its 'job' argument")
 
@@ -109,17 +115,94 @@ class DataSet(FourcatModule):
 				"software_version": get_software_version(),
 				"software_file": "",
 				"num_rows": 0,
-				"key_parent": parent
+				"key_parent": parent if parent else "",
+				"owner": parameters.get("user", ""),
+				"datasource": parameters.get("datasource", "")  # see set_datasource()
 			}
 			self.parameters = parameters
 
 			self.db.insert("datasets", data=self.data)
 			self.reserve_result_file(parameters, extension)
 
-		# retrieve analyses and processors that may be run for this dataset
-		analyses = self.db.fetchall("SELECT * FROM datasets WHERE key_parent = %s ORDER BY timestamp ASC", (self.key,))
-		self.children = sorted([DataSet(data=analysis, db=self.db) for analysis in analyses],
-							   key=lambda dataset: dataset.is_finished(), reverse=True)
+	@property
+	def children(self):
+		"""
+		Get child datasets, i.e. datasets created by processors run on this one
+
+		Children are loaded from the database when first requested. To load
+		the children of many datasets (or a full tree of datasets) at once,
+		use `DataSet.preload_children()`.
+
+		:return list:  Child datasets, finished datasets first, then ordered
+		by creation time
+		"""
+		if self._children is None:
+			analyses = self.db.fetchall("SELECT * FROM datasets WHERE key_parent = %s ORDER BY timestamp ASC", (self.key,))
+			self._children = self.sort_children([DataSet(data=analysis, db=self.db) for analysis in analyses])
+
+		return self._children
+
+	@staticmethod
+	def sort_children(children):
+		"""
+		Sort child datasets in the order in which they are shown
+
+		:param list children:  Child datasets, ordered by creation time
+		:return list:  Child datasets, finished datasets first
+		"""
+		return sorted(children, key=lambda dataset: dataset.is_finished(), reverse=True)
+
+	@staticmethod
+	def preload_children(datasets, db, recursive=True):
+		"""
+		Load children for a number of datasets at once
+
+		Rather than each dataset (and each of their children, et cetera)
+		loading its own children when they are first requested, this fetches
+		all descendants of the given datasets with a single (recursive) query
+		and makes them available via the datasets' `children` attribute.
+
+		Every dataset is only instantiated once, so the datasets in the
+		resulting trees are unique objects, and the given datasets are used as
+		their roots.
+
+		:param list datasets:  Datasets to load children for
+		:param db:  Database handler
+		:param bool recursive:  Also load the children's children, et cetera.
+		If `False`, only direct children are loaded.
+		:return dict:  All datasets in the loaded trees, key => DataSet
+		"""
+		identity_map = {dataset.key: dataset for dataset in datasets}
+		if not identity_map:
+			return identity_map
+
+		keys = list(identity_map.keys())
+		if recursive:
+			# UNION (rather than UNION ALL) so that a dataset is never
+			# visited twice, even if the tree is somehow circular
+			records = db.fetchall(
+				"WITH RECURSIVE family AS ("
+				"    SELECT * FROM datasets WHERE key_parent = ANY(%s)"
+				"    UNION"
+				"    SELECT datasets.* FROM datasets INNER JOIN family ON datasets.key_parent = family.key"
+				") SELECT * FROM family ORDER BY timestamp ASC", (keys,))
+		else:
+			records = db.fetchall("SELECT * FROM datasets WHERE key_parent = ANY(%s) ORDER BY timestamp ASC", (keys,))
+
+		children = {key: [] for key in keys}
+		for record in records:
+			if record["key"] not in identity_map:
+				identity_map[record["key"]] = DataSet(data=record, db=db)
+
+			children.setdefault(record["key_parent"], []).append(identity_map[record["key"]])
+			if recursive:
+				children.setdefault(record["key"], [])
+
+		for key, dataset_children in children.items():
+			if key in identity_map:
+				identity_map[key]._children = DataSet.sort_children(dataset_children)
+
+		return identity_map
 
 	def check_dataset_finished(self):
 		"""
@@ -151,6 +234,172 @@ class DataSet(FourcatModule):
 		"""
 		return self.folder.joinpath(self.data["result_file"])
 
+	def get_index_path(self):
+		"""
+		Get path to the result file's index
+
+		The index is a small file next to the result file that contains the
+		amount of rows, columns and byte offsets of rows in the result file;
+		see `DataSetIndex`.
+
+		:return Path:  A path to the index file
+		"""
+		return DataSetIndex.get_index_path(self.get_results_path())
+
+	def get_index(self):
+		"""
+		Get the result file's index
+
+		:return DataSetIndex|None:  Index, or `None` if the dataset has no
+		valid index (e.g. because it is not finished yet)
+		"""
+		return DataSetIndex.load(self.get_results_path())
+
+	def can_index(self):
+		"""
+		Check whether an index can be built for the result file
+
+		:return bool:  Whether the result file is of a type that can be
+		indexed
+		"""
+		return self.get_results_path().suffix.lower() in (".csv", ".ndjson", ".parquet")
+
+	def build_index(self, min_size=0):
+		"""
+		Build an index for the result file
+
+		Indexes can be built for CSV, NDJSON and Parquet files. Indexing
+		failures are not fatal; without an index, the result file is simply
+		read from the start when it is needed.
+
+		:param int min_size:  Do not build an index for files smaller than
+		  this many bytes
+		:return DataSetIndex|None:  Index, or `None` if none could be built
+		"""
+		path = self.get_results_path()
+		if not path.exists() or not self.can_index():
+			return None
+
+		if min_size and path.stat().st_size < min_size:
+			return None
+
+		index = DataSetIndex.load(path)
+		if index:
+			# e.g. for shallow copies, which share a result file
+			return index
+
+		processor = self.get_own_processor()
+		mapper = processor.map_item if processor and hasattr(processor, "map_item") else None
+
+		try:
+			return DataSetIndex.build(path, mapper=mapper)
+		except Exception as e:
+			# anything can go wrong here, e.g. in the processor's map_item(),
+			# but the dataset works fine without an index
+			self.log("Could not build index for result file: %s" % e)
+			DataSetIndex.delete(path)
+			return None
+
+	def get_mapped_csv_path(self):
+		"""
+		Get path to the cached CSV version of the result file
+
+		For datasets with results that are not CSV files (e.g. NDJSON), a CSV
+		file with mapped items can be generated once with `get_mapped_csv()`
+		and stored next to the result file for later reuse.
+
+		:return Path:  A path to the mapped CSV file
+		"""
+		path = self.get_results_path()
+		return path.with_name(path.name + ".mapped.csv")
+
+	def get_mapped_csv(self, generate=True):
+		"""
+		Get a CSV version of the (NDJSON) result file
+
+		Items are mapped with the `map_item` method of the processor that
+		created the dataset. The CSV file is only generated once, and reused
+		until the result file changes.
+
+		:param bool generate:  Generate the CSV file if there is no up to date
+		  version of it yet. If `False`, `None` is returned in that case.
+		:return Path|None:  Path to the mapped CSV file, or `None` if the
+		result file cannot be mapped
+		"""
+		if not self.can_map_csv():
+			return None
+
+		mapped_path = self.get_mapped_csv_path()
+		if mapped_path.exists() and mapped_path.stat().st_mtime >= self.get_results_path().stat().st_mtime:
+			return mapped_path
+
+		if not generate:
+			return None
+
+		for chunk in self.iterate_mapped_csv():
+			pass
+
+		return mapped_path if mapped_path.exists() else None
+
+	def can_map_csv(self):
+		"""
+		Check if a CSV version of the result file can be generated
+
+		:return bool:  Whether the result file is an NDJSON file and the
+		processor that created the dataset can map its items
+		"""
+		path = self.get_results_path()
+		return path.exists() and path.suffix.lower() == ".ndjson" and hasattr(self.get_own_processor(), "map_item")
+
+	def iterate_mapped_csv(self, chunk_size=64 * 1024):
+		"""
+		Generate a CSV version of the (NDJSON) result file, in chunks
+
+		The CSV file is yielded while it is being generated, e.g. to send it
+		to a client while it is downloading, and at the same time written to
+		the file `get_mapped_csv()` returns for later reuse. It is written to
+		a temporary file first, which is only kept if the whole CSV file is
+		generated, so a partially written file is never served.
+
+		:param int chunk_size:  Approximate size of the chunks to yield, in
+		  characters
+		:return generator:  Yields strings, together making up the CSV file
+		"""
+		processor = self.get_own_processor()
+		mapped_path = self.get_mapped_csv_path()
+		temp_path = mapped_path.with_name(mapped_path.name + ".%s.tmp" % random.randint(0, 1000000000))
+
+		buffer = io.StringIO()
+		try:
+			with self.get_results_path().open(encoding="utf-8") as infile, temp_path.open("w", encoding="utf-8", newline="") as outfile:
+				writer = None
+				for line in infile:
+					if not line.strip():
+						continue
+
+					mapped_item = processor.map_item(json.loads(line))
+					if not writer:
+						writer = csv.DictWriter(buffer, fieldnames=tuple(mapped_item.keys()))
+						writer.writeheader()
+
+					writer.writerow(mapped_item)
+					if buffer.tell() >= chunk_size:
+						chunk = buffer.getvalue()
+						buffer.seek(0)
+						buffer.truncate(0)
+
+						outfile.write(chunk)
+						yield chunk
+
+				chunk = buffer.getvalue()
+				outfile.write(chunk)
+				yield chunk
+
+			temp_path.replace(mapped_path)
+		finally:
+			if temp_path.exists():
+				temp_path.unlink()
+
 	def get_log_path(self):
 		"""
 		Get path to dataset log file
@@ -272,6 +521,10 @@ class DataSet(FourcatModule):
 		self.data["is_finished"] = True
 		self.data["num_rows"] = num_rows
 
+		# reading small files from the start is cheap enough; for those,
+		# an index is only built when something asks for one
+		self.build_index(min_size=self.index_min_size)
+
 	def unfinish(self):
 		"""
 		Declare unfinished, and reset status, so that it may be executed again.
@@ -284,6 +537,12 @@ class DataSet(FourcatModule):
 		except FileNotFoundError:
 			pass
 
+		DataSetIndex.delete(self.get_results_path())
+		try:
+			self.get_mapped_csv_path().unlink()
+		except FileNotFoundError:
+			pass
+
 		self.data["timestamp"] = int(time.time())
 		self.data["is_finished"] = False
 		self.data["num_rows"] = 0
@@ -318,7 +577,8 @@ class DataSet(FourcatModule):
 
 		copy = DataSet(parameters=parameters, db=self.db, extension=self.result_file.split(".")[-1], type=self.type)
 		for field in self.data:
-			if field in ("id", "key", "timestamp", "job", "parameters", "result_file"):
+			# the datasource is set from the (copied) parameters already
+			if field in ("id", "key", "timestamp", "job", "parameters", "result_file", "datasource"):
 				continue
 
 			copy.__setattr__(field, self.data[field])
@@ -342,10 +602,12 @@ class DataSet(FourcatModule):
 		Deletes both database records and result files. Note that manipulating
 		a dataset object after it has been deleted is undefined behaviour.
 		"""
-		# first, recursively delete children
-		children = self.db.fetchall("SELECT * FROM datasets WHERE key_parent = %s", (self.key,))
-		for child in children:
-			child = DataSet(key=child["key"], db=self.db)
+		# first, recursively delete children - load them all at once, so they
+		# do not each need to query the database for their own children
+		if self._children is None:
+			DataSet.preload_children([self], self.db)
+
+		for child in self.children:
 			child.delete()
 
 		# delete from database
@@ -358,6 +620,12 @@ class DataSet(FourcatModule):
 			# already deleted, apparently
 			pass
 
+		DataSetIndex.delete(self.get_results_path())
+		try:
+			self.get_mapped_csv_path().unlink()
+		except FileNotFoundError:
+			pass
+
 	def is_finished(self):
 		"""
 		Check if dataset is finished
@@ -409,7 +677,7 @@ class DataSet(FourcatModule):
 		"""
 		Returns the dataset columns.
 
-		Useful for processor input forms. Can deal with both CSV and NDJSON
+		Useful for processor input forms. Can deal with CSV, Parquet and NDJSON
 		files, the latter only if a `map_item` function is available in the
 		processor that generated it. While in other cases one could use the
 		keys of the JSON object, this is not always possible in follow-up code
@@ -423,6 +691,10 @@ class DataSet(FourcatModule):
 			# no file to get columns from
 			return False
 
+		index = self.get_index()
+		if index and index.columns is not None:
+			return list(index.columns)
+
 		if self.get_results_path().suffix.lower() == ".csv":
 			with self.get_results_path().open(encoding="utf-8") as infile:
 				reader = csv.DictReader(infile)
@@ -443,6 +715,16 @@ class DataSet(FourcatModule):
 				# not a valid NDJSON file?
 				return []
 
+		elif self.get_results_path().suffix.lower() == ".parquet":
+			# columnar files store their schema separately from the data, so
+			# no rows need to be read to know the columns
+			import pyarrow.parquet as pq
+			try:
+				return list(pq.read_schema(str(self.get_results_path())).names)
+			except (OSError, ValueError):
+				# not a valid Parquet file?
+				return []
+
 		else:
 			# not a CSV or NDJSON file, or no map_item function available
 			return []
@@ -533,11 +815,25 @@ class DataSet(FourcatModule):
 		:param str label:  New datasource type
 		:return str:  The new datasource type
 		"""
+		self.set_datasource(datasource)
+		return datasource
+
+	def set_datasource(self, datasource):
+		"""
+		Set the datasource for this dataset
 
+		The datasource is stored both in the dataset's parameters, where most
+		code reads it from, and in its own column, which is used to filter
+		datasets with. This updates both, so they never disagree.
+
+		:param str datasource:  Datasource ID
+		"""
 		self.parameters["datasource"] = datasource
+		self.data["parameters"] = json.dumps(self.parameters)
+		self.data["datasource"] = datasource
 
-		self.db.update("datasets", data={"parameters": json.dumps(self.parameters)}, where={"key": self.key})
-		return datasource
+		self.db.update("datasets", where={"key": self.key},
+					   data={"datasource": datasource, "parameters": self.data["parameters"]})
 
 	def reserve_result_file(self, parameters=None, extension="csv"):
 		"""
@@ -547,7 +843,9 @@ class DataSet(FourcatModule):
 		no file exists or will exist at that location other than the file we
 		expect (i.e. the data for this particular dataset).
 
-		:param str extension: File extension, "csv" by default
+		:param str extension: File extension, "csv" by default. Besides "csv",
+		  "ndjson" and "parquet" are formats that processors can read items
+		  from.
 		:param parameters:  Dataset parameters
 		:return bool:  Whether the file path was successfully reserved
 		"""
@@ -754,23 +1052,24 @@ class DataSet(FourcatModule):
 		if self.genealogy:
 			return self.genealogy
 
-		key_parent = self.key_parent
-		genealogy = []
-
-		while key_parent:
-			try:
-				parent = DataSet(key=key_parent, db=self.db)
-			except TypeError:
-				break
-
-			genealogy.append(parent)
-			if parent.key_parent:
+		genealogy = [self]
+		if self.key_parent:
+			# get all ancestors in one go; UNION (rather than UNION ALL) so
+			# that a circular genealogy does not recurse infinitely
+			ancestors = self.db.fetchall(
+				"WITH RECURSIVE ancestors AS ("
+				"    SELECT * FROM datasets WHERE key = %s"
+				"    UNION"
+				"    SELECT datasets.* FROM datasets INNER JOIN ancestors ON datasets.key = ancestors.key_parent"
+				") SELECT * FROM ancestors", (self.key_parent,))
+			ancestors = {ancestor["key"]: ancestor for ancestor in ancestors}
+
+			# walk up the tree, and stop if a parent does not exist
+			key_parent = self.key_parent
+			while key_parent in ancestors and key_parent not in [dataset.key for dataset in genealogy]:
+				parent = DataSet(data=ancestors[key_parent], db=self.db)
+				genealogy.insert(0, parent)
 				key_parent = parent.key_parent
-			else:
-				break
-
-		genealogy.reverse()
-		genealogy.append(self)
 
 		self.genealogy = genealogy
 		return self.genealogy
@@ -785,13 +1084,11 @@ class DataSet(FourcatModule):
 
 		:return list:  List of DataSets
 		"""
-		children = [DataSet(data=record, db=self.db) for record in self.db.fetchall("SELECT * FROM datasets WHERE key_parent = %s", (self.key,))]
-		results = children.copy()
-		if recursive:
-			for child in children:
-				results += child.get_all_children(recursive)
+		if not recursive:
+			return self.children.copy()
 
-		return results
+		family = DataSet.preload_children([self], self.db)
+		return [dataset for key, dataset in family.items() if key != self.key]
 
 	def get_breadcrumbs(self):
 		"""
@@ -994,6 +1291,11 @@ class DataSet(FourcatModule):
 			super().__setattr__(attr, value)
 			return
 
+		# stored in two places, which need to be kept in sync
+		if attr == "datasource":
+			self.set_datasource(value)
+			return
+
 		if attr not in self.data:
 			self.parameters[attr] = value
 			attr = "parameters"
@@ -0,0 +1,450 @@
+"""
+Sidecar index for dataset result files
+"""
+import datetime
+import json
+import csv
+
+from pathlib import Path
+
+csv.field_size_limit(1024 * 1024 * 1024)
+
+
+class DataSetIndex:
+	"""
+	Index of a dataset result file
+
+	The index is stored as a small JSON file next to the result file, with the
+	same name plus an `.index` suffix. It contains the amount of rows and the
+	columns in the dataset, and for CSV and NDJSON files, the byte offset of
+	every `block_size`-th row, plus the earliest and latest timestamp of the
+	items in each block of rows. This allows reading arbitrary rows or time
+	ranges from the file without reading it from the start.
+
+	Parquet files keep this kind of metadata themselves, so for those only the
+	amount of rows and columns are indexed.
+	"""
+	#: Index file format version; indexes with another version are ignored
+	version = 1
+
+	#: Amount of rows per block - the byte offset of the first row of each
+	#: block is stored in the index
+	block_size = 1000
+
+	#: Path to the result file this is an index of
+	path = None
+
+	#: Index data
+	data = {}
+
+	def __init__(self, path, data):
+		"""
+		Instantiate index object
+
+		Use `DataSetIndex.load()` or `DataSetIndex.build()` to get an index
+		object for a given file.
+
+		:param Path path:  Path to result file
+		:param dict data:  Index data
+		"""
+		self.path = Path(path)
+		self.data = data
+
+	@staticmethod
+	def get_index_path(path):
+		"""
+		Get path to the index file for a given result file
+
+		:param Path path:  Path to result file
+		:return Path:  Path to index file
+		"""
+		path = Path(path)
+		return path.with_name(path.name + ".index")
+
+	@classmethod
+	def load(cls, path):
+		"""
+		Load index for a result file
+
+		The index is only returned if it matches the current version of the
+		result file, i.e. if the result file has not been modified since the
+		index was built.
+
+		:param Path path:  Path to result file
+		:return DataSetIndex|None:  Index, or `None` if no valid index exists
+		"""
+		path = Path(path)
+		index_path = cls.get_index_path(path)
+		if not path.exists() or not index_path.exists():
+			return None
+
+		try:
+			with index_path.open(encoding="utf-8") as infile:
+				data = json.load(infile)
+		except (OSError, json.JSONDecodeError):
+			return None
+
+		stat = path.stat()
+		if data.get("version") != cls.version or data.get("size") != stat.st_size or data.get("mtime") != stat.st_mtime:
+			# stale index
+			return None
+
+		return cls(path, data)
+
+	@classmethod
+	def build(cls, path, mapper=None):
+		"""
+		Build and save the index for a result file
+
+		This reads the full file once. For NDJSON files, items are mapped with
+		the given mapper to determine the dataset's columns and timestamps.
+
+		:param Path path:  Path to result file
+		:param callable mapper:  Function to map NDJSON items with, usually the
+		  `map_item` method of the processor that created the dataset
+		:return DataSetIndex:  The new index
+		"""
+		path = Path(path)
+		suffix = path.suffix.lower()
+
+		data = {
+			"version": cls.version,
+			"format": suffix[1:],
+			"block_size": cls.block_size,
+			"num_rows": 0,
+			"columns": None,
+			"blocks": []
+		}
+
+		if suffix == ".parquet":
+			import pyarrow.parquet as pq
+			metadata = pq.ParquetFile(str(path)).metadata
+			data["num_rows"] = metadata.num_rows
+			data["columns"] = list(metadata.schema.to_arrow_schema().names)
+
+		elif suffix == ".csv":
+			with path.open("rb") as infile:
+				rows = cls.iterate_csv_offsets(infile)
+				header = next(rows, (0, []))[1]
+
+				data["columns"] = header
+				timestamp_index = header.index("timestamp") if "timestamp" in header else None
+
+				block = None
+				for offset, row in rows:
+					if data["num_rows"] % cls.block_size == 0:
+						block = cls.new_block(offset)
+						data["blocks"].append(block)
+
+					timestamp = row[timestamp_index] if timestamp_index is not None and timestamp_index < len(row) else None
+					cls.add_timestamp(block, timestamp)
+					data["num_rows"] += 1
+
+		elif suffix == ".ndjson":
+			with path.open("rb") as infile:
+				offset = 0
+				block = None
+				for line in infile:
+					if not line.strip():
+						offset += len(line)
+						continue
+
+					if data["num_rows"] % cls.block_size == 0:
+						block = cls.new_block(offset)
+						data["blocks"].append(block)
+
+					offset += len(line)
+					try:
+						item = json.loads(line)
+						if mapper:
+							item = mapper(item)
+					except (json.JSONDecodeError, KeyError, ValueError, TypeError, AttributeError):
+						# unmappable item; still counts as a row but does not
+						# tell us anything about timestamps
+						item = {}
+
+					if mapper and data["columns"] is None and item:
+						data["columns"] = list(item.keys())
+
+					cls.add_timestamp(block, item.get("timestamp") if isinstance(item, dict) else None)
+					data["num_rows"] += 1
+
+		else:
+			raise NotImplementedError("Cannot index %s file" % path.suffix)
+
+		stat = path.stat()
+		data["size"] = stat.st_size
+		data["mtime"] = stat.st_mtime
+
+		with cls.get_index_path(path).open("w", encoding="utf-8") as outfile:
+			json.dump(data, outfile)
+
+		return cls(path, data)
+
+	@classmethod
+	def delete(cls, path):
+		"""
+		Delete the index for a result file, if it exists
+
+		:param Path path:  Path to result file
+		"""
+		try:
+			cls.get_index_path(path).unlink()
+		except FileNotFoundError:
+			pass
+
+	@property
+	def num_rows(self):
+		"""
+		Amount of rows in the indexed file
+
+		:return int:
+		"""
+		return self.data["num_rows"]
+
+	@property
+	def columns(self):
+		"""
+		Columns in the indexed file
+
+		For NDJSON files, these are the columns of mapped items, if the index
+		was built with a mapper.
+
+		:return list|None:  Column names, or `None` if unknown
+		"""
+		return self.data["columns"]
+
+	def has_unparsed_timestamps(self):
+		"""
+		Check if any items in the file have a timestamp that could not be
+		interpreted while indexing
+
+		:return bool:
+		"""
+		return any([block["unparsed"] > 0 for block in self.data["blocks"]])
+
+	def get_byte_ranges(self, min_timestamp=None, max_timestamp=None):
+		"""
+		Get byte ranges of blocks that may contain items in a time range
+
+		Blocks that contain items with timestamps that could not be parsed
+		are always included, since it cannot be known whether their items are
+		in the range. Adjacent blocks are merged into one range.
+
+		:param int min_timestamp:  Earliest timestamp, or `None`
+		:param int max_timestamp:  Latest timestamp, or `None`
+		:return list:  List of `(start, end)` tuples; `end` is `None` for a
+		  range that continues until the end of the file
+		"""
+		if self.data["format"] not in ("csv", "ndjson"):
+			raise NotImplementedError("Byte ranges are not available for %s files" % self.data["format"])
+
+		ranges = []
+		blocks = self.data["blocks"]
+		for i, block in enumerate(blocks):
+			if not block["unparsed"]:
+				if block["min_timestamp"] is None:
+					# no rows with a timestamp at all
+					continue
+				if min_timestamp is not None and block["max_timestamp"] < min_timestamp:
+					continue
+				if max_timestamp is not None and block["min_timestamp"] > max_timestamp:
+					continue
+
+			start = block["offset"]
+			end = blocks[i + 1]["offset"] if i + 1 < len(blocks) else None
+			if ranges and ranges[-1][1] == start:
+				ranges[-1] = (ranges[-1][0], end)
+			else:
+				ranges.append((start, end))
+
+		return ranges
+
+	def get_row_offset(self, row):
+		"""
+		Get the byte offset to seek to to read a given row
+
+		:param int row:  Row number, starting at 0
+		:return tuple:  A `(offset, skip)` tuple: the byte offset of the block
+		  the row is in, and the amount of rows to skip from there to reach
+		  the requested row
+		"""
+		if self.data["format"] not in ("csv", "ndjson"):
+			raise NotImplementedError("Row offsets are not available for %s files" % self.data["format"])
+
+		if row >= self.num_rows:
+			return None, 0
+
+		block = row // self.data["block_size"]
+		return self.data["blocks"][block]["offset"], row % self.data["block_size"]
+
+	def iterate_rows(self, offset=0, limit=None, columns=None):
+		"""
+		Iterate through rows in the indexed file, starting at a given row
+
+		Rows are returned as they are stored, i.e. NDJSON items are not mapped.
+
+		:param int offset:  Row to start at
+		:param int limit:  Amount of rows to yield at most; `None` for all
+		:param list columns:  Only include these columns, for Parquet files
+		:return Generator:  Yields rows, as dictionaries
+		"""
+		if limit is not None and limit <= 0:
+			return
+
+		if self.data["format"] == "parquet":
+			import pyarrow.parquet as pq
+
+			parquet_file = pq.ParquetFile(str(self.path))
+			metadata = parquet_file.metadata
+			if columns is not None:
+				columns = [column for column in columns if column in self.columns]
+
+			# skip row groups before the offset
+			skipped = 0
+			for group in range(0, metadata.num_row_groups):
+				group_rows = metadata.row_group(group).num_rows
+				if skipped + group_rows <= offset:
+					skipped += group_rows
+					continue
+
+				table = parquet_file.read_row_group(group, columns=columns)
+				for row in table.slice(max(0, offset - skipped)).to_pylist():
+					yield row
+					if limit is not None:
+						limit -= 1
+						if limit <= 0:
+							return
+
+				skipped += group_rows
+			return
+
+		start, skip = self.get_row_offset(offset)
+		if start is None:
+			return
+
+		for row in self.iterate_ranges(self.path, [(start, None)], fieldnames=self.columns):
+			if skip:
+				skip -= 1
+				continue
+
+			yield row
+			if limit is not None:
+				limit -= 1
+				if limit <= 0:
+					return
+
+	@classmethod
+	def iterate_ranges(cls, path, ranges, fieldnames=None):
+		"""
+		Iterate through items in given byte ranges of a CSV or NDJSON file
+
+		Each range should start at the start of a row, e.g. at a block
+		offset from an index.
+
+		:param Path path:  Path to file
+		:param list ranges:  List of `(start, end)` tuples, as returned by
+		  `get_byte_ranges()`. If `end` is `None`, read until the end of the
+		  file.
+		:param list fieldnames:  For CSV files, the column names. If not
+		  given, the first row of the file is read to determine them.
+		:return Generator:  Yields items, as dictionaries
+		"""
+		path = Path(path)
+		suffix = path.suffix.lower()
+
+		with path.open("rb") as infile:
+			if suffix == ".csv" and fieldnames is None:
+				fieldnames = next(cls.iterate_csv_offsets(infile), (0, []))[1]
+
+			for start, end in ranges:
+				infile.seek(start)
+				if suffix == ".csv":
+					for offset, row in cls.iterate_csv_offsets(infile, start):
+						if end is not None and offset >= end:
+							break
+						yield dict(zip(fieldnames, row))
+
+				elif suffix == ".ndjson":
+					offset = start
+					for line in infile:
+						if end is not None and offset >= end:
+							break
+						offset += len(line)
+						if line.strip():
+							yield json.loads(line)
+
+				else:
+					raise NotImplementedError("Cannot read byte ranges from %s file" % path.suffix)
+
+	@staticmethod
+	def iterate_csv_offsets(infile, start=0):
+		"""
+		Iterate through CSV rows, with the byte offset each row starts at
+
+		Rows may span multiple lines, so offsets cannot be determined by
+		simply looking at line breaks. Instead, lines are fed to a CSV reader
+		one by one and it is tracked how many bytes have been read when a row
+		is complete.
+
+		:param infile:  File handle, opened in binary mode, positioned at the
+		  start of a row
+		:param int start:  Byte offset the file handle is positioned at
+		:return Generator:  Yields `(offset, row)` tuples
+		"""
+		position = {"offset": start}
+
+		def lines():
+			for line in infile:
+				position["offset"] += len(line)
+				yield line.decode("utf-8")
+
+		reader = csv.reader(lines())
+		while True:
+			row_start = position["offset"]
+			try:
+				row = next(reader)
+			except StopIteration:
+				return
+
+			yield row_start, row
+
+	@staticmethod
+	def new_block(offset):
+		"""
+		Get data for a new block of rows
+
+		:param int offset:  Byte offset of the first row in the block
+		:return dict:  Block data
+		"""
+		return {"offset": offset, "min_timestamp": None, "max_timestamp": None, "unparsed": 0}
+
+	@staticmethod
+	def add_timestamp(block, timestamp):
+		"""
+		Update a block's timestamp range with the timestamp of one of its rows
+
+		Timestamps can be UNIX timestamps or `YYYY-MM-DD HH:MM:SS` dates (in
+		UTC), which is what 4CAT stores in result files. Timestamps in other
+		formats are counted as 'unparsed'.
+
+		:param dict block:  Block data
+		:param timestamp:  Timestamp of the row
+		"""
+		try:
+			if isinstance(timestamp, (int, float)):
+				timestamp = int(timestamp)
+			elif isinstance(timestamp, str) and timestamp.isdigit():
+				timestamp = int(timestamp)
+			else:
+				timestamp = int(datetime.datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S").replace(
+					tzinfo=datetime.timezone.utc).timestamp())
+		except (TypeError, ValueError):
+			block["unparsed"] += 1
+			return
+
+		if block["min_timestamp"] is None or timestamp < block["min_timestamp"]:
+			block["min_timestamp"] = timestamp
+
+		if block["max_timestamp"] is None or timestamp > block["max_timestamp"]:
+			block["max_timestamp"] = timestamp
@@ -0,0 +1,365 @@
+"""
+Memory-bounded indexes for finding duplicate texts in large datasets
+"""
+import hashlib
+import re
+
+import numpy as np
+
+# amount of set bits per byte value, to calculate Hamming distances with
+POPCOUNT = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)
+
+
+class DigestSet:
+	"""
+	Set of 64-bit digests with a bounded memory footprint
+
+	Digests are stored in sorted NumPy arrays ('runs') at 8 bytes per digest,
+	rather than as e.g. hex strings in a Python set, which take up more than
+	ten times as much. Digests are added in batches; each batch becomes a new
+	run, and runs of similar size are merged so that only a few runs need to
+	be searched per lookup.
+
+	Once the runs in memory take up more than the memory limit, they are
+	merged into a single run that is written to disk and memory-mapped, after
+	which memory is available for new digests again. Memory use can exceed
+	the limit temporarily while runs are merged.
+	"""
+	#: Amount of bytes runs in memory may take up before they are written
+	#: to disk
+	memory_limit = 256 * 1024 * 1024
+
+	#: Folder to write runs to, or a callable returning it; if `None`, runs
+	#: are never written to disk
+	spill_path = None
+
+	def __init__(self, memory_limit=None, spill_path=None, name="digests"):
+		"""
+		Set up digest set
+
+		:param int memory_limit:  Amount of bytes runs in memory may take up
+		:param Path|callable spill_path:  Folder to write runs to once the
+		  memory limit is reached. This should be a folder that is cleaned up
+		  afterwards, e.g. a dataset's staging area. If this is a callable, it
+		  is only called (and should return the folder) when runs are first
+		  written to disk, so the folder need not be created otherwise.
+		:param str name:  Prefix for the names of files written to
+		  `spill_path`, so multiple sets can share a folder
+		"""
+		if memory_limit:
+			self.memory_limit = memory_limit
+
+		self.spill_path = spill_path
+		self.name = name
+
+		self.runs = []
+		self.disk_runs = []
+
+	def __len__(self):
+		"""
+		Amount of digests in the set
+
+		:return int:
+		"""
+		return sum([len(run) for run in self.runs + self.disk_runs])
+
+	@property
+	def memory_used(self):
+		"""
+		Amount of bytes the digests in memory take up
+
+		:return int:
+		"""
+		return sum([run.nbytes for run in self.runs])
+
+	@property
+	def disk_used(self):
+		"""
+		Amount of bytes the digests written to disk take up
+
+		:return int:
+		"""
+		return sum([run.nbytes for run in self.disk_runs])
+
+	def add_many(self, digests):
+		"""
+		Add digests to the set
+
+		:param digests:  Digests to add, as an array of unsigned 64-bit
+		  integers or a list of 8-byte strings (e.g. from `digest()`)
+		:return np.ndarray:  For each digest, whether it was already in the
+		  set, including digests that occur earlier in `digests` itself
+		"""
+		digests = as_digest_array(digests)
+		seen = self.contains_many(digests)
+
+		# only the first occurrence of a digest within the batch is new
+		_, first = np.unique(digests, return_index=True)
+		is_first = np.zeros(len(digests), dtype=bool)
+		is_first[first] = True
+		seen |= ~is_first
+
+		self.add_run(np.sort(digests[~seen]))
+		return seen
+
+	def contains_many(self, digests):
+		"""
+		Check whether digests are in the set
+
+		:param digests:  Digests to check, as for `add_many()`
+		:return np.ndarray:  For each digest, whether it is in the set
+		"""
+		digests = as_digest_array(digests)
+		found = np.zeros(len(digests), dtype=bool)
+
+		for run in self.runs + self.disk_runs:
+			index = np.minimum(np.searchsorted(run, digests), len(run) - 1)
+			found |= run[index] == digests
+
+		return found
+
+	def between(self, low, high):
+		"""
+		Get all digests within a range
+
+		:param int low:  Lower bound (inclusive)
+		:param int high:  Upper bound (exclusive); may be 2^64
+		:return np.ndarray:  Digests in the range
+		"""
+		low = np.uint64(low)
+		matches = []
+		for run in self.runs + self.disk_runs:
+			start = np.searchsorted(run, low)
+			end = np.searchsorted(run, np.uint64(high)) if high < 2 ** 64 else len(run)
+			if end > start:
+				matches.append(run[start:end])
+
+		return np.concatenate(matches) if matches else np.zeros(0, dtype=np.uint64)
+
+	def add_run(self, run):
+		"""
+		Add a run of digests
+
+		:param np.ndarray run:  Digests to add. These must be sorted, unique,
+		  and not yet in the set.
+		"""
+		if not len(run):
+			return
+
+		# merge runs like a binary counter, so there are at most about
+		# log2(amount of batches) runs in memory
+		self.runs.append(run)
+		while len(self.runs) > 1 and len(self.runs[-2]) <= len(self.runs[-1]):
+			last = self.runs.pop()
+			self.runs.append(np.sort(np.concatenate((self.runs.pop(), last))))
+
+		if self.memory_used > self.memory_limit and self.spill_path:
+			self.spill()
+
+	def spill(self):
+		"""
+		Write all runs in memory to disk as a single run
+		"""
+		run = self.runs[0] if len(self.runs) == 1 else np.sort(np.concatenate(self.runs))
+		self.runs = []
+
+		if callable(self.spill_path):
+			self.spill_path = self.spill_path()
+
+		run_file = self.spill_path.joinpath("%s-%i.npy" % (self.name, len(self.disk_runs)))
+		np.save(run_file, run)
+		self.disk_runs.append(np.load(run_file, mmap_mode="r"))
+
+	def close(self):
+		"""
+		Remove all digests from the set
+
+		This releases the memory-mapped runs, so the files they were written
+		to can be removed.
+		"""
+		self.runs = []
+		self.disk_runs = []
+
+
+class SimHashIndex:
+	"""
+	Index of SimHashes, to find near-duplicate texts
+
+	Texts are near-duplicates if the Hamming distance between their SimHashes
+	(see `simhash()`) is at most `max_distance`. To find these without
+	comparing a SimHash to all others, the 64 bits are divided into
+	`max_distance + 1` bands; near-duplicates are identical in at least one
+	of these. Per band, the SimHashes are stored rotated so that the band is
+	at the start, so candidates can be found with a range lookup in a
+	`DigestSet`.
+	"""
+	#: Maximum Hamming distance between SimHashes of near-duplicates
+	max_distance = 3
+
+	#: Amount of SimHashes to collect before adding them to the index
+	batch_size = 1000
+
+	def __init__(self, max_distance=None, memory_limit=None, spill_path=None):
+		"""
+		Set up index
+
+		:param int max_distance:  Maximum Hamming distance between SimHashes
+		  of near-duplicates
+		:param int memory_limit:  Amount of bytes the index may take up in
+		  memory, divided over the bands
+		:param Path|callable spill_path:  Folder to write to once the memory
+		  limit is reached, see `DigestSet`
+		"""
+		if max_distance is not None:
+			self.max_distance = max_distance
+
+		num_bands = self.max_distance + 1
+		band_width = 64 // num_bands
+		memory_limit = memory_limit // num_bands if memory_limit else None
+
+		# offset and width per band; the last band takes the remaining bits
+		self.bands = [(band * band_width, band_width if band < num_bands - 1 else 64 - band * band_width) for band in
+					  range(num_bands)]
+		self.tables = [DigestSet(memory_limit=memory_limit, spill_path=spill_path, name="simhash-%i" % band) for band
+					   in range(num_bands)]
+
+		self.pending = np.zeros(self.batch_size, dtype=np.uint64)
+		self.num_pending = 0
+
+	@property
+	def memory_used(self):
+		"""
+		Amount of bytes the index takes up in memory
+
+		:return int:
+		"""
+		return sum([table.memory_used for table in self.tables]) + self.pending.nbytes
+
+	@property
+	def disk_used(self):
+		"""
+		Amount of bytes the index takes up on disk
+
+		:return int:
+		"""
+		return sum([table.disk_used for table in self.tables])
+
+	def add(self, value):
+		"""
+		Add a SimHash, unless it is a near-duplicate of one already added
+
+		:param int value:  SimHash
+		:return bool:  Whether the SimHash is a near-duplicate of one already
+		  in the index; if so, it is not added
+		"""
+		if self.num_pending and hamming_distances(self.pending[:self.num_pending], value).min() <= self.max_distance:
+			return True
+
+		for (offset, width), table in zip(self.bands, self.tables):
+			rotated = rotate(value, offset)
+			low = (rotated >> (64 - width)) << (64 - width)
+			candidates = table.between(low, low + (1 << (64 - width)))
+			if len(candidates) and hamming_distances(candidates, rotated).min() <= self.max_distance:
+				return True
+
+		self.pending[self.num_pending] = value
+		self.num_pending += 1
+		if self.num_pending == self.batch_size:
+			self.flush()
+
+		return False
+
+	def flush(self):
+		"""
+		Add pending SimHashes to the index
+		"""
+		pending = [int(value) for value in self.pending[:self.num_pending]]
+		for (offset, width), table in zip(self.bands, self.tables):
+			table.add_run(np.sort(np.array([rotate(value, offset) for value in pending], dtype=np.uint64)))
+
+		self.num_pending = 0
+
+	def close(self):
+		"""
+		Remove all SimHashes from the index, see `DigestSet.close()`
+		"""
+		for table in self.tables:
+			table.close()
+
+		self.num_pending = 0
+
+
+def digest(text):
+	"""
+	Get a 64-bit digest of a text
+
+	With 64-bit digests, the odds of two different texts getting the same
+	digest are about one in ten thousand for a set of fifty million texts.
+
+	:param str text:  Text to digest
+	:return bytes:  8-byte digest
+	"""
+	return hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+
+
+def simhash(text, shingle_size=3):
+	"""
+	Get the SimHash of a text
+
+	SimHashes of texts that share most of their shingles (sequences of
+	`shingle_size` words) differ in only a few bits, so similar texts can be
+	found by comparing SimHashes.
+
+	:param str text:  Text to hash
+	:param int shingle_size:  Amount of words per shingle
+	:return int|None:  64-bit SimHash, or `None` if the text contains no words
+	"""
+	words = re.findall(r"\w+", text)
+	if not words:
+		return None
+
+	shingles = [" ".join(words[i:i + shingle_size]) for i in range(max(1, len(words) - shingle_size + 1))]
+	hashes = as_digest_array([digest(shingle) for shingle in shingles])
+
+	# each bit of the SimHash is set if it is set in most shingle hashes
+	bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+	majority = bits.sum(axis=0) * 2 > len(shingles)
+
+	return int(np.packbits(majority, bitorder="little").view("<u8")[0])
+
+
+def as_digest_array(digests):
+	"""
+	Convert digests to an array of unsigned 64-bit integers
+
+	:param digests:  Array of integers, or list of 8-byte strings
+	:return np.ndarray:
+	"""
+	if isinstance(digests, np.ndarray):
+		return digests.astype(np.uint64, copy=False)
+
+	return np.frombuffer(b"".join(digests), dtype="<u8").astype(np.uint64)
+
+
+def hamming_distances(values, value):
+	"""
+	Get the Hamming distance between a value and each of an array of values
+
+	:param np.ndarray values:  Unsigned 64-bit integers
+	:param int value:  Value to compare to
+	:return np.ndarray:  Amount of differing bits per value
+	"""
+	differences = np.ascontiguousarray(np.bitwise_xor(values, np.uint64(value)))
+	return POPCOUNT[differences.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def rotate(value, bits):
+	"""
+	Rotate the bits of a 64-bit integer to the left
+
+	:param int value:  Value to rotate
+	:param int bits:  Amount of bits to rotate by
+	:return int:  Rotated value
+	"""
+	value = int(value)
+	return ((value << bits) | (value >> (64 - bits))) & 0xFFFFFFFFFFFFFFFF
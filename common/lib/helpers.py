@@ -2,7 +2,9 @@
 Miscellaneous helper functions for the 4CAT backend
 """
 import subprocess
+import threading
 import datetime
+import codecs
 import smtplib
 import socket
 import copy
@@ -264,34 +266,74 @@ def get_4cat_canvas(path, width, height, header=None, footer="made with 4CAT", f
 	return canvas
 
 
+_api_connection = threading.local()
+
+
 def call_api(action, payload=None):
 	"""
 	Send message to server
 
-	Calls the internal API and returns interpreted response.
+	Calls the internal API and returns interpreted response. The connection to
+	the API is kept open and reused for later calls from the same thread.
 
 	:param str action: API action
 	:param payload: API payload
 
 	:return: API response, or timeout message in case of timeout
 	"""
-	connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-	connection.settimeout(15)
-	connection.connect((config.API_HOST, config.API_PORT))
+	msg = json.dumps({"request": action, "payload": payload}).encode("utf-8") + b"\n"
+
+	for attempt in range(0, 2):
+		connection = getattr(_api_connection, "socket", None)
+		reused = connection is not None
+		if not connection:
+			connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+			connection.settimeout(15)
+			connection.connect((config.API_HOST, config.API_PORT))
+			_api_connection.socket = connection
+			_api_connection.buffer = b""
 
-	msg = json.dumps({"request": action, "payload": payload})
-	connection.sendall(msg.encode("ascii", "ignore"))
+		try:
+			connection.sendall(msg)
+
+			buffer = _api_connection.buffer
+			while b"\n" not in buffer:
+				bytes = connection.recv(4096)
+				if not bytes:
+					raise ConnectionError("Connection closed by API")
+				buffer += bytes
+
+			response, _api_connection.buffer = buffer.split(b"\n", 1)
+			response = response.decode("utf-8")
+			break
+		except (socket.timeout, TimeoutError):
+			# the response may still arrive later, so this connection can
+			# no longer be used
+			_close_api_connection()
+			response = "(Connection timed out)"
+			break
+		except OSError:
+			# the API may have closed an idle connection - retry once with a
+			# fresh one
+			_close_api_connection()
+			if not reused:
+				raise
 
 	try:
-		response = ""
-		while True:
-			bytes = connection.recv(2048)
-			if not bytes:
-				break
+		return json.loads(response)
+	except json.JSONDecodeError:
+		return response
 
-			response += bytes.decode("ascii", "ignore")
-	except (socket.timeout, TimeoutError):
-		response = "(Connection timed out)"
+
+def _close_api_connection():
+	"""
+	Close this thread's connection to the internal API, if any
+	"""
+	connection = getattr(_api_connection, "socket", None)
+	_api_connection.socket = None
+	_api_connection.buffer = b""
+	if not connection:
+		return
 
 	try:
 		connection.shutdown(socket.SHUT_RDWR)
@@ -300,11 +342,6 @@ def call_api(action, payload=None):
 		pass
 	connection.close()
 
-	try:
-		return json.loads(response)
-	except json.JSONDecodeError:
-		return response
-
 
 def get_interval_descriptor(item, interval):
 	"""
@@ -346,6 +383,32 @@ def get_interval_descriptor(item, interval):
 		return str(timestamp.year) + "-" + str(timestamp.month).zfill(2) + "-" + str(timestamp.day).zfill(2)
 
 
+def get_baseline_counts(db, datasource, board, interval, metric="posts_per_day"):
+	"""
+	Get totals of a data source metric per interval
+
+	Reads the rollups calculated by the `datasource-metrics` worker, which are
+	only available for local data sources. Useful to relate counts in a
+	dataset to the overall activity in the data source.
+
+	:param db:  Database handler
+	:param str datasource:  Data source ID
+	:param str board:  Board to get totals for, or an empty string for the
+	data source as a whole
+	:param str interval:  Interval, one of "all", "overall", "year",
+	"month", "week", "day"
+	:param str metric:  Metric to get totals of
+	:return dict:  Totals, with the same interval descriptors as keys as
+	returned by `get_interval_descriptor()`
+	"""
+	granularity = "all" if interval in ("all", "overall") else interval
+	totals = db.fetchall(
+		"SELECT date, count FROM metrics_rollups WHERE datasource = %s AND board = %s AND granularity = %s AND metric = %s",
+		(datasource, board if board else "*", granularity, metric))
+
+	return {(interval if granularity == "all" else row["date"]): row["count"] for row in totals}
+
+
 def pad_interval(intervals, first_interval=None, last_interval=None):
 	"""
 	Pad an interval so all intermediate intervals are filled
@@ -519,6 +582,87 @@ def dict_search_and_update(item, keyword_matches, function):
 	loop_helper_function(temp_item, keyword_matches, function)
 	return temp_item
 
+
+def iterate_json_list(handle, chunk_size=1024 * 1024):
+	"""
+	Iterate through the items of a JSON list in a file, one by one
+
+	Reads the file in chunks and parses one item at a time, so the full list
+	never needs to be loaded into memory. This can be used to read e.g. token
+	sets, which are stored as one (potentially very long) list of token lists.
+
+	:param handle:  File-like object to read from, opened in binary or text
+	  mode. Binary files are decoded as UTF-8.
+	:param int chunk_size:  Amount of bytes or characters to read at once
+	:return generator:  Yields the items in the list
+	"""
+	decoder = json.JSONDecoder()
+	utf8 = codecs.getincrementaldecoder("utf-8")()
+	buffer = ""
+	position = 0
+	started = False
+	at_end = False
+
+	def read():
+		chunk = handle.read(chunk_size)
+		if isinstance(chunk, bytes):
+			return utf8.decode(chunk, final=not chunk), bool(chunk)
+		return chunk, bool(chunk)
+
+	while True:
+		# skip whitespace and, within the list, separators
+		while position < len(buffer) and (buffer[position].isspace() or (started and buffer[position] == ",")):
+			position += 1
+
+		if position >= len(buffer):
+			if at_end:
+				raise ValueError("Unexpected end of JSON list")
+
+			# read the next chunk, discarding what has been parsed
+			chunk, has_data = read()
+			buffer = buffer[position:] + chunk
+			position = 0
+			at_end = not has_data
+			continue
+
+		if not started:
+			if buffer[position] != "[":
+				raise ValueError("File does not contain a JSON list")
+			started = True
+			position += 1
+			continue
+
+		if buffer[position] == "]":
+			return
+
+		try:
+			item, end = decoder.raw_decode(buffer, position)
+		except json.JSONDecodeError:
+			if at_end:
+				raise
+
+			# item is not complete yet
+			end = None
+
+		# numbers may continue in the next chunk: they are only complete if
+		# followed by something that cannot be part of a number (e.g. a
+		# split '1.5' is parsed as '1', followed by '.')
+		incomplete_number = end is not None and end < len(buffer) and isinstance(item, (int, float)) \
+							and not isinstance(item, bool) and not (buffer[end].isspace() or buffer[end] in ",]")
+
+		if end is None or ((end >= len(buffer) or incomplete_number) and not at_end):
+			# need more data - items that end exactly at the end of the
+			# buffer may also continue in the next chunk
+			chunk, has_data = read()
+			buffer = buffer[position:] + chunk
+			position = 0
+			at_end = not has_data
+			continue
+
+		yield item
+		position = end
+
+
 def get_last_line(filepath):
 	"""
 	Seeks from end of file for '\n' and returns that line
@@ -12,6 +12,10 @@ class Job:
 	"""
 	Job in queue
 	"""
+	#: PostgreSQL channel on which it is announced that jobs have become
+	#: claimable, i.e. have been added or released
+	notify_channel = "fourcat_jobs"
+
 	data = {}
 	db = None
 
@@ -142,6 +146,7 @@ class Job:
 
 		self.db.update("jobs", data=update,
 					   where={"jobtype": self.data["jobtype"], "remote_id": self.data["remote_id"]})
+		self.db.notify(Job.notify_channel, self.data["jobtype"])
 		self.is_claimed = False
 
 	def update_status(self, status):
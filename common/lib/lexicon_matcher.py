@@ -0,0 +1,201 @@
+"""
+Match text against multiple lexicons in one pass
+"""
+import re
+
+import ahocorasick
+
+
+class LexiconMatcher:
+	"""
+	Multi-pattern matcher
+
+	Determines which of a number of lexicons match a given text. All phrases
+	of all lexicons are compiled into a single Aho-Corasick automaton, so a
+	text only needs to be scanned once regardless of the amount of lexicons
+	or phrases, rather than once per lexicon with a regular expression
+	consisting of an alternation of all of its phrases.
+
+	Phrases only match as whole words, i.e. with the same word boundaries as
+	`\\b` in a regular expression. Phrases may contain `*` wildcards that
+	match any amount of non-whitespace characters. Lexicons may also be
+	defined as a regular expression; these are not included in the automaton
+	but are checked separately.
+
+	.. code-block:: python
+
+		matcher = LexiconMatcher()
+		matcher.add_phrases("animals", ["cat", "dog"])
+		matcher.add_phrases("colours", ["red", "gr*n"], wildcards=True)
+		matcher.compile()
+
+		matcher.match("A green dog")  # {"animals", "colours"}
+	"""
+	#: Whether matching is case sensitive
+	case_sensitive = False
+
+	#: IDs of lexicons that phrases or expressions were added for
+	lexicons = None
+
+	def __init__(self, case_sensitive=False):
+		"""
+		Set up matcher
+
+		:param bool case_sensitive:  Whether matching is case sensitive
+		"""
+		self.case_sensitive = case_sensitive
+		self.lexicons = set()
+
+		self.keys = {}
+		self.expressions = {}
+		self.automaton = None
+
+	def add_phrases(self, lexicon_id, phrases, wildcards=False):
+		"""
+		Add phrases to a lexicon
+
+		:param str lexicon_id:  Lexicon to add the phrases to
+		:param Iterable phrases:  Phrases to add. Empty phrases are ignored.
+		:param bool wildcards:  Interpret `*` in phrases as a wildcard that
+		  matches any amount of non-whitespace characters
+		"""
+		for phrase in phrases:
+			if not phrase:
+				continue
+
+			if not self.case_sensitive:
+				phrase = phrase.lower()
+
+			if not wildcards or "*" not in phrase:
+				# literal phrase; matches if the word boundaries are right
+				self.add_key(phrase, (lexicon_id, None, False))
+				continue
+
+			# wildcard phrase; the automaton looks for its first literal
+			# part, and a regular expression then checks if the full phrase
+			# matches there
+			segments = phrase.split("*")
+			anchor = [segment for segment in segments if segment]
+			expression = r"\b" + r"[^\s]*".join([re.escape(segment) for segment in segments]) + r"\b"
+			if not anchor:
+				# only wildcards, nothing to look for
+				self.add_expression(lexicon_id, expression)
+				continue
+
+			expression = re.compile(expression, flags=0 if self.case_sensitive else re.IGNORECASE)
+			self.add_key(anchor[0], (lexicon_id, expression, not segments[0]))
+
+	def add_expression(self, lexicon_id, expression):
+		"""
+		Add a regular expression to a lexicon
+
+		The lexicon matches if the expression is found anywhere in the text.
+
+		:param str lexicon_id:  Lexicon to add the expression to
+		:param str expression:  Regular expression
+		:raises re.error:  If the expression is invalid
+		"""
+		expression = re.compile(expression, flags=0 if self.case_sensitive else re.IGNORECASE)
+		self.expressions.setdefault(lexicon_id, []).append(expression)
+		self.lexicons.add(lexicon_id)
+
+	def add_key(self, key, entry):
+		"""
+		Add a string for the automaton to look for
+
+		:param str key:  String to look for
+		:param tuple entry:  Lexicon ID, expression to check (or `None` for
+		  literal phrases) and whether the expression may start before the
+		  key
+		"""
+		self.keys.setdefault(key, []).append(entry)
+		self.lexicons.add(entry[0])
+
+	def compile(self):
+		"""
+		Build the automaton
+
+		Needs to be called after adding phrases and before matching.
+		"""
+		self.automaton = ahocorasick.Automaton()
+		for key, entries in self.keys.items():
+			self.automaton.add_word(key, (len(key), entries))
+
+		if self.keys:
+			self.automaton.make_automaton()
+
+	def match(self, text):
+		"""
+		Determine which lexicons match a text
+
+		:param str text:  Text to match
+		:return set:  IDs of matching lexicons
+		"""
+		if not text:
+			return set()
+
+		if not self.case_sensitive:
+			lowered = text.lower()
+			if len(lowered) != len(text):
+				# some characters (e.g. 'İ') lowercase to multiple
+				# characters, which would mess up word boundaries; leave
+				# those as they are
+				lowered = "".join([char.lower() if len(char.lower()) == 1 else char for char in text])
+			text = lowered
+
+		matching = set()
+		if self.keys:
+			for end, (length, entries) in self.automaton.iter(text):
+				start = end - length + 1
+				for lexicon_id, expression, open_start in entries:
+					if lexicon_id in matching:
+						continue
+
+					if expression is None:
+						if is_word_boundary(text, start) and is_word_boundary(text, end + 1):
+							matching.add(lexicon_id)
+
+					elif not open_start:
+						if expression.match(text, start):
+							matching.add(lexicon_id)
+
+					else:
+						# the phrase starts with a wildcard, so it may start
+						# anywhere in the word the key was found in
+						word_start = start
+						while word_start > 0 and not text[word_start - 1].isspace():
+							word_start -= 1
+
+						if any([expression.match(text, offset) for offset in range(word_start, start + 1)]):
+							matching.add(lexicon_id)
+
+				if len(matching) == len(self.lexicons):
+					# no need to look any further
+					return matching
+
+		for lexicon_id, expressions in self.expressions.items():
+			if lexicon_id not in matching and any([expression.search(text) for expression in expressions]):
+				matching.add(lexicon_id)
+
+		return matching
+
+
+is_word_character = re.compile(r"\w").match
+
+
+def is_word_boundary(text, index):
+	"""
+	Check if there is a word boundary at a position in a text
+
+	Equivalent to `\\b` in a regular expression: there is a boundary if
+	exactly one of the characters before and at the position is a word
+	character.
+
+	:param str text:  Text
+	:param int index:  Position to check
+	:return bool:  Whether there is a word boundary
+	"""
+	before = index > 0 and is_word_character(text[index - 1]) is not None
+	after = index < len(text) and is_word_character(text[index]) is not None
+
+	return before != after
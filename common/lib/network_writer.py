@@ -0,0 +1,371 @@
+"""
+Incremental writer for network files
+"""
+import shutil
+import re
+
+from xml.sax.saxutils import escape, quoteattr
+
+from pathlib import Path
+
+
+class NetworkWriter:
+	"""
+	Write nodes and edges to a network file one by one
+
+	Unlike `networkx.write_gexf()`, this does not need the full network to be
+	loaded as a graph object, and does not build an XML tree in memory, so
+	it can be used for networks of any size. Supports GEXF (1.3) and GraphML
+	files; the format is determined by the file's extension unless given
+	explicitly. Use as a context manager:
+
+	.. code-block:: python
+
+		with NetworkWriter(path) as writer:
+			writer.add_node("a", label="Node A", weight=2)
+			writer.add_node("b", label="Node B", weight=2)
+			writer.add_edge("a", "b", weight=2)
+
+	As with NetworkX, node and edge attributes are saved as attributes in the
+	network file, with the following exceptions:
+
+	- `label` is used as the node label
+	- `weight` is used as the edge weight (and saved as a node attribute)
+	- `viz` may be a dictionary with a `position` (with `x` and `y`) and
+	  `size`, which are saved as GEXF visualisation attributes
+	- `spells` may be a list of (start, end) tuples during which the node or
+	  edge exists
+	- Attributes with a list of (value, start, end) tuples as value are saved
+	  as dynamic attributes
+
+	Since the file needs to declare all attributes before listing nodes and
+	edges, these are written to temporary files next to the network file
+	first and copied into the file when the writer is closed.
+	"""
+	#: Path of the file being written
+	path = None
+
+	#: File format: `gexf` or `graphml`
+	format = None
+
+	#: Whether edges are directed
+	directed = False
+
+	#: Amount of nodes written so far
+	num_nodes = 0
+
+	#: Amount of edges written so far
+	num_edges = 0
+
+	# characters that cannot be used in XML documents
+	invalid_characters = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+	def __init__(self, path, directed=False, graph_attributes=None, format=None):
+		"""
+		Set up writer
+
+		:param Path path:  File to write to. Will be overwritten.
+		:param bool directed:  Whether edges are directed
+		:param dict graph_attributes:  Attributes of the graph, saved as
+		  metadata
+		:param str format:  `gexf` or `graphml`; if `None`, this is
+		  determined from the extension of `path`, defaulting to `gexf`
+		"""
+		self.path = Path(path)
+		self.format = format if format else self.path.suffix.lower()[1:]
+		if self.format not in ("gexf", "graphml"):
+			self.format = "gexf"
+
+		self.directed = directed
+		self.graph_attributes = graph_attributes if graph_attributes else {}
+		self.num_nodes = 0
+		self.num_edges = 0
+
+		# attribute declarations per class: title -> [ID, type, is dynamic]
+		self.attributes = {"node": {}, "edge": {}}
+		self.time_format = None
+
+		self.node_path = self.path.with_name(self.path.name + ".nodes")
+		self.edge_path = self.path.with_name(self.path.name + ".edges")
+		self.node_file = None
+		self.edge_file = None
+
+	def __enter__(self):
+		"""
+		Open temporary files for writing
+
+		:return NetworkWriter:  This writer
+		"""
+		self.node_file = self.node_path.open("w", encoding="utf-8")
+		self.edge_file = self.edge_path.open("w", encoding="utf-8")
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		"""
+		Write network file and remove temporary files
+		"""
+		try:
+			self.node_file.close()
+			self.edge_file.close()
+			if exc_type is None:
+				self.write_file()
+		finally:
+			for path in (self.node_path, self.edge_path):
+				if path.exists():
+					path.unlink()
+
+		return False
+
+	def add_node(self, key, **attributes):
+		"""
+		Write a node
+
+		:param str key:  Node ID
+		:param attributes:  Node attributes
+		"""
+		label = attributes.pop("label", key)
+		if self.format == "graphml":
+			attributes["label"] = label
+			self.node_file.write("    <node id=%s>\n%s    </node>\n" % (
+				self.quote(key), self.serialise_graphml("node", attributes)))
+		else:
+			self.node_file.write("      <node id=%s label=%s>\n%s      </node>\n" % (
+				self.quote(key), self.quote(label), self.serialise_gexf("node", attributes)))
+
+		self.num_nodes += 1
+
+	def add_edge(self, source, target, **attributes):
+		"""
+		Write an edge
+
+		:param str source:  ID of source node
+		:param str target:  ID of target node
+		:param attributes:  Edge attributes
+		"""
+		if self.format == "graphml":
+			self.edge_file.write("    <edge source=%s target=%s>\n%s    </edge>\n" % (
+				self.quote(source), self.quote(target), self.serialise_graphml("edge", attributes)))
+		else:
+			weight = attributes.pop("weight", None)
+			self.edge_file.write("      <edge id=\"%i\" source=%s target=%s%s>\n%s      </edge>\n" % (
+				self.num_edges, self.quote(source), self.quote(target),
+				(" weight=%s" % self.quote(weight)) if weight is not None else "",
+				self.serialise_gexf("edge", attributes)))
+
+		self.num_edges += 1
+
+	def serialise_gexf(self, element_class, attributes):
+		"""
+		Serialise node or edge attributes as GEXF
+
+		:param str element_class:  `node` or `edge`
+		:param dict attributes:  Attributes
+		:return str:  XML for the attributes
+		"""
+		viz = attributes.pop("viz", None)
+		spells = attributes.pop("spells", None)
+
+		xml = ""
+		attvalues = ""
+		for title, value in attributes.items():
+			if value is None:
+				continue
+
+			if type(value) is list:
+				# dynamic attribute
+				attribute_id = self.declare(element_class, title, value[0][0] if value else "", dynamic=True)
+				for attvalue, start, end in value:
+					self.declare_time(start)
+					attvalues += "          <attvalue for=\"%s\" value=%s start=%s end=%s />\n" % (
+						attribute_id, self.quote(attvalue), self.quote(start), self.quote(end))
+			else:
+				attribute_id = self.declare(element_class, title, value)
+				attvalues += "          <attvalue for=\"%s\" value=%s />\n" % (attribute_id, self.quote(value))
+
+		if attvalues:
+			xml += "        <attvalues>\n" + attvalues + "        </attvalues>\n"
+
+		if spells:
+			xml += "        <spells>\n"
+			for start, end in spells:
+				self.declare_time(start)
+				xml += "          <spell start=%s end=%s />\n" % (self.quote(start), self.quote(end))
+			xml += "        </spells>\n"
+
+		if viz:
+			if "size" in viz:
+				xml += "        <viz:size value=%s />\n" % self.quote(viz["size"])
+			if "position" in viz:
+				xml += "        <viz:position x=%s y=%s z=\"0.0\" />\n" % (
+					self.quote(viz["position"]["x"]), self.quote(viz["position"]["y"]))
+
+		return xml
+
+	def serialise_graphml(self, element_class, attributes):
+		"""
+		Serialise node or edge attributes as GraphML
+
+		GraphML has no notion of dynamic attributes or visualisation
+		attributes; dynamic attributes and spells are saved as their string
+		representation, and the position and size as `x`, `y` and `size`.
+
+		:param str element_class:  `node` or `edge`
+		:param dict attributes:  Attributes
+		:return str:  XML for the attributes
+		"""
+		viz = attributes.pop("viz", None)
+		if viz:
+			if "position" in viz:
+				attributes["x"] = viz["position"]["x"]
+				attributes["y"] = viz["position"]["y"]
+			if "size" in viz:
+				attributes["size"] = viz["size"]
+
+		xml = ""
+		for title, value in attributes.items():
+			if value is None:
+				continue
+
+			if type(value) is list:
+				value = str(value)
+
+			attribute_id = self.declare(element_class, title, value)
+			xml += "      <data key=\"d%s\">%s</data>\n" % (attribute_id, escape(self.to_string(value)))
+
+		return xml
+
+	def declare(self, element_class, title, value, dynamic=False):
+		"""
+		Declare an attribute
+
+		If the attribute was declared before with a different type, its
+		type is changed to one that fits both values.
+
+		:param str element_class:  `node` or `edge`
+		:param str title:  Attribute name
+		:param value:  Attribute value, used to determine its type
+		:param bool dynamic:  Whether this is a dynamic attribute
+		:return int:  Attribute ID
+		"""
+		if type(value) is bool:
+			value_type = "boolean"
+		elif type(value) is int:
+			value_type = "long"
+		elif type(value) is float:
+			value_type = "double"
+		else:
+			value_type = "string"
+
+		declarations = self.attributes[element_class]
+		if title not in declarations:
+			attribute_id = len(self.attributes["node"]) + len(self.attributes["edge"])
+			declarations[title] = [attribute_id, value_type, dynamic]
+		elif declarations[title][1] != value_type:
+			numeric = ("long", "double")
+			declarations[title][1] = "double" if value_type in numeric and declarations[title][1] in numeric else "string"
+
+		return declarations[title][0]
+
+	def declare_time(self, moment):
+		"""
+		Determine the time format of the network from a spell boundary
+
+		:param moment:  Start or end of a spell
+		"""
+		if not self.time_format:
+			self.time_format = "date" if type(moment) is str else "double"
+
+	def write_file(self):
+		"""
+		Write the network file, including the nodes and edges written so far
+		"""
+		with self.path.open("w", encoding="utf-8") as output:
+			if self.format == "graphml":
+				output.write("<?xml version='1.0' encoding='utf-8'?>\n")
+				output.write("<graphml xmlns=\"http://graphml.graphdrawing.org/xmlns\" "
+							 "xmlns:xsi=\"http://www.w3.org/2001/XMLSchema-instance\" "
+							 "xsi:schemaLocation=\"http://graphml.graphdrawing.org/xmlns "
+							 "http://graphml.graphdrawing.org/xmlns/1.0/graphml.xsd\">\n")
+				for element_class, declarations in self.attributes.items():
+					for title, (attribute_id, value_type, dynamic) in declarations.items():
+						output.write("  <key id=\"d%s\" for=\"%s\" attr.name=%s attr.type=\"%s\" />\n" % (
+							attribute_id, element_class, self.quote(title), value_type))
+
+				for title, value in self.graph_attributes.items():
+					output.write("  <desc>%s: %s</desc>\n" % (escape(title), escape(self.to_string(value))))
+
+				output.write("  <graph edgedefault=\"%s\">\n" % ("directed" if self.directed else "undirected"))
+				self.copy_file(self.node_path, output)
+				self.copy_file(self.edge_path, output)
+				output.write("  </graph>\n</graphml>\n")
+
+			else:
+				is_dynamic = bool(self.time_format)
+				output.write("<?xml version='1.0' encoding='utf-8'?>\n")
+				output.write("<gexf xmlns=\"http://gexf.net/1.3\" version=\"1.3\" "
+							 "xmlns:viz=\"http://gexf.net/1.3/viz\" "
+							 "xmlns:xsi=\"http://www.w3.org/2001/XMLSchema-instance\" "
+							 "xsi:schemaLocation=\"http://gexf.net/1.3 http://gexf.net/1.3/gexf.xsd\">\n")
+				output.write("  <meta>\n")
+				output.write("    <creator>%s</creator>\n" % escape(
+					self.to_string(self.graph_attributes.get("generated_by", "4CAT Capture & Analysis Toolkit"))))
+				description = "; ".join(["%s: %s" % (title, self.to_string(value)) for title, value in
+										 self.graph_attributes.items() if title != "generated_by"])
+				if description:
+					output.write("    <description>%s</description>\n" % escape(description))
+				output.write("  </meta>\n")
+
+				output.write("  <graph defaultedgetype=\"%s\" mode=\"%s\"%s>\n" % (
+					"directed" if self.directed else "undirected", "dynamic" if is_dynamic else "static",
+					(" timeformat=\"%s\"" % self.time_format) if is_dynamic else ""))
+
+				for element_class, declarations in self.attributes.items():
+					for dynamic in (False, True):
+						attributes = [(title, declaration) for title, declaration in declarations.items() if
+									  declaration[2] == dynamic]
+						if not attributes:
+							continue
+
+						output.write("    <attributes class=\"%s\" mode=\"%s\">\n" % (
+							element_class, "dynamic" if dynamic else "static"))
+						for title, (attribute_id, value_type, is_dynamic) in attributes:
+							output.write("      <attribute id=\"%s\" title=%s type=\"%s\" />\n" % (
+								attribute_id, self.quote(title), value_type))
+						output.write("    </attributes>\n")
+
+				output.write("    <nodes>\n")
+				self.copy_file(self.node_path, output)
+				output.write("    </nodes>\n    <edges>\n")
+				self.copy_file(self.edge_path, output)
+				output.write("    </edges>\n  </graph>\n</gexf>\n")
+
+	def copy_file(self, path, output):
+		"""
+		Copy the contents of a temporary file to the output file
+
+		:param Path path:  File to copy
+		:param output:  File handle to copy to
+		"""
+		with path.open(encoding="utf-8") as infile:
+			shutil.copyfileobj(infile, output)
+
+	def quote(self, value):
+		"""
+		Get a value as a quoted XML attribute value
+
+		:param value:  Value
+		:return str:  Quoted value
+		"""
+		return quoteattr(self.to_string(value))
+
+	def to_string(self, value):
+		"""
+		Convert a value to a string that can be used in an XML document
+
+		:param value:  Value
+		:return str:  String
+		"""
+		if type(value) is bool:
+			return "true" if value else "false"
+
+		return self.invalid_characters.sub("", str(value))
@@ -101,6 +101,55 @@ class JobQueue:
 
 		return [Job.get_by_data(job, self.db) for job in jobs if job]
 
+	def claim_jobs(self, slots):
+		"""
+		Claim claimable jobs, for a number of job types at once
+
+		Jobs are claimed in a single query; jobs that are locked by another
+		transaction (e.g. because another 4CAT backend is claiming them at the
+		same time) are skipped, so a job can never be claimed twice. Per job
+		type, the oldest claimable jobs are claimed first.
+
+		:param dict slots:  Job type => the maximum amount of jobs of that
+		type to claim
+		:return list:  Claimed jobs, as `Job` objects
+		"""
+		slots = {jobtype: amount for jobtype, amount in slots.items() if amount > 0}
+		if not slots:
+			return []
+
+		now = int(time.time())
+		jobtypes = list(slots.keys())
+		amounts = [slots[jobtype] for jobtype in jobtypes]
+
+		# the claim time of repeating jobs is a multiple of the interval; see
+		# Job.claim()
+		try:
+			jobs = self.db.fetchall((
+				"UPDATE jobs SET"
+				"       timestamp_claimed = CASE WHEN interval = 0 THEN %s ELSE (%s / interval) * interval END,"
+				"       timestamp_lastclaimed = CASE WHEN interval = 0 THEN %s ELSE (%s / interval) * interval END"
+				" WHERE id IN ("
+				"       SELECT claimable.id FROM unnest(%s::text[], %s::integer[]) AS slots(jobtype, amount)"
+				"       CROSS JOIN LATERAL ("
+				"           SELECT id FROM jobs"
+				"            WHERE jobs.jobtype = slots.jobtype"
+				"              AND timestamp_claimed = 0"
+				"              AND timestamp_after < %s"
+				"              AND (interval = 0 OR timestamp_lastclaimed + interval < %s)"
+				"         ORDER BY timestamp ASC"
+				"            LIMIT slots.amount"
+				"              FOR UPDATE SKIP LOCKED"
+				"       ) AS claimable"
+				" )"
+				" RETURNING *"),
+				(now, now, now, now, jobtypes, amounts, now, now))
+		except psycopg2.ProgrammingError:
+			# see get_all_jobs()
+			jobs = []
+
+		return [Job.get_by_data(job, self.db) for job in sorted(jobs, key=lambda job: job["timestamp"])]
+
 	def get_job_count(self, jobtype="*"):
 		"""
 		Get total number of jobs
@@ -115,6 +164,31 @@ class JobQueue:
 
 		return int(count["count"])
 
+	def get_job_stats(self):
+		"""
+		Get amount of queued jobs and age of the oldest queued job per job type
+
+		Like `get_all_jobs()`, only jobs that are unclaimed and may be claimed
+		are counted; running jobs and recurring jobs that are not due yet are
+		not. The age of the oldest job only takes into account jobs that are
+		not recurring, since recurring jobs stay in the queue indefinitely.
+
+		:return dict:  Job type -> `{"queued": int, "oldest": int|None}`, with
+		the oldest job's timestamp, or `None` if there are only recurring jobs
+		of that type
+		"""
+		now = int(time.time())
+		stats = self.db.fetchall(
+			"SELECT jobtype, COUNT(*) AS num, MIN(timestamp) FILTER (WHERE interval = 0) AS oldest"
+			"  FROM jobs"
+			" WHERE jobtype != ''"
+			"   AND timestamp_claimed = 0"
+			"   AND timestamp_after < %s"
+			"   AND (interval = 0 OR timestamp_lastclaimed + interval < %s)"
+			" GROUP BY jobtype", (now, now))
+
+		return {row["jobtype"]: {"queued": row["num"], "oldest": row["oldest"]} for row in stats}
+
 	def add_job(self, jobtype, details=None, remote_id=0, claim_after=0, interval=0):
 		"""
 		Add a new job to the queue
@@ -148,9 +222,48 @@ class JobQueue:
 		}
 
 		self.db.insert("jobs", data, safe=True, constraints=("jobtype", "remote_id"))
+		self.db.notify(Job.notify_channel, jobtype)
 
 		return Job.get_by_data(data, database=self.db)
 
+	def add_jobs(self, jobs):
+		"""
+		Add multiple new jobs to the queue at once
+
+		Like `add_job()`, but jobs are inserted with a single query. Jobs that
+		already exist for a given combination of job type and remote ID are
+		skipped.
+
+		:param list jobs:  List of jobs, as dictionaries with a `jobtype` and
+		`remote_id` and optionally `details`, `claim_after` and `interval`
+		keys, which are interpreted as the arguments of `add_job()`
+		:return int:  Number of jobs that were added
+		"""
+		now = int(time.time())
+		rows = {}
+		for job in jobs:
+			# skip duplicates within the batch itself, which would make the
+			# whole query fail
+			rows[(job["jobtype"], str(job["remote_id"]))] = {
+				"jobtype": job["jobtype"],
+				"details": json.dumps(job.get("details")),
+				"timestamp": now,
+				"timestamp_claimed": 0,
+				"timestamp_lastclaimed": 0,
+				"remote_id": job["remote_id"],
+				"timestamp_after": job.get("claim_after", 0),
+				"interval": job.get("interval", 0),
+				"attempts": 0
+			}
+
+		if not rows:
+			return 0
+
+		added = self.db.insert_many("jobs", list(rows.values()), safe=True, constraints=("jobtype", "remote_id"))
+		self.db.notify(Job.notify_channel)
+
+		return added
+
 	def release_all(self):
 		"""
 		Release all jobs
@@ -158,8 +271,29 @@ class JobQueue:
 		All claimed jobs are released. This is useful to run when the backend is restarted.
 		"""
 		self.db.execute("UPDATE jobs SET timestamp_claimed = 0")
+		self.db.notify(Job.notify_channel)
 
+	def get_next_claim_time(self):
+		"""
+		Get the time at which the next currently unclaimable job may be
+		claimed
+
+		Jobs that cannot be claimed yet, because they have a `claim_after`
+		time in the future or are repeating jobs whose interval has not
+		passed yet, do not trigger a notification when they become claimable.
+		This method can be used to determine when to check for those.
 
+		:return int|None:  Timestamp, or `None` if there are no such jobs
+		"""
+		next_claim = self.db.fetchone((
+			"SELECT MIN(claimable_from) AS next_claim FROM ("
+			"  SELECT GREATEST(timestamp_after, CASE WHEN interval > 0 THEN timestamp_lastclaimed + interval ELSE 0 END) AS claimable_from"
+			"    FROM jobs"
+			"   WHERE timestamp_claimed = 0"
+			") AS unclaimed WHERE claimable_from >= %s"),
+			(int(time.time()),))
+
+		return next_claim["next_claim"] if next_claim else None
 
 	def get_place_in_queue(self, job):
 		"""
@@ -0,0 +1,185 @@
+"""
+Incremental writer for dataset result files
+"""
+import json
+import csv
+
+from pathlib import Path
+
+csv.field_size_limit(1024 * 1024 * 1024)
+
+
+class ResultWriter:
+	"""
+	Write items to a result file one by one
+
+	Items are written as they come in, so the full result set never needs to
+	be kept in memory. Supports CSV, NDJSON and Parquet files; the format is
+	determined by the file's extension unless given explicitly. Use as a
+	context manager:
+
+	.. code-block:: python
+
+		with ResultWriter(path) as writer:
+			for item in items:
+				writer.write(item)
+
+		dataset.finish(writer.num_rows)
+
+	For CSV and Parquet files, the columns are those of the first item
+	written, unless `fieldnames` are given. Items missing a column get an
+	empty value for it; items with columns that are not in the header raise
+	a `ValueError`. As in result files written elsewhere, Parquet values are
+	stored as strings.
+	"""
+	#: Path of the file being written
+	path = None
+
+	#: File format: `csv`, `ndjson` or `parquet`
+	format = None
+
+	#: Columns of the file, `None` until known
+	fieldnames = None
+
+	#: Amount of items written so far
+	num_rows = 0
+
+	#: Amount of items to write to a Parquet file at once
+	batch_size = 10000
+
+	def __init__(self, path, fieldnames=None, format=None, batch_size=None):
+		"""
+		Set up writer
+
+		:param Path path:  File to write to. Will be overwritten.
+		:param list fieldnames:  Columns of the file. If `None`, the keys of
+		  the first item are used.
+		:param str format:  `csv`, `ndjson` or `parquet`; if `None`, this is
+		  determined from the extension of `path`, defaulting to `csv`
+		:param int batch_size:  Amount of items to write to a Parquet file
+		  at once
+		"""
+		self.path = Path(path)
+		self.format = format if format else self.path.suffix.lower()[1:]
+		if self.format not in ("csv", "ndjson", "parquet"):
+			self.format = "csv"
+
+		self.fieldnames = list(fieldnames) if fieldnames is not None else None
+		self.num_rows = 0
+		if batch_size:
+			self.batch_size = batch_size
+
+		self.handle = None
+		self.writer = None
+		self.schema = None
+		self.schema_fields = set()
+		self.batch = []
+
+	def __enter__(self):
+		"""
+		Open file for writing
+
+		:return ResultWriter:  This writer
+		"""
+		if self.format == "parquet":
+			# the writer is set up once the columns are known
+			self.handle = None
+		else:
+			self.handle = self.path.open("w", encoding="utf-8", newline="")
+
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		"""
+		Write remaining items and close file
+
+		If no items were written, a CSV file will still have a header if the
+		columns were declared, and a Parquet file will only be written if the
+		columns were declared.
+		"""
+		try:
+			if exc_type is None:
+				if self.format == "csv" and not self.writer and self.fieldnames is not None:
+					self.start_csv()
+				elif self.format == "parquet":
+					if not self.writer and self.fieldnames is not None:
+						self.start_parquet()
+					self.flush()
+		finally:
+			if self.format == "parquet" and self.writer:
+				self.writer.close()
+			elif self.handle:
+				self.handle.close()
+
+		return False
+
+	def write(self, item):
+		"""
+		Write an item
+
+		:param dict item:  Item to write
+		"""
+		if self.fieldnames is None:
+			self.fieldnames = list(item.keys())
+
+		if self.format == "ndjson":
+			self.handle.write(json.dumps(item) + "\n")
+
+		elif self.format == "csv":
+			if not self.writer:
+				self.start_csv()
+			self.writer.writerow(item)
+
+		else:
+			if not self.writer:
+				self.start_parquet()
+
+			extra = [field for field in item if field not in self.schema_fields]
+			if extra:
+				raise ValueError("Item contains fields not in the file's columns: %s" % ", ".join(extra))
+
+			self.batch.append(item)
+			if len(self.batch) >= self.batch_size:
+				self.flush()
+
+		self.num_rows += 1
+
+	def write_many(self, items):
+		"""
+		Write multiple items
+
+		:param Iterable items:  Items to write
+		"""
+		for item in items:
+			self.write(item)
+
+	def start_csv(self):
+		"""
+		Set up CSV writer and write header
+		"""
+		self.writer = csv.DictWriter(self.handle, fieldnames=self.fieldnames, restval="")
+		self.writer.writeheader()
+
+	def start_parquet(self):
+		"""
+		Set up Parquet writer
+		"""
+		import pyarrow
+		import pyarrow.parquet as pq
+
+		self.schema = pyarrow.schema([(field, pyarrow.string()) for field in self.fieldnames])
+		self.schema_fields = set(self.fieldnames)
+		self.writer = pq.ParquetWriter(str(self.path), self.schema)
+
+	def flush(self):
+		"""
+		Write buffered items to a Parquet file
+		"""
+		if not self.batch:
+			return
+
+		import pyarrow
+
+		columns = {field: [None if item.get(field) is None else str(item.get(field)) for item in self.batch] for field in self.fieldnames}
+		self.writer.write_table(pyarrow.Table.from_pydict(columns, schema=self.schema))
+		self.batch = []
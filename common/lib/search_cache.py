@@ -0,0 +1,134 @@
+"""
+Cache of search results, to reuse for identical queries
+"""
+import hashlib
+import time
+import json
+
+
+class SearchCache:
+	"""
+	Search result cache
+
+	Maps normalised search parameters to the key of a finished dataset that
+	was created with those parameters. The results of that dataset can then
+	be reused for later searches with the same parameters, rather than
+	running the same (potentially heavy) query again.
+
+	Cached results are invalidated when new data is added to the data source
+	they were collected from, within the time window (and for the board, if
+	applicable) that was searched, or when the cached results are older than
+	a given amount of seconds.
+	"""
+	db = None
+
+	def __init__(self, db):
+		"""
+		Set up cache
+
+		:param db:  Database handler
+		"""
+		self.db = db
+
+	@staticmethod
+	def get_cache_key(type, parameters):
+		"""
+		Get a cache key for a combination of search type and parameters
+
+		:param str type:  Search type, e.g. `4chan-search`
+		:param dict parameters:  Normalised search parameters
+		:return str:  Cache key
+		"""
+		plain_key = json.dumps({"type": type, "parameters": parameters}, sort_keys=True, default=str)
+		return hashlib.sha256(plain_key.encode("utf-8")).hexdigest()
+
+	def get(self, cache_key, max_age=0):
+		"""
+		Get the key of a dataset with cached results
+
+		:param str cache_key:  Cache key, see `get_cache_key()`
+		:param int max_age:  Ignore cached results older than this many
+		seconds. `0` to not restrict by age.
+		:return str|None:  Dataset key, or `None` if nothing was cached for
+		this key
+		"""
+		cached = self.db.fetchone("SELECT * FROM search_cache WHERE cache_key = %s", (cache_key,))
+		if not cached:
+			return None
+
+		if max_age and cached["timestamp"] < time.time() - max_age:
+			self.delete(cache_key)
+			return None
+
+		return cached["dataset"]
+
+	def add(self, cache_key, dataset, datasource, board="", min_date=0, max_date=0):
+		"""
+		Cache the results of a dataset
+
+		:param str cache_key:  Cache key, see `get_cache_key()`
+		:param str dataset:  Key of the dataset with the results
+		:param str datasource:  Data source the results were collected from
+		:param str board:  Board that was searched, or an empty string (or
+		`*`) if results were not restricted to a board
+		:param int min_date:  Start of the searched time window, `0` if
+		unrestricted
+		:param int max_date:  End of the searched time window, `0` if
+		unrestricted
+		"""
+		# searches across all boards are stored without a board, so they are
+		# invalidated when data is added to any board
+		if board == "*":
+			board = ""
+
+		self.db.upsert("search_cache", data={
+			"cache_key": cache_key,
+			"dataset": dataset,
+			"datasource": datasource,
+			"board": board if board else "",
+			"min_date": min_date if min_date else 0,
+			"max_date": max_date if max_date else 0,
+			"timestamp": int(time.time())
+		}, constraints=("cache_key",))
+
+	def delete(self, cache_key):
+		"""
+		Remove results from the cache
+
+		:param str cache_key:  Cache key, see `get_cache_key()`
+		"""
+		self.db.delete("search_cache", where={"cache_key": cache_key})
+
+	def invalidate(self, datasource, board=None, min_timestamp=0, max_timestamp=0):
+		"""
+		Invalidate cached results after data was added to a data source
+
+		All cached results for the data source that may include the new data
+		are removed from the cache, i.e. results for searches in the same
+		board (or across boards) whose time window overlaps with the time span
+		of the new data.
+
+		:param str datasource:  Data source to which data was added
+		:param str board:  Board to which data was added, or `None` to
+		invalidate results for all boards
+		:param int min_timestamp:  Timestamp of the earliest added item, `0`
+		if unknown
+		:param int max_timestamp:  Timestamp of the latest added item, `0` if
+		unknown
+		"""
+		where = ["datasource = %s"]
+		replacements = [datasource]
+
+		if board:
+			where.append("board IN ('', %s)")
+			replacements.append(board)
+
+		if max_timestamp:
+			where.append("min_date <= %s")
+			replacements.append(max_timestamp)
+
+		if min_timestamp:
+			where.append("(max_date = 0 OR max_date >= %s)")
+			replacements.append(min_timestamp)
+
+		self.db.execute("DELETE FROM search_cache WHERE " + " AND ".join(where), replacements)
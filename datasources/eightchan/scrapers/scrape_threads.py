@@ -38,11 +38,11 @@ class ThreadScraper8chan(ThreadScraper4chan):
 		url = "https://8kun.net/%s/res/%s.json" % (self.job.details["board"], thread_id)
 		return url
 
-	def queue_image(self, post, thread):
+	def queue_images(self, posts, thread):
 		"""
 		We're not scraping images for 8chan
 
-		:param post:  Post data
+		:param posts:  Post data
 		:param thread:   Thread data
 		"""
 		pass
\ No newline at end of file
@@ -16,8 +16,9 @@ Flow:
    -> create separate sets of new posts and deleted posts
    -> mark deleted posts as deleted
    -> add new posts to database
-      -> save_post(): save post data to database
-         -> queue_image(): if an image was attached, queue a job to scrape it
+      -> save_posts(): save data for all new posts to database at once
+         -> get_post_data(): map scraped post data to a database row
+         -> queue_images(): queue jobs to scrape attached images
    -> update_thread(): update thread data
 """
 import requests
@@ -32,8 +33,8 @@ import six
 from pathlib import Path
 
 from backend.abstract.scraper import BasicJSONScraper
-from common.lib.exceptions import JobAlreadyExistsException
 from common.lib.helpers import strip_tags
+from common.lib.search_cache import SearchCache
 
 import config
 
@@ -113,19 +114,17 @@ class ThreadScraper4chan(BasicJSONScraper):
 
 		# mark deleted posts as such
 		deleted = set(post_dict_db.keys()) - set(post_dict_scrape.keys())
-		for post_id in deleted:
-			self.db.upsert("posts_%s_deleted" % self.prefix, data={"id_seq": post_id_map[post_id], "timestamp_deleted": self.init_time}, constraints=["id_seq"], commit=False)
+		if deleted:
+			self.db.execute_many(
+				"INSERT INTO posts_" + self.prefix + "_deleted (id_seq, timestamp_deleted) VALUES %s"
+				" ON CONFLICT (id_seq) DO UPDATE SET timestamp_deleted = EXCLUDED.timestamp_deleted",
+				replacements=[(post_id_map[post_id], self.init_time) for post_id in deleted], commit=False)
 		self.db.commit()
 
 		# add new posts
 		new = set(post_dict_scrape.keys()) - set(post_dict_db.keys())
-		new_posts = 0
-		new_ids = set()
-		for post_id in new:
-			added = self.save_post(post_dict_scrape[post_id], thread, first_post)
-			if added:
-				new_posts += 1
-				new_ids.add(added)
+		new_ids = set(self.save_posts([post_dict_scrape[post_id] for post_id in new], thread, first_post))
+		new_posts = len(new_ids)
 
 		all_ids = set([post_id_map[post_id] for post_id in post_dict_scrape.keys() if post_id in post_id_map]).union(new_ids)
 		undeleted = 0
@@ -144,20 +143,90 @@ class ThreadScraper4chan(BasicJSONScraper):
 		# return the amount of new posts
 		return new_posts
 
-	def save_post(self, post, thread, first_post):
+	def save_posts(self, posts, thread, first_post):
 		"""
-		Add post to database
+		Add posts to database
+
+		All posts are inserted with a single query. Posts that are already in
+		the database (e.g. because they were scraped as part of another
+		thread) are skipped.
+
+		:param list posts: Data of posts to add
+		:param dict thread: Data for thread the posts belong to
+		:param dict first_post:  First post in thread
+		:return list:  Sequential IDs of the posts that were inserted
+		"""
+		rows = {}
+		for post in posts:
+			post_data = self.get_post_data(post, thread, first_post)
+			if post_data:
+				rows[post_data["id"]] = (post, post_data)
+
+		if not rows:
+			return []
+
+		table = "posts_" + self.prefix
+		invalid = set()
+		try:
+			inserted = self.db.insert_many(table, [row[1] for row in rows.values()], safe=True,
+										   constraints=("id", "board"), return_field=("id", "id_seq"))
+		except (ValueError, psycopg2.DataError):
+			# a single invalid post would make the whole batch fail, so
+			# insert the posts one by one instead to save the valid ones
+			self.db.rollback()
+			inserted = []
+			for post, post_data in rows.values():
+				try:
+					inserted.extend(self.db.insert_many(table, [post_data], safe=True, constraints=("id", "board"),
+														return_field=("id", "id_seq")))
+				except (ValueError, psycopg2.DataError) as e:
+					self.db.rollback()
+					invalid.add(post_data["id"])
+					self.log.error("%s (%s) during scrape of thread %s" % (e.__class__.__name__, e, post["no"]))
+
+		# other posts that were not inserted were already in the database
+		inserted_ids = set([row["id"] for row in inserted])
+		skipped = set(rows.keys()) - inserted_ids - invalid
+		if skipped:
+			dupes = self.db.fetchall("SELECT id, thread_id, timestamp FROM " + table + " WHERE board = %s AND id IN %s",
+									 (self.job.details["board"], tuple(skipped)))
+			dupes = {dupe["id"]: dupe for dupe in dupes}
+			for post_id in skipped:
+				post = rows[post_id][0]
+				if post_id in dupes:
+					dupe = dupes[post_id]
+					self.log.info("Post %s in thread %s/%s/%s (time: %s) scraped twice: first seen as %s in thread %s at %s" % (
+						post["no"], self.datasource, thread["board"], thread["id"], post["time"], dupe["id"], dupe["thread_id"], dupe["timestamp"]))
+				else:
+					self.log.error("Post %s in thread %s/%s/%s could not be inserted but no dupe was found?" % (
+						post["no"], self.datasource, thread["board"], thread["id"]))
+
+		# cached search results for this board may be missing the new posts
+		if inserted_ids:
+			timestamps = [rows[post_id][1]["timestamp"] for post_id in inserted_ids]
+			SearchCache(self.db).invalidate(self.datasource, board=self.job.details["board"],
+												min_timestamp=min(timestamps), max_timestamp=max(timestamps))
+
+		# Download images (exclude .webm files)
+		self.queue_images([rows[post_id][0] for post_id in rows if post_id in inserted_ids and "filename" in rows[post_id][0] and rows[post_id][0]["ext"] != ".webm"], thread)
+
+		return [row["id_seq"] for row in inserted]
+
+	def get_post_data(self, post, thread, first_post):
+		"""
+		Get database row for a scraped post
 
 		:param dict post: Post data to add
 		:param dict thread: Data for thread the post belongs to
 		:param dict first_post:  First post in thread
-		:return bool:  Whether the post was inserted
+		:return dict|None:  Post data, as it is to be inserted into the
+		database, or `None` if the post is invalid
 		"""
 		# check for data integrity
 		missing = set(self.required_fields) - set(post.keys())
 		if missing != set():
 			self.log.warning("Missing fields %s in scraped post in %s/%s, ignoring" % (repr(missing), self.datasource, self.job.data["remote_id"]))
-			return False
+			return None
 
 		# save dimensions as a dumpable dict - no need to make it indexable
 		if len({"w", "h", "tn_h", "tn_w"} - set(post.keys())) == 0:
@@ -224,69 +293,49 @@ class ThreadScraper4chan(BasicJSONScraper):
 				except requests.RequestException as e:
 					self.log.warning("Could not send highlight alerts to Slack webhook (%s)" % e)
 
+		for field in post_data:
+			if not isinstance(post_data[field], six.string_types):
+				continue
+			# apparently, sometimes \0 appears in posts or something; psycopg2 can't cope with this
+			post_data[field] = post_data[field].replace("\0", "")
 
-		# now insert the post into the database
-		return_value = True
-		try:
-			for field in post_data:
-				if not isinstance(post_data[field], six.string_types):
-					continue
-				# apparently, sometimes \0 appears in posts or something; psycopg2 can't cope with this
-				post_data[field] = post_data[field].replace("\0", "")
-
-			return_value = self.db.insert("posts_" + self.prefix, post_data, return_field="id_seq")
-		except psycopg2.IntegrityError as e:
-			self.db.rollback()
-			dupe = self.db.fetchone("SELECT * from posts_" + self.prefix + " WHERE id = %s" % (str(post["no"]),))
-			if dupe:
-				self.log.info("Post %s in thread %s/%s/%s (time: %s) scraped twice: first seen as %s in thread %s at %s" % (
-				 post["no"], self.datasource, thread["board"], thread["id"], post["time"], dupe["id"], dupe["thread_id"], dupe["timestamp"]))
-			else:
-				self.log.error("Post %s in thread %s/%s/%s hit database constraint (%s) but no dupe was found?" % (
-				post["no"], self.datasource, thread["board"], thread["id"], e))
-
-			return False
-		except ValueError as e:
-			self.db.rollback()
-			self.log.error("ValueError (%s) during scrape of thread %s" % (e, post["no"]))
-
-		# Download images (exclude .webm files)
-		if "filename" in post and post["ext"] != ".webm":
-			self.queue_image(post, thread)
+		return post_data
 
-		return return_value
-
-	def queue_image(self, post, thread):
+	def queue_images(self, posts, thread):
 		"""
-		Queue image for downloading
+		Queue images for downloading
 
-		This queues the image for downloading, if it hasn't been downloaded yet
-		and a valid image folder has been set. This is the only place in the
-		backend where the image path is determined!
+		This queues the images attached to the given posts for downloading,
+		if they haven't been downloaded yet and a valid image folder has been
+		set. This is the only place in the backend where the image path is
+		determined!
 
-		:param dict post:  Post data to queue image download for
-		:param dict thread:  Thread data of thread within which image was posted
+		:param list posts:  Data of posts to queue image downloads for
+		:param dict thread:  Thread data of thread within which images were posted
 		"""
-
-		# generate image path
-		md5 = hashlib.md5()
-		md5.update(base64.b64decode(post["md5"]))
-
 		image_folder = Path(config.PATH_ROOT, config.PATH_IMAGES)
-		image_path = image_folder.joinpath(md5.hexdigest() + post["ext"])
-
-		if config.PATH_IMAGES and image_folder.is_dir() and not image_path.is_file():
-			claimtime = int(time.time()) + config.IMAGE_INTERVAL
-
-			try:
-				self.queue.add_job("4chan-image", remote_id=post["md5"], claim_after=claimtime, details={
-					"board": thread["board"],
-					"ext": post["ext"],
-					"tim": post["tim"],
-					"destination": str(image_path),
-				})
-			except JobAlreadyExistsException:
-				pass
+		if not posts or not config.PATH_IMAGES or not image_folder.is_dir():
+			return
+
+		claimtime = int(time.time()) + config.IMAGE_INTERVAL
+		jobs = []
+		for post in posts:
+			# generate image path
+			md5 = hashlib.md5()
+			md5.update(base64.b64decode(post["md5"]))
+			image_path = image_folder.joinpath(md5.hexdigest() + post["ext"])
+
+			if image_path.is_file():
+				continue
+
+			jobs.append({"jobtype": "4chan-image", "remote_id": post["md5"], "claim_after": claimtime, "details": {
+				"board": thread["board"],
+				"ext": post["ext"],
+				"tim": post["tim"],
+				"destination": str(image_path),
+			}})
+
+		self.queue.add_jobs(jobs)
 
 	def register_thread(self, first_post, last_reply, last_post, num_replies):
 		"""
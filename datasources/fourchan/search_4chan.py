@@ -24,6 +24,10 @@ class Search4Chan(SearchWithScope):
 	sphinx_index = "4chan"  # prefix for sphinx indexes for this data source. Should usually match sphinx.conf
 	prefix = "4chan"  # table identifier for this datasource; see below for usage
 
+	# results are reused for identical queries; the thread scraper
+	# invalidates them when new posts are added
+	cache_results = True
+
 	# Columns to return in csv
 	return_cols = ['thread_id', 'id', 'timestamp', 'board', 'body', 'subject', 'author', 'image_file', 'image_md5',
 				   'country_name', 'country_code']
@@ -466,7 +470,7 @@ class Search4Chan(SearchWithScope):
 		else:
 			sql_query += " ORDER BY p.timestamp ASC"
 
-		return self.db.fetchall_interruptable(self.queue, sql_query, replacements)
+		return self.db.iterate_interruptable(self.queue, sql_query, replacements)
 
 	def get_items_complex(self, query):
 		"""
@@ -548,7 +552,7 @@ class Search4Chan(SearchWithScope):
 			if self.interrupted:
 				raise ProcessorInterruptedException("Interrupted while fetching post data")
 			query = "SELECT " + columns + " FROM posts_" + self.prefix + " WHERE " + where + " ORDER BY id ASC"
-			posts = self.db.fetchall_interruptable(self.queue, query, replacements)
+			return self.db.iterate_interruptable(self.queue, query, replacements)
 
 		if posts is None:
 			return posts
@@ -557,12 +561,8 @@ class Search4Chan(SearchWithScope):
 			self.dataset.update_status("Query finished, but no results were found.")
 			return None
 
-		if not use_sphinx:
-			return posts
-
 		# query posts database
 		self.dataset.update_status("Found %i matches. Collecting post data" % len(posts))
-		datafetch_start = time.time()
 		self.log.info("Collecting post data from database")
 		columns = ", ".join(self.return_cols)
 
@@ -572,11 +572,10 @@ class Search4Chan(SearchWithScope):
 		# postgres_where.append("board = %s")
 		# postgres_replacements.append(query.get("board"))
 
-		posts_full = self.fetch_posts(tuple([post["post_id"] for post in posts]), postgres_where, postgres_replacements)
-
-		self.dataset.update_status("Post data collected")
-		self.log.info("Full posts query finished in %i seconds." % (time.time() - datafetch_start))
+		posts_full = self.fetch_posts([post["post_id"] for post in posts], postgres_where, postgres_replacements)
 
+		# post data is streamed from the database as the results are written,
+		# with progress reported per chunk of post IDs
 		return posts_full
 
 	def convert_for_sphinx(self, string):
@@ -606,8 +605,8 @@ class Search4Chan(SearchWithScope):
 		"""
 		Fetch post data from database
 
-		:param list post_ids:  List of post IDs to return data for
-		:return list: List of posts, with a dictionary representing the database record for each post
+		:param Iterable post_ids:  Post IDs to return data for
+		:return Generator: Yields posts, ordered by ID, with a dictionary representing the database record for each post
 		"""
 		if not where:
 			where = []
@@ -616,31 +615,30 @@ class Search4Chan(SearchWithScope):
 			replacements = []
 
 		columns = ", ".join(self.return_cols)
-		where.append("id IN %s")
-		replacements.append(post_ids)
+		where.append("id = ANY(%s)")
 
 		if self.interrupted:
 			raise ProcessorInterruptedException("Interrupted while fetching post data")
 
 		query = "SELECT " + columns + " FROM posts_" + self.prefix + " WHERE " + " AND ".join(
 			where) + " ORDER BY id ASC"
-		return self.db.fetchall_interruptable(self.queue, query, replacements)
+		return self.iterate_by_ids(query, post_ids, replacements, status="Collecting post data (%i/%i posts)")
 
 	def fetch_threads(self, thread_ids):
 		"""
 		Fetch post from database for given threads
 
 		:param list thread_ids: List of thread IDs to return post data for
-		:return list: List of posts, with a dictionary representing the database record for each post
+		:return Generator: Yields posts, with a dictionary representing the database record for each post
 		"""
 		columns = ", ".join(self.return_cols)
 
 		if self.interrupted:
 			raise ProcessorInterruptedException("Interrupted while fetching thread data")
 
-		return self.db.fetchall_interruptable(self.queue,
-			"SELECT " + columns + " FROM posts_" + self.prefix + " WHERE thread_id IN %s ORDER BY thread_id ASC, id ASC",
-											  (thread_ids,))
+		return self.iterate_by_ids(
+			"SELECT " + columns + " FROM posts_" + self.prefix + " WHERE thread_id = ANY(%s) ORDER BY thread_id ASC, id ASC",
+			thread_ids, status="Collecting posts (%i/%i threads)")
 
 	def fetch_sphinx(self, where, replacements):
 		"""
@@ -724,9 +722,11 @@ class Search4Chan(SearchWithScope):
 		:return dict:  Threads sizes, with thread IDs as keys
 		"""
 		# find total thread lengths for all threads in initial data set
-		thread_sizes = {row["thread_id"]: row["num_posts"] for row in self.db.fetchall_interruptable(
-			self.queue, "SELECT COUNT(*) as num_posts, thread_id FROM posts_" + self.prefix + " WHERE thread_id IN %s GROUP BY thread_id",
-			(thread_ids,)) if int(row["num_posts"]) > min_length}
+		# threads are counted per chunk of thread IDs; each chunk contains
+		# all posts for the threads in it, so the counts are complete
+		thread_sizes = {row["thread_id"]: row["num_posts"] for row in self.iterate_by_ids(
+			"SELECT COUNT(*) as num_posts, thread_id FROM posts_" + self.prefix + " WHERE thread_id = ANY(%s) GROUP BY thread_id",
+			thread_ids) if int(row["num_posts"]) > min_length}
 
 		return thread_sizes
 
@@ -173,7 +173,7 @@ class ImportFromExternalTool(BasicProcessor):
 		# what datasource to assign to the dataset
 		datasource = platform.split("-")[0]
 		dataset.type = "%s-search" % datasource
-		dataset.datasource = datasource
+		dataset.set_datasource(datasource)
 
 		file.seek(0)
 		done = 0
@@ -28,6 +28,10 @@ class SearchParliamentSpeeches(Search):
     max_workers = 1
     max_retries = 3
 
+    # the speech data is only updated occasionally, so results can be reused
+    # for identical queries until they expire from the cache
+    cache_results = True
+
     options = {
         "intro": {
             "type":  UserInput.OPTION_INFO,
@@ -118,7 +118,7 @@ class SearchUsenet(Search4Chan):
 
 		sql_query += " ORDER BY p.timestamp ASC"
 
-		return self.db.fetchall_interruptable(self.queue, sql_query, replacements)
+		return self.db.iterate_interruptable(self.queue, sql_query, replacements)
 
 	def get_items_complex(self, query):
 		"""
@@ -181,7 +181,6 @@ class SearchUsenet(Search4Chan):
 
 		# query posts database
 		self.dataset.update_status("Found %i matches. Collecting post data" % len(posts))
-		datafetch_start = time.time()
 		self.log.info("Collecting post data from database")
 		columns = ", ".join(self.return_cols)
 
@@ -190,19 +189,18 @@ class SearchUsenet(Search4Chan):
 
 		groups = [group.strip().replace("*", "%") for group in query.get("group_match", "").split(",")]
 		groups = [group for group in groups if group]
-		posts_full = self.fetch_posts(tuple([post["post_id"] for post in posts]), postgres_where, postgres_replacements, groups)
-
-		self.dataset.update_status("Post data collected")
-		self.log.info("Full posts query finished in %i seconds." % (time.time() - datafetch_start))
+		posts_full = self.fetch_posts([post["post_id"] for post in posts], postgres_where, postgres_replacements, groups)
 
+		# post data is streamed from the database as the results are written,
+		# with progress reported per chunk of post IDs
 		return posts_full
 
 	def fetch_posts(self, post_ids, where=None, replacements=None, groups=None):
 		"""
 		Fetch post data from database
 
-		:param list post_ids:  List of post IDs to return data for
-		:return list: List of posts, with a dictionary representing the database record for each post
+		:param Iterable post_ids:  Post IDs to return data for
+		:return Generator: Yields posts, ordered by ID, with a dictionary representing the database record for each post
 		"""
 		if not where:
 			where = []
@@ -211,8 +209,6 @@ class SearchUsenet(Search4Chan):
 			replacements = []
 
 		columns = ", ".join(self.return_cols)
-		where.append("id IN %s")
-		replacements.append(post_ids)
 
 		if self.interrupted:
 			raise ProcessorInterruptedException("Interrupted while fetching post data")
@@ -221,9 +217,12 @@ class SearchUsenet(Search4Chan):
 			where.append("id IN ( SELECT post_id FROM groups_" + self.prefix + " WHERE \"group\" LIKE ANY(%s) )")
 			replacements.append(groups)
 
+		# the ID array is passed last, see iterate_by_ids()
+		where.append("id = ANY(%s)")
+
 		query = "SELECT " + columns + " FROM posts_" + self.prefix + " WHERE " + " AND ".join(
 			where) + " ORDER BY id ASC"
-		return self.db.fetchall_interruptable(self.queue, query, replacements)
+		return self.iterate_by_ids(query, post_ids, replacements, status="Collecting post data (%i/%i posts)")
 
 	def validate_query(query, request, user):
 		"""
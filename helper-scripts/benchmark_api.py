@@ -0,0 +1,87 @@
+"""
+Benchmark the local API
+
+Sends requests to the local API of a running 4CAT backend from a number of
+concurrent clients, and reports the latency of the requests. By default
+clients keep their connection open between requests, as the frontend does;
+with --reconnect, a new connection is opened for each request, as older
+clients (e.g. the Munin plugins) do.
+"""
+import threading
+import argparse
+import socket
+import time
+import json
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)) + "/..")
+from common.lib.helpers import call_api
+import config
+
+cli = argparse.ArgumentParser(description="Benchmark the local 4CAT API")
+cli.add_argument("-c", "--clients", default=10, type=int, help="Amount of concurrent clients")
+cli.add_argument("-n", "--requests", default=200, type=int, help="Amount of requests per client")
+cli.add_argument("-a", "--action", default="workers", help="API action to request (default 'workers')")
+cli.add_argument("-r", "--reconnect", action="store_true", default=False, help="Open a new connection for each "
+																				  "request, without keep-alive")
+args = cli.parse_args()
+
+
+def request_once(action):
+	"""
+	Send a request over a new connection, the way older clients do
+
+	:param str action:  API action
+	:return:  API response
+	"""
+	connection = socket.create_connection((config.API_HOST, config.API_PORT), timeout=15)
+	connection.sendall(json.dumps({"request": action}).encode("utf-8"))
+	response = b""
+	while True:
+		data = connection.recv(4096)
+		if not data:
+			break
+		response += data
+	connection.close()
+
+	return json.loads(response.decode("utf-8"))
+
+
+def client(timings, errors):
+	"""
+	Run requests and record their latency
+
+	:param list timings:  List to add latencies to
+	:param list errors:  List to add errors to
+	"""
+	for i in range(0, args.requests):
+		start = time.perf_counter()
+		try:
+			response = request_once(args.action) if args.reconnect else call_api(args.action)
+			if not isinstance(response, dict) or response.get("error"):
+				errors.append(response)
+		except (OSError, json.JSONDecodeError) as e:
+			errors.append(e)
+		timings.append(time.perf_counter() - start)
+
+
+timings = []
+errors = []
+clients = [threading.Thread(target=client, args=(timings, errors)) for i in range(0, args.clients)]
+
+print("Sending %i '%s' requests from %i clients to %s:%s..." % (
+	args.clients * args.requests, args.action, args.clients, config.API_HOST, config.API_PORT))
+start = time.perf_counter()
+for thread in clients:
+	thread.start()
+for thread in clients:
+	thread.join()
+duration = time.perf_counter() - start
+
+timings = sorted(timings)
+print("%i requests in %.2f s (%.1f requests/s), %i errors" % (len(timings), duration, len(timings) / duration, len(errors)))
+for percentile in (50, 90, 99):
+	index = min(len(timings) - 1, int(len(timings) * percentile / 100))
+	print("p%i  %8.2f ms" % (percentile, timings[index] * 1000))
+print("max  %8.2f ms" % (timings[-1] * 1000))
@@ -0,0 +1,87 @@
+"""
+Benchmark the queries behind the /results/ page
+
+Creates a scratch copy of the datasets table in a separate schema, fills it
+with (by default) a million synthetic datasets, and times the queries used to
+list datasets - e.g. for a user's datasets both the current version, which
+uses the indexed 'owner' column, and the previous version, which parsed the
+JSON parameters of each dataset, and both offset and keyset pagination. The scratch schema is removed afterwards; the actual datasets
+table is not touched.
+"""
+import argparse
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)) + "/..")
+from common.lib.database import Database
+from common.lib.logger import Logger
+
+cli = argparse.ArgumentParser(description="Benchmark the /results/ page queries against a large datasets table")
+cli.add_argument("-r", "--rows", default=1000000, type=int, help="Amount of datasets to generate (default 1M)")
+cli.add_argument("-u", "--users", default=1000, type=int, help="Amount of users to divide the datasets over")
+cli.add_argument("-i", "--iterations", default=25, type=int, help="Amount of times to run each query")
+cli.add_argument("-s", "--schema", default="fourcat_benchmark", help="Scratch schema to create the test table in. "
+																	 "Will be deleted after the benchmark!")
+args = cli.parse_args()
+
+logger = Logger()
+db = Database(logger=logger, appname="benchmark-results")
+
+print("Creating scratch table %s.datasets with %i rows..." % (args.schema, args.rows))
+db.execute("DROP SCHEMA IF EXISTS " + args.schema + " CASCADE")
+db.execute("CREATE SCHEMA " + args.schema)
+db.execute("CREATE TABLE " + args.schema + ".datasets (LIKE public.datasets INCLUDING ALL)")
+db.execute("SET search_path TO " + args.schema)
+
+# about one in five datasets is a top-level dataset, the others are
+# processor results
+db.execute("""
+	INSERT INTO datasets (key, type, key_parent, query, parameters, owner, datasource, timestamp, is_finished, num_rows)
+	SELECT md5(i::text),
+	       CASE WHEN i %% 5 = 0 THEN '4chan-search' ELSE 'count-posts' END,
+	       CASE WHEN i %% 5 = 0 THEN '' ELSE md5((i - i %% 5)::text) END,
+	       'query ' || i,
+	       json_build_object('user', 'user' || (i %% %s), 'datasource', '4chan', 'board', 'pol')::text,
+	       'user' || (i %% %s),
+	       '4chan',
+	       1500000000 + i,
+	       TRUE,
+	       i %% 1000
+	  FROM generate_series(1, %s) AS i
+""", (args.users, args.users, args.rows))
+db.execute("ANALYZE datasets")
+
+# the user with the most top-level datasets
+user = "user0"
+page_size = 20
+
+queries = {
+	"count (json)": ("SELECT COUNT(*) AS num FROM datasets WHERE (key_parent = '' OR key_parent IS NULL) AND parameters::json->>'user' = %s", (user,)),
+	"count (column)": ("SELECT COUNT(*) AS num FROM datasets WHERE key_parent = '' AND owner = %s", (user,)),
+	"page (json)": ("SELECT * FROM datasets WHERE (key_parent = '' OR key_parent IS NULL) AND parameters::json->>'user' = %s ORDER BY timestamp DESC LIMIT %s OFFSET %s", (user, page_size, 0)),
+	"page (column)": ("SELECT * FROM datasets WHERE key_parent = '' AND owner = %s ORDER BY timestamp DESC LIMIT %s OFFSET %s", (user, page_size, 0)),
+	"deep page (offset)": ("SELECT * FROM datasets WHERE key_parent = '' ORDER BY timestamp DESC, id DESC LIMIT %s OFFSET %s", (page_size + 1, page_size * 5000)),
+	"deep page (keyset)": ("SELECT * FROM datasets WHERE key_parent = '' AND (timestamp, id) < (%s, %s) ORDER BY timestamp DESC, id DESC LIMIT %s", (1500000000 + args.rows // 2, args.rows // 2, page_size + 1)),
+	"filter (like)": ("SELECT * FROM datasets WHERE key_parent = '' AND query LIKE %s ORDER BY timestamp DESC, id DESC LIMIT %s", ("%y 12345%", page_size + 1)),
+	"count (estimate)": ("SELECT count_estimate(%s) AS num", ("SELECT * FROM datasets WHERE key_parent = ''",)),
+	"children (per dataset)": ("SELECT * FROM datasets WHERE key_parent = %s ORDER BY timestamp ASC", (db.fetchone("SELECT key FROM datasets WHERE key_parent = '' AND owner = %s LIMIT 1", (user,))["key"],)),
+}
+
+try:
+	print("Running each query %i times...\n" % args.iterations)
+	for label, (query, replacements) in queries.items():
+		timings = []
+		for i in range(0, args.iterations):
+			start = time.perf_counter()
+			db.fetchall(query, replacements)
+			timings.append(time.perf_counter() - start)
+
+		timings = sorted(timings)
+		print("%-24s median %8.2f ms   min %8.2f ms   max %8.2f ms" % (
+			label, timings[len(timings) // 2] * 1000, timings[0] * 1000, timings[-1] * 1000))
+finally:
+	db.execute("SET search_path TO public")
+	db.execute("DROP SCHEMA IF EXISTS " + args.schema + " CASCADE")
+
+print("\nDone.")
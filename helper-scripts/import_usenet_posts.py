@@ -17,6 +17,7 @@ from pathlib import Path
 sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)) + "/..")
 from common.lib.database import Database
 from common.lib.logger import Logger
+from common.lib.search_cache import SearchCache
 
 cli = argparse.ArgumentParser()
 cli.add_argument("--input", "-i", help="SQLite database file to use as input", required=True)
@@ -167,4 +168,11 @@ for thread_id, data in threads.items():
 print("Committing thread updates to database...")
 db.commit()
 
+print("Clearing cached search results...")
+SearchCache(db).invalidate("usenet")
+
+# imported posts may be older than what metrics have been calculated for
+print("Resetting data source metrics...")
+db.delete("metrics_watermarks", where={"datasource": "usenet"})
+
 print("Done!")
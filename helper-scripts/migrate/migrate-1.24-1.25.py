@@ -0,0 +1,149 @@
+# Add 'search_cache' table for reusing search results, indexed 'owner' and
+# 'datasource' columns to datasets table, 'heartbeat' table, and unique
+# metrics with watermarks and rollups for incremental calculation
+import psycopg2
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)) + "'/../..")
+from common.lib.database import Database
+from common.lib.logger import Logger
+
+import config
+
+log = Logger(output=True)
+db = Database(logger=log, dbname=config.DB_NAME, user=config.DB_USER, password=config.DB_PASSWORD, host=config.DB_HOST,
+              port=config.DB_PORT, appname="4cat-migrate")
+
+print("  Checking if search_cache table exists...")
+has_table = db.fetchone("SELECT COUNT(*) AS num FROM information_schema.tables WHERE table_name = 'search_cache'")
+if has_table["num"] == 0:
+    print("  ...No, adding.")
+    db.execute("""CREATE TABLE IF NOT EXISTS search_cache (
+      cache_key   TEXT UNIQUE PRIMARY KEY,
+      dataset     TEXT,
+      datasource  TEXT,
+      board       TEXT DEFAULT '',
+      min_date    INTEGER DEFAULT 0,
+      max_date    INTEGER DEFAULT 0,
+      timestamp   INTEGER
+    )""")
+    db.execute("CREATE INDEX IF NOT EXISTS search_cache_datasource ON search_cache (datasource, board)")
+else:
+    print("  ...Yes, nothing to update.")
+
+print("  Checking if datasets table has a column 'owner'...")
+has_column = db.fetchone("SELECT COUNT(*) AS num FROM information_schema.columns WHERE table_name = 'datasets' AND column_name = 'owner'")
+if has_column["num"] == 0:
+    print("  ...No, adding.")
+    db.execute("ALTER TABLE datasets ADD COLUMN owner TEXT DEFAULT ''")
+    db.execute("UPDATE datasets SET owner = COALESCE(parameters::json->>'user', '')")
+else:
+    print("  ...Yes, nothing to update.")
+
+print("  Checking if datasets table has a column 'datasource'...")
+has_column = db.fetchone("SELECT COUNT(*) AS num FROM information_schema.columns WHERE table_name = 'datasets' AND column_name = 'datasource'")
+if has_column["num"] == 0:
+    print("  ...No, adding.")
+    db.execute("ALTER TABLE datasets ADD COLUMN datasource TEXT DEFAULT ''")
+    db.execute("UPDATE datasets SET datasource = COALESCE(parameters::json->>'datasource', '')")
+else:
+    print("  ...Yes, nothing to update.")
+
+print("  Linking datasets to jobs stored in their parameters...")
+db.execute("UPDATE datasets SET job = (parameters::json->>'job')::integer WHERE job = 0 AND parameters::json->>'job' ~ '^[0-9]+$'")
+
+print("  Normalising parent keys of top-level datasets...")
+db.execute("UPDATE datasets SET key_parent = '' WHERE key_parent IS NULL")
+
+print("  Adding indexes to datasets table...")
+db.execute("CREATE INDEX IF NOT EXISTS datasets_key ON datasets (key)")
+db.execute("CREATE INDEX IF NOT EXISTS datasets_key_parent ON datasets (key_parent)")
+db.execute("CREATE INDEX IF NOT EXISTS datasets_job ON datasets (job)")
+db.execute("CREATE INDEX IF NOT EXISTS datasets_owner ON datasets (owner, timestamp, id)")
+db.execute("CREATE INDEX IF NOT EXISTS datasets_datasource ON datasets (datasource, timestamp)")
+db.execute("CREATE INDEX IF NOT EXISTS datasets_timestamp ON datasets (timestamp, id)")
+
+print("  Adding trigram index for dataset queries...")
+try:
+    db.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    db.execute("CREATE INDEX IF NOT EXISTS datasets_query ON datasets USING gin (query gin_trgm_ops)")
+except psycopg2.Error as e:
+    db.rollback()
+    print("  ...Could not add index (%s). Filtering datasets by query will be slower. Ask your database" % e)
+    print("     administrator to enable the pg_trgm extension and run this script again to add it.")
+
+print("  Checking if heartbeat table exists...")
+has_table = db.fetchone("SELECT COUNT(*) AS num FROM information_schema.tables WHERE table_name = 'heartbeat'")
+if has_table["num"] == 0:
+    print("  ...No, adding.")
+    db.execute("""CREATE TABLE IF NOT EXISTS heartbeat (
+      component  text UNIQUE PRIMARY KEY,
+      pid        integer DEFAULT 0,
+      timestamp  integer DEFAULT 0
+    )""")
+else:
+    print("  ...Yes, nothing to update.")
+
+print("  Checking if metrics table exists...")
+has_table = db.fetchone("SELECT COUNT(*) AS num FROM information_schema.tables WHERE table_name = 'metrics'")
+if has_table["num"] == 0:
+    print("  ...No, adding.")
+    db.execute("""CREATE TABLE IF NOT EXISTS metrics (
+      metric      text,
+      datasource  text,
+      board       text,
+      date        text,
+      count       integer
+    )""")
+else:
+    print("  ...Yes, removing duplicate metrics.")
+    db.execute("UPDATE metrics SET board = '' WHERE board IS NULL")
+    db.execute("""DELETE FROM metrics AS duplicate USING metrics AS original
+                   WHERE duplicate.ctid < original.ctid
+                     AND duplicate.metric = original.metric
+                     AND duplicate.datasource = original.datasource
+                     AND duplicate.board = original.board
+                     AND duplicate.date = original.date""")
+
+db.execute("CREATE UNIQUE INDEX IF NOT EXISTS unique_metrics ON metrics (metric, datasource, board, date)")
+
+print("  Checking if metrics_watermarks table exists...")
+has_table = db.fetchone("SELECT COUNT(*) AS num FROM information_schema.tables WHERE table_name = 'metrics_watermarks'")
+if has_table["num"] == 0:
+    print("  ...No, adding.")
+    db.execute("""CREATE TABLE IF NOT EXISTS metrics_watermarks (
+      datasource  text,
+      board       text,
+      metric      text,
+      watermark   integer DEFAULT 0
+    )""")
+    db.execute("CREATE UNIQUE INDEX IF NOT EXISTS unique_metrics_watermarks ON metrics_watermarks (datasource, board, metric)")
+
+    # metrics were previously only calculated for complete days, so posts
+    # until the end of the latest day with metrics have been counted
+    print("  Setting watermarks for existing metrics...")
+    db.execute("""INSERT INTO metrics_watermarks (datasource, board, metric, watermark)
+                  SELECT datasource, board, metric, EXTRACT(EPOCH FROM (MAX(date)::date + 1)::timestamp AT TIME ZONE 'UTC')::integer
+                    FROM metrics WHERE metric = 'posts_per_day'
+                GROUP BY datasource, board, metric""")
+else:
+    print("  ...Yes, nothing to update.")
+
+print("  Checking if metrics_rollups table exists...")
+has_table = db.fetchone("SELECT COUNT(*) AS num FROM information_schema.tables WHERE table_name = 'metrics_rollups'")
+if has_table["num"] == 0:
+    print("  ...No, adding. Rollups will be calculated the next time the datasource-metrics worker runs.")
+    db.execute("""CREATE TABLE IF NOT EXISTS metrics_rollups (
+      datasource   text,
+      board        text,
+      granularity  text,
+      metric       text,
+      date         text,
+      count        bigint
+    )""")
+    db.execute("CREATE UNIQUE INDEX IF NOT EXISTS unique_metrics_rollups ON metrics_rollups (datasource, board, granularity, metric, date)")
+else:
+    print("  ...Yes, nothing to update.")
+
+print("  Done!")
@@ -3,7 +3,7 @@ Filter posts by a dates
 """
 import csv
 import dateutil.parser
-from datetime import datetime
+from datetime import datetime, timezone
 
 from backend.abstract.processor import BasicProcessor
 from common.lib.helpers import UserInput
@@ -86,13 +86,22 @@ class DateFilter(BasicProcessor):
         invalid_dates = 0
         matching_items = 0
 
+        # If the source dataset is indexed, only read the blocks of items that
+        # may contain dates in the range. Dates in the dataset are in UTC.
+        byte_ranges = None
+        index = self.source_dataset.get_index()
+        if index and index.data["format"] in ("csv", "ndjson"):
+            min_timestamp = int(datetime.combine(min_date, datetime.min.time(), tzinfo=timezone.utc).timestamp())
+            max_timestamp = int(datetime.combine(max_date, datetime.max.time(), tzinfo=timezone.utc).timestamp())
+            byte_ranges = index.get_byte_ranges(min_timestamp, max_timestamp)
+
         # Start writer
         with self.dataset.get_results_path().open("w", encoding="utf-8", newline="") as outfile:
             writer = None
 
 
             # Loop through items
-            for item in self.iterate_items(self.source_file):
+            for item in self.iterate_items(self.source_file, byte_ranges=byte_ranges):
                 if not writer:
                     # First iteration, check if column actually exists
                     if date_column_name not in item.keys():
@@ -1,12 +1,14 @@
 """
 Filter posts by lexicon
 """
+import functools
 import re
 import csv
 from pathlib import Path
 
 from backend.abstract.processor import BasicProcessor
 from common.lib.helpers import UserInput
+from common.lib.lexicon_matcher import LexiconMatcher
 
 import config
 
@@ -95,29 +97,24 @@ class LexicalFilter(BasicProcessor):
 			[word.strip() for word in self.parameters.get("lexicon-custom", "").split(",") if word.strip()])
 		lexicons[custom_id] |= custom_lexicon
 
-		# compile into regex for quick matching
-		lexicon_regexes = {}
+		# compile into a single matcher, so all lexicons can be checked in one
+		# pass over each post
+		matcher = LexiconMatcher(case_sensitive=case_sensitive)
 		for lexicon_id in lexicons:
 			if not lexicons[lexicon_id]:
 				continue
 
-			if not self.parameters.get("as_regex"):
-				phrases = [re.escape(term) for term in lexicons[lexicon_id] if term]
+			if lexicon_id == custom_id and self.parameters.get("as_regex"):
+				try:
+					matcher.add_expression(lexicon_id, r"\b(" + "|".join(lexicons[lexicon_id]) + r")\b")
+				except re.error:
+					self.dataset.update_status("Invalid regular expression, cannot use as filter", is_final=True)
+					self.dataset.finish(0)
+					return
 			else:
-				phrases = [term for term in lexicons[lexicon_id] if term]
-
-			try:
-				if not case_sensitive:
-					lexicon_regexes[lexicon_id] = re.compile(
-					r"\b(" + "|".join(phrases) + r")\b",
-					flags=re.IGNORECASE)
-				else:
-					lexicon_regexes[lexicon_id] = re.compile(
-					r"\b(" + "|".join(phrases) + r")\b")
-			except re.error:
-				self.dataset.update_status("Invalid regular expression, cannot use as filter", is_final=True)
-				self.dataset.finish(0)
-				return
+				matcher.add_phrases(lexicon_id, lexicons[lexicon_id])
+
+		matcher.compile()
 
 		# now for the real deal
 		self.dataset.update_status("Reading source file")
@@ -136,40 +133,17 @@ class LexicalFilter(BasicProcessor):
 			writer.writeheader()
 
 			# iterate through posts and see if they match
-			for post in self.iterate_items(self.source_file):
-				if not post.get("body", None):
-					continue
-
+			match = functools.partial(match_post, matcher=matcher, exclude=exclude)
+			for post in self.iterate_items_parallel(self.source_file, match):
 				if processed % 2500 == 0:
 					self.dataset.update_status("Processed %i posts (%i matching)" % (processed, matching_items))
 
-				# if 'partition' is false, there will just be one combined
-				# lexicon, but else we'll have different ones we can
-				# check separately
-				matching_lexicons = set()
-				for lexicon_id in lexicons:
-					if lexicon_id not in lexicon_regexes:
-						continue
-
-					lexicon_regex = lexicon_regexes[lexicon_id]
-
-					# check if we match
-					if not lexicon_regex.findall(post["body"]) and not exclude:
-						continue
-					elif lexicon_regex.findall(post["body"]) and exclude:
-						continue
-
-					matching_lexicons.add(lexicon_id)
-
-				# if none of the lexicons match, the post is not retained
 				processed += 1
-				if not matching_lexicons:
+				if not post:
 					continue
 
-				# if one does, record which match, and save it to the output
-				post["matching_lexicons"] = ",".join(matching_lexicons)
+				# save matching posts to the output
 				writer.writerow(post)
-
 				matching_items += 1
 
 		if matching_items > 0:
@@ -181,3 +155,33 @@ class LexicalFilter(BasicProcessor):
 
 		# Request standalone
 		self.create_standalone()
+
+
+def match_post(post, matcher, exclude=False):
+	"""
+	Check which lexicons a post matches
+
+	This is run in parallel, in separate processes.
+
+	:param dict post:  Post to check
+	:param LexiconMatcher matcher:  Compiled matcher for all lexicons
+	:param bool exclude:  Retain the post for the lexicons it does *not*
+	  match
+	:return dict|None:  The post with a `matching_lexicons` field added if it
+	  matches any lexicon, else `None`
+	"""
+	if not post.get("body", None):
+		return None
+
+	# with 'exclude', a post is retained for the lexicons it does *not* match
+	matching_lexicons = matcher.match(post["body"])
+	if exclude:
+		matching_lexicons = matcher.lexicons - matching_lexicons
+
+	# if none of the lexicons match, the post is not retained
+	if not matching_lexicons:
+		return None
+
+	# if one does, record which match
+	post["matching_lexicons"] = ",".join(sorted(matching_lexicons))
+	return post
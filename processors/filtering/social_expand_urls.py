@@ -266,7 +266,7 @@ class UrlUnshortener(BasicProcessor):
 
         standalone = self.dataset.copy(shallow=False)
         standalone.body_match = "(Filtered) " + self.source_dataset.query
-        standalone.datasource = self.source_dataset.parameters.get("datasource", "custom")
+        standalone.set_datasource(self.source_dataset.parameters.get("datasource", "custom"))
 
         try:
             standalone.board = self.source_dataset.board
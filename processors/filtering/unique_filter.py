@@ -1,11 +1,11 @@
 """
 Filter by unique posts
 """
-import hashlib
 import csv
 
 from backend.abstract.processor import BasicProcessor
 from common.lib.helpers import UserInput
+from common.lib.deduplication import DigestSet, SimHashIndex, digest, simhash
 
 __author__ = "Sal Hagen"
 __credits__ = ["Sal Hagen"]
@@ -33,13 +33,47 @@ class UniqueFilter(BasicProcessor):
 			"help": "Case sensitive",
 			"default": False,
 			"tooltip": "Check to consider posts with different capitals as different."
+		},
+		"near_duplicates": {
+			"type": UserInput.OPTION_TOGGLE,
+			"help": "Also remove near-duplicates",
+			"default": False,
+			"tooltip": "Also remove posts that are nearly identical to an earlier post, e.g. spam with a slightly "
+					   "different ending. This is slower than only removing exact duplicates."
+		},
+		"memory_limit": {
+			"type": UserInput.OPTION_TEXT,
+			"help": "Memory limit (MB)",
+			"default": 256,
+			"min": 16,
+			"max": 4096,
+			"tooltip": "Amount of memory to use to keep track of posts seen so far. Beyond this, data is "
+					   "temporarily stored on disk, which is slower."
 		}
 	}
 
+	# amount of posts to check for duplicates at once
+	batch_size = 10000
+
 	def process(self):
 		"""
 		Reads a CSV file, hashes the posts, and only keeps those it didn't encounter yet.
+
+		Hashes are stored as 64-bit digests in a `DigestSet`, which writes
+		them to a staging area when over the memory limit, so memory use
+		stays bounded regardless of the size of the dataset.
 		"""
+		case_sensitive = self.parameters.get("case_sensitive", False)
+		memory_limit = self.parameters.get("memory_limit", self.options["memory_limit"]["default"]) * 1024 * 1024
+
+		# the memory limit is divided between the two indexes if both are used
+		if self.parameters.get("near_duplicates"):
+			memory_limit = memory_limit // 2
+			near_duplicates = SimHashIndex(memory_limit=memory_limit, spill_path=self.get_spill_path)
+		else:
+			near_duplicates = None
+
+		digests = DigestSet(memory_limit=memory_limit, spill_path=self.get_spill_path)
 
 		# now for the real deal
 		self.dataset.update_status("Reading source file")
@@ -48,7 +82,11 @@ class UniqueFilter(BasicProcessor):
 		processed = 0
 		unique = 0
 
-		hashes = set()
+		def memory_status():
+			indexes = [digests, near_duplicates] if near_duplicates else [digests]
+			return "%.1f MB in memory, %.1f MB on disk" % (
+				sum([index.memory_used for index in indexes]) / 1024 / 1024,
+				sum([index.disk_used for index in indexes]) / 1024 / 1024)
 
 		# iterate through posts and see if they match
 		with self.dataset.get_results_path().open("w", encoding="utf-8") as output:
@@ -59,33 +97,74 @@ class UniqueFilter(BasicProcessor):
 			writer = csv.DictWriter(output, fieldnames=fieldnames)
 			writer.writeheader()
 
-			# iterate through posts and see if they match
-			for post in self.iterate_items(self.source_file):
+			def write_batch(batch):
+				"""
+				Write posts in a batch that were not seen before
+
+				:param list batch:  List of (post, normalised body) tuples
+				:return int:  Amount of posts written
+				"""
+				written = 0
+				seen = digests.add_many([digest(body) for post, body in batch])
+				for (post, body), is_duplicate in zip(batch, seen):
+					if is_duplicate:
+						continue
+
+					if near_duplicates:
+						body_simhash = simhash(body)
+						if body_simhash is not None and near_duplicates.add(body_simhash):
+							continue
+
+					writer.writerow(post)
+					written += 1
+
+				return written
 
+			# iterate through posts and see if they match, in batches, so
+			# the digests of a batch can be looked up at once
+			batch = []
+			for post in self.iterate_items(self.source_file):
+				processed += 1
 				if not post.get("body", None):
 					continue
 
 				body = post["body"].strip()
-				if not self.parameters.get("case_sensitive", False):
+				if not case_sensitive:
 					body = body.lower()
 
-				hash_object = hashlib.md5(body.encode("utf-8"))
-				md5_hash = hash_object.hexdigest()
-
-				if md5_hash not in hashes:
-					writer.writerow(post)
-					unique += 1
+				batch.append((post, body))
+				if len(batch) >= self.batch_size:
+					unique += write_batch(batch)
+					batch = []
+					self.dataset.update_status("Processed %i posts (%i unique, %s)" % (processed, unique, memory_status()))
 
-				hashes.add(md5_hash)
+			if batch:
+				unique += write_batch(batch)
 
-				if processed % 2500 == 0:
-					self.dataset.update_status("Processed %i posts (%i unique)" % (processed, unique))
+		self.dataset.update_status("New dataset created with %i unique item(s) (%s)" % (unique, memory_status()), is_final=True)
 
-				processed += 1
+		# release the digests written to disk, if any; the staging area is
+		# removed after processing
+		digests.close()
+		if near_duplicates:
+			near_duplicates.close()
 
-		self.dataset.update_status("New dataset created with %i matching item(s)" % unique, is_final=True)
 		self.dataset.finish(unique)
 
+	def get_spill_path(self):
+		"""
+		Get the folder to write digests to when over the memory limit
+
+		The staging area is only created once this is called, so no folder
+		is created if everything fits in memory.
+
+		:return Path:  Staging area
+		"""
+		if not hasattr(self, "staging_area"):
+			self.staging_area = self.dataset.get_staging_area()
+
+		return self.staging_area
+
 	def after_process(self):
 		super().after_process()
 
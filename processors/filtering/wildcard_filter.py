@@ -1,11 +1,12 @@
 """
 Filter posts by lexicon
 """
-import re
+import functools
 import csv
 
 from backend.abstract.processor import BasicProcessor
 from common.lib.helpers import UserInput
+from common.lib.lexicon_matcher import LexiconMatcher
 
 __author__ = "Stijn Peeters"
 __credits__ = ["Stijn Peeters"]
@@ -41,11 +42,17 @@ class WildcardFilter(BasicProcessor):
         Reads a CSV file, and retains posts matching the provided filter
         """
 
-        matches = [match.strip().replace("*", "[^\s]*") for match in self.parameters.get("match").split(",")]
+        matches = [match.strip() for match in self.parameters.get("match", "").split(",") if match.strip()]
+        if not matches:
+            self.dataset.update_status("No keywords given, cannot use as filter", is_final=True)
+            self.dataset.finish(0)
+            return
 
-        # load lexicons from word lists
-
-        matcher = re.compile(r"\b(" + "|".join(matches) + r")\b", flags=re.IGNORECASE)
+        # all keywords are compiled into a single matcher, so each post only
+        # needs to be scanned once
+        matcher = LexiconMatcher()
+        matcher.add_phrases("match", matches, wildcards=True)
+        matcher.compile()
 
         # now for the real deal
         self.dataset.update_status("Reading source file")
@@ -64,15 +71,13 @@ class WildcardFilter(BasicProcessor):
             writer.writeheader()
 
             # iterate through posts and see if they match
-            for post in self.iterate_items(self.source_file):
+            match = functools.partial(match_post, matcher=matcher)
+            for post in self.iterate_items_parallel(self.source_file, match):
                 processed += 1
-                if not post.get("body", None):
-                    continue
-
                 if processed % 2500 == 0:
                     self.dataset.update_status("Processed %i posts (%i matching)" % (processed, matching_items))
 
-                if not matcher.findall(post.get("body")):
+                if not post:
                     continue
 
                 writer.writerow(post)
@@ -86,3 +91,19 @@ class WildcardFilter(BasicProcessor):
 
         # Request standalone
         self.create_standalone()
+
+
+def match_post(post, matcher):
+    """
+    Check if a post matches the filter
+
+    This is run in parallel, in separate processes.
+
+    :param dict post:  Post to check
+    :param LexiconMatcher matcher:  Compiled matcher for the keywords
+    :return dict|None:  The post if it matches, else `None`
+    """
+    if not post.get("body", None):
+        return None
+
+    return post if matcher.match(post.get("body")) else None
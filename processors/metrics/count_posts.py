@@ -3,7 +3,9 @@ Collapse post bodies into one long string
 """
 import datetime
 
-from common.lib.helpers import UserInput, pad_interval, get_interval_descriptor
+from collections import Counter
+
+from common.lib.helpers import UserInput, pad_interval, get_interval_descriptor, get_baseline_counts
 from backend.abstract.processor import BasicProcessor
 
 __author__ = "Stijn Peeters"
@@ -56,28 +58,28 @@ class CountPosts(BasicProcessor):
 		with self.dataset.get_results_path().open("w") as results:
 			counter = 0
 
-			for post in self.iterate_items(self.source_file):
+			# only the timestamp is needed to count posts per interval, and
+			# since there is little to do per post, read them in batches
+			for batch in self.iterate_batches(self.source_file, columns=("timestamp",)):
 				try:
-					date = get_interval_descriptor(post, timeframe)
+					dates = [get_interval_descriptor(post, timeframe) for post in batch]
 				except ValueError as e:
 					self.dataset.update_status("%s, cannot count posts per %s" % (str(e), timeframe), is_final=True)
 					self.dataset.update_status(0)
 					return
 
 				# Add a count for the respective timeframe
-				if date not in intervals:
-					intervals[date] = {}
-					intervals[date]["absolute"] = 1
-				else:
-					intervals[date]["absolute"] += 1
+				for date, count in Counter(dates).items():
+					if date not in intervals:
+						intervals[date] = {"absolute": 0}
 
-				first_interval = min(first_interval, date)
-				last_interval = max(last_interval, date)
+						first_interval = min(first_interval, date)
+						last_interval = max(last_interval, date)
 
-				counter += 1
+					intervals[date]["absolute"] += count
 
-				if counter % 2500 == 0:
-					self.dataset.update_status("Counted through " + str(counter) + " posts.")
+				counter += len(batch)
+				self.dataset.update_status("Counted through " + str(counter) + " posts.")
 
 			# pad interval if needed, this is useful if the result is to be
 			# visualised as a histogram, for example
@@ -94,33 +96,9 @@ class CountPosts(BasicProcessor):
 
 				self.dataset.update_status("Calculating relative counts.")
 
-				# Set a board, if used for this dataset
-				board = self.source_dataset.parameters["board"]
-				datasource = self.source_dataset.parameters["datasource"]
-				board_sql = "AND board = '" + board + "'" if board else ""
-
-				# Make sure we're using the same right date format.
-				if timeframe != "all":
-					if timeframe == "year":
-						time_format = "YYYY"
-					elif timeframe == "month":
-						time_format = "YYYY-MM"
-					elif timeframe == "week":
-						time_format = "YYYY-WW"
-					elif timeframe == "day":
-						time_format = "YYYY-MM-DD"
-					time_sql = "to_char(to_date(date, 'YYYY-MM-DD'), '%s') AS date_str," % time_format
-				else:
-					time_sql = "'all' AS date_str,"
-
 				# Fetch the total counts per timeframe for this datasource
-				total_counts = {row["date_str"]: row["count"] for row in self.db.fetchall(
-					"""
-					SELECT %s SUM(count) as count FROM metrics
-					WHERE datasource = '%s' %s
-					GROUP BY date_str
-					"""
-					% (time_sql, datasource, board_sql))}
+				total_counts = get_baseline_counts(self.db, self.source_dataset.parameters["datasource"],
+												   self.source_dataset.parameters.get("board"), timeframe)
 
 				# Quick set to check what dates are in the metrics table
 				added_dates = set(total_counts.keys())
@@ -133,7 +111,7 @@ class CountPosts(BasicProcessor):
 					if interval in added_dates:
 						intervals[interval]["relative"] = intervals[interval]["absolute"] / total_counts[interval]
 
-			rows = []
+		def rows():
 			for interval in intervals:
 
 				row = {
@@ -144,9 +122,9 @@ class CountPosts(BasicProcessor):
 				# Also add relative counts if needed
 				if add_relative:
 					row["value_relative"] = intervals[interval]["relative"]
-				rows.append(row)
+				yield row
 
-		self.write_csv_items_and_finish(rows)
+		self.write_items_and_finish(rows())
 
 	@classmethod
 	def get_options(cls, parent_dataset=None, user=None):
@@ -1,10 +1,10 @@
 """
 Generate ranking per post attribute
 """
+import heapq
 import re
 
 from collections import OrderedDict
-from itertools import islice
 
 from backend.abstract.processor import BasicProcessor
 from common.lib.helpers import UserInput, convert_to_int, get_interval_descriptor
@@ -28,6 +28,10 @@ class AttributeRanker(BasicProcessor):
 	description = "Count frequencies for a given post attribute and aggregate the results, sorted by most-occurring value. Optionally results may be counted per period."  # description displayed in UI
 	extension = "csv"  # extension of result file, used internally and in UI
 
+	# used to extract URLs and host names from post bodies
+	link_regex = re.compile(r"https?://[^\s\]()]+")
+	www_regex = re.compile(r"^www\.")
+
 	# the following determines the options available to the user via the 4CAT
 	# interface.
 	options = {
@@ -114,6 +118,9 @@ class AttributeRanker(BasicProcessor):
 		# This is needed to check for URLs in the "domain" and "url" columns for Reddit submissions
 		datasource = self.source_dataset.parameters.get("datasource")
 
+		# only read the columns we actually need from the source file
+		columns = {"timestamp", "body", "url", "urls", "hashtags", "mentions", attribute}
+
 		# we need to be able to order the values later, chronologically, so use
 		# and OrderedDict; all frequencies go into this variable
 		items = OrderedDict()
@@ -124,81 +131,75 @@ class AttributeRanker(BasicProcessor):
 		overall_top = {}
 		if rank_style == "overall":
 			self.dataset.update_status("Determining overall top-%i items" % cutoff)
-			for post in self.iterate_items(self.source_file):
-				values = self.get_values(post, attribute, filter, weighby)
-				for value in values:
-					if to_lowercase:
-						value = value.lower()
-					if value not in overall_top:
-						overall_top[value] = 0
+			for batch in self.iterate_batches(self.source_file, columns=columns):
+				for post in batch:
+					values = self.get_values(post, attribute, filter, weighby)
+					for value in values:
+						if to_lowercase:
+							value = value.lower()
+						if value not in overall_top:
+							overall_top[value] = 0
 
-					overall_top[value] += 1
+						overall_top[value] += 1
 
 			overall_top = sorted(overall_top, key=lambda item: overall_top[item], reverse=True)[0:cutoff]
 
 		# now for the real deal
 		self.dataset.update_status("Reading source file")
-		for post in self.iterate_items(self.source_file):
-			# determine where to put this data
-			try:
-				time_unit = get_interval_descriptor(post, timeframe)
-			except ValueError as e:
-				self.dataset.update_status("%s, cannot count posts per %s" % (str(e), timeframe), is_final=True)
-				self.dataset.update_status(0)
-				return
-
-			if time_unit not in items:
-				items[time_unit] = OrderedDict()
-
-			# get values from post
-			values = self.get_values(post, attribute, filter, weighby)
-
-			# keep track of occurrences of found items per relevant time period
-			for value in values:
-				if to_lowercase:
-						value = value.lower()
+		for batch in self.iterate_batches(self.source_file, columns=columns):
+			for post in batch:
+				# determine where to put this data
+				try:
+					time_unit = get_interval_descriptor(post, timeframe)
+				except ValueError as e:
+					self.dataset.update_status("%s, cannot count posts per %s" % (str(e), timeframe), is_final=True)
+					self.dataset.update_status(0)
+					return
+
+				if time_unit not in items:
+					items[time_unit] = OrderedDict()
+
+				# get values from post
+				values = self.get_values(post, attribute, filter, weighby)
+
+				# keep track of occurrences of found items per relevant time period
+				for value in values:
+					if to_lowercase:
+							value = value.lower()
 				
-				if rank_style == "overall" and value not in overall_top:
-					continue
-
-				if value not in items[time_unit]:
-					items[time_unit][value] = 0
-
-				items[time_unit][value] += 1
-
-		# sort by time and frequency
-		self.dataset.update_status("Sorting items")
-		sorted_items = OrderedDict((key, items[key]) for key in sorted(items.keys()))
-		for time_unit in sorted_items:
-			sorted_unit = OrderedDict((item, sorted_items[time_unit][item]) for item in
-									  sorted(sorted_items[time_unit], reverse=True,
-											 key=lambda key: sorted_items[time_unit][key]))
-			sorted_items[time_unit].clear()
-			sorted_items[time_unit].update(sorted_unit)
-
-			if cutoff > 0:
-				# OrderedDict's API sucks and really needs some extra
-				# convenience methods
-				sorted_items[time_unit] = OrderedDict(islice(sorted_items[time_unit].items(), cutoff))
-
-		# convert to flat list
-		rows = []
-		for time_unit in sorted_items:
-			for item in sorted_items[time_unit]:
-				row = {
-					"date": time_unit,
-					"item": item,
-					"value": sorted_items[time_unit][item]
-				}
-
-				rows.append(row)
-
-		# write as csv
-		if rows:
-			self.write_csv_items_and_finish(rows)
-		else:
+					if rank_style == "overall" and value not in overall_top:
+						continue
+
+					if value not in items[time_unit]:
+						items[time_unit][value] = 0
+
+					items[time_unit][value] += 1
+
+		if not any(items.values()):
 			self.dataset.update_status("No posts contain the requested attributes.")
 			self.dataset.finish(0)
+			return
+
+		# sort by time and frequency, and write one time unit at a time, so
+		# there is no need to keep a sorted copy of all counts in memory
+		self.dataset.update_status("Writing sorted items")
+		with self.write_items(fieldnames=("date", "item", "value")) as writer:
+			for time_unit in sorted(items.keys()):
+				counts = items.pop(time_unit)
+				if cutoff > 0:
+					top = heapq.nlargest(cutoff, counts.items(), key=lambda item: item[1])
+				else:
+					top = sorted(counts.items(), reverse=True, key=lambda item: item[1])
+
+				for item, value in top:
+					writer.write({
+						"date": time_unit,
+						"item": item,
+						"value": value
+					})
+
+		self.dataset.update_status("Finished")
+		self.dataset.finish(writer.num_rows)
 
 	def get_values(self, post, attribute, filter, weighby=None):
 		"""
@@ -210,8 +211,8 @@ class AttributeRanker(BasicProcessor):
 		:return list:  Items found for attribute
 		"""
 		# we use these to extract URLs and host names if needed
-		link_regex = re.compile(r"https?://[^\s\]()]+")
-		www_regex = re.compile(r"^www\.")
+		link_regex = self.link_regex
+		www_regex = self.www_regex
 
 		if attribute in ("url", "hostname"):
 			# URLs need some processing because there may be multiple per post
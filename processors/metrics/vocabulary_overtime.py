@@ -6,7 +6,7 @@ import re
 from pathlib import Path
 
 from backend.abstract.processor import BasicProcessor
-from common.lib.helpers import UserInput, get_interval_descriptor
+from common.lib.helpers import UserInput, get_interval_descriptor, get_baseline_counts
 
 import config
 
@@ -75,6 +75,30 @@ class OvertimeAnalysis(BasicProcessor):
 		}
 	}
 
+	@classmethod
+	def get_options(cls, parent_dataset=None, user=None):
+		"""
+		Get processor options
+
+		Frequencies can be related to the overall activity in the data source
+		for local data sources, for which this is tracked.
+
+		:param DataSet parent_dataset:  Dataset that will be uploaded
+		:param User user:  User that will be uploading it
+		:return dict:  Processor options
+		"""
+		options = cls.options.copy()
+
+		if parent_dataset and parent_dataset.parameters.get("datasource") in ("4chan", "8kun", "8chan", "parliaments", "usenet", "breitbart"):
+			options["add_relative"] = {
+				"type": UserInput.OPTION_TOGGLE,
+				"default": False,
+				"help": "Add relative frequencies",
+				"tooltip": "Divides the frequency by the total amount of posts in the data source for this timeframe."
+			}
+
+		return options
+
 	def process(self):
 		"""
 		Reads a CSV file, counts occurences of chosen values over all posts,
@@ -169,15 +193,28 @@ class OvertimeAnalysis(BasicProcessor):
 
 			processed += 1
 
+		# relate frequencies to the overall amount of posts in the data
+		# source, if needed
+		add_relative = self.parameters.get("add_relative", False)
+		if add_relative:
+			self.dataset.update_status("Calculating relative frequencies")
+			total_counts = get_baseline_counts(self.db, self.source_dataset.parameters["datasource"],
+											   self.source_dataset.parameters.get("board"), timeframe)
+
 		# turn all that data into a simple three-column frequency table
 		rows = []
 		for interval in sorted(intervals):
 			for vocabulary_id in activity:
-				rows.append({
+				row = {
 					"date": interval,
 					"item": vocabulary_id,
 					"value": activity.get(vocabulary_id, {}).get(interval, 0)
-				})
+				}
+
+				if add_relative:
+					row["value_relative"] = row["value"] / total_counts[interval] if total_counts.get(interval) else None
+
+				rows.append(row)
 
 		# write as csv
 		if rows:
@@ -5,8 +5,7 @@ import re
 
 from backend.abstract.processor import BasicProcessor
 from common.lib.helpers import UserInput
-
-import networkx as nx
+from common.lib.cooccurrence import CooccurrenceNetwork
 
 __author__ = "Stijn Peeters"
 __credits__ = ["Stijn Peeters"]
@@ -45,6 +44,22 @@ class URLCoLinker(BasicProcessor):
 			"default": "thread",
 			"tooltip": "If 'thread' is selected, URLs are considered to occur together if they appear within the same "
 					   "thread, even if they are in different posts."
+		},
+		"min-weight": {
+			"type": UserInput.OPTION_TEXT,
+			"help": "Minimum edge weight",
+			"default": 1,
+			"min": 1,
+			"tooltip": "Co-links that occur less often than this are left out of the network, as are URLs that have no "
+					   "co-links left."
+		},
+		"max-edges": {
+			"type": UserInput.OPTION_TEXT,
+			"help": "Maximum co-links per URL",
+			"default": 0,
+			"min": 0,
+			"tooltip": "If more than 0, only the most frequent co-links of each URL are kept. Useful to make very "
+					   "dense networks readable."
 		}
 	}
 
@@ -64,7 +79,7 @@ class URLCoLinker(BasicProcessor):
 
 		links = {}
 		processed = 0
-		network = nx.Graph()
+		network = CooccurrenceNetwork()
 
 		for post in self.iterate_items(self.source_file):
 			processed += 1
@@ -97,43 +112,25 @@ class URLCoLinker(BasicProcessor):
 			# if we're looking at a post level, each post gets its own
 			# co-link set, but if we're doing this on a thread level, we
 			# add all the links we found to one pool per thread, and then
-			# create co-link pairs from that in the next for loop
+			# create co-link pairs from that once all posts have been read
+			link_ids = [network.add_node(link) for link in post_links]
 			if self.parameters.get("level") == "post":
-				unit_id = post["id"]
+				network.add_clique(link_ids)
 			else:
-				unit_id = post["thread_id"]
-
-			if unit_id not in links:
-				links[unit_id] = []
+				if post["thread_id"] not in links:
+					links[post["thread_id"]] = set()
 
-			# in the case of post-level analysis, this is identical to just
-			# post_links on its own
-			links[unit_id] = [*post_links, *links[unit_id]]
+				links[post["thread_id"]].update(link_ids)
 
-		# create co-link pairs from all links per co-link unit (thread or post)
+		# create co-link pairs from all links per thread; threads with a
+		# single link (which, of course, is not co-linked with any other
+		# link) are ignored by add_clique()
 		self.dataset.update_status("Finding common URLs")
-		for unit_id in links:
-			post_links = links[unit_id]
-
-			# ignore single links (which, of course, are not co-linked with
-			# any other links)
-			if len(post_links) <= 1:
-				continue
-
-			# create co-link pairs from link sets
-			pairs = set()
-			for from_link in post_links:
-				# keep track of all URLs so we can easily write the node
-				# list later
-				if from_link not in network.nodes():
-					network.add_node(from_link)
-
-				for to_link in post_links:
-					if to_link not in network.nodes():
-						network.add_node(to_link)
+		for thread_links in links.values():
+			network.add_clique(list(thread_links))
 
-					network.add_edge(from_link, to_link)
+		network.prune(min_weight=self.parameters.get("min-weight"), max_edges_per_node=self.parameters.get("max-edges"))
 
 		self.dataset.update_status("Writing network file")
-		nx.write_gexf(network, self.dataset.get_results_path())
-		self.dataset.finish(len(network.nodes))
+		num_nodes = network.write(self.dataset.get_results_path())
+		self.dataset.finish(num_nodes)
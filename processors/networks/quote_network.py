@@ -4,8 +4,7 @@ Extract most-used images from corpus
 import re
 
 from backend.abstract.processor import BasicProcessor
-
-import networkx as nx
+from common.lib.cooccurrence import CooccurrenceNetwork
 
 __author__ = "Stijn Peeters"
 __credits__ = ["Stijn Peeters"]
@@ -43,20 +42,14 @@ class QuoteNetworkGrapher(BasicProcessor):
 		"""
 		link = re.compile(r">>([0-9]+)")
 
-		network = nx.Graph()
+		network = CooccurrenceNetwork()
 
 		self.dataset.update_status("Reading source file")
 		for post in self.iterate_items(self.source_file):
 			quotes = link.findall(post["body"])
 			if quotes:
-				if post["id"] not in network.nodes:
-					network.add_node(post["id"])
-
-				if quotes[0] not in network.nodes:
-					network.add_node(quotes[0])
-
-				network.add_edge(post["id"], quotes[0])
+				network.add_edges([network.add_node(post["id"])], [network.add_node(quotes[0])])
 
 		self.dataset.update_status("Writing network file")
-		nx.write_gexf(network, self.dataset.get_results_path())
-		self.dataset.finish(len(network.nodes))
\ No newline at end of file
+		num_nodes = network.write(self.dataset.get_results_path())
+		self.dataset.finish(num_nodes)
\ No newline at end of file
@@ -5,8 +5,8 @@ from dateutil.relativedelta import relativedelta
 
 from backend.abstract.processor import BasicProcessor
 from common.lib.helpers import UserInput, get_interval_descriptor
+from common.lib.cooccurrence import CooccurrenceNetwork
 
-import networkx as nx
 import datetime
 
 __author__ = "Stijn Peeters"
@@ -80,6 +80,30 @@ class ColumnNetworker(BasicProcessor):
             "default": False,
             "help": "Convert values to lowercase",
             "tooltip": "Merges values with varying cases"
+        },
+        "min-weight": {
+            "type": UserInput.OPTION_TEXT,
+            "help": "Minimum edge weight",
+            "default": 1,
+            "min": 1,
+            "tooltip": "Edges that occur less often than this are left out of the network, as are nodes that have no "
+                       "edges left."
+        },
+        "max-edges": {
+            "type": UserInput.OPTION_TEXT,
+            "help": "Maximum edges per node",
+            "default": 0,
+            "min": 0,
+            "tooltip": "If more than 0, only the heaviest edges of each node are kept. An edge is kept if it is among "
+                       "the heaviest edges of either of its nodes. Useful to make very dense networks readable."
+        },
+        "k-core": {
+            "type": UserInput.OPTION_TEXT,
+            "help": "Minimum node degree (k-core)",
+            "default": 0,
+            "min": 0,
+            "tooltip": "If more than 0, only the part of the network in which each node is connected to at least "
+                       "this many other nodes is kept."
         }
     }
 
@@ -146,7 +170,7 @@ class ColumnNetworker(BasicProcessor):
         processed = 0
 
         network_parameters = {"generated_by": "4CAT Capture & Analysis Toolkit", "source_dataset_id": self.source_dataset.key}
-        network = nx.DiGraph(**network_parameters) if directed else nx.Graph(**network_parameters)
+        cooccurrences = CooccurrenceNetwork(directed=directed, allow_loops=allow_loops)
 
         for item in self.iterate_items(self.source_file):
             if column_a not in item or column_b not in item:
@@ -157,7 +181,7 @@ class ColumnNetworker(BasicProcessor):
 
             processed += 1
             if processed % 500 == 0:
-                self.dataset.update_status("Processed %i items (%i nodes found)" % (processed, len(network.nodes)))
+                self.dataset.update_status("Processed %i items (%i nodes found)" % (processed, cooccurrences.num_nodes))
 
             # both columns need to have a value for an edge to be possible
             if not item.get(column_a) or not item.get(column_b):
@@ -196,121 +220,102 @@ class ColumnNetworker(BasicProcessor):
                 self.dataset.update_status(0)
                 return
 
-            for value_a in values_a:
-                for value_b in values_b:
-                    # node 'ID', which we use to differentiate by column (or not)
-                    node_a = column_a + "-" + value_a if categorise else "node-" + value_a
-                    node_b = column_b + "-" + value_b if categorise else "node-" + value_b
-
-                    if not allow_loops and node_a == node_b:
-                        continue
-
-                    # keep a list of intervals the node occurs in in the node
-                    # attributes. Use a dictionary to also record per-interval
-                    # frequency
-                    if node_a not in network.nodes():
-                        network.add_node(node_a, intervals={}, label=value_a, **({"category": column_a} if categorise else {}))
+            # node 'ID', which we use to differentiate by column (or not)
+            nodes_a = [cooccurrences.add_node(column_a + "-" + value if categorise else "node-" + value, label=value,
+                                              **({"category": column_a} if categorise else {})) for value in values_a]
+            nodes_b = [cooccurrences.add_node(column_b + "-" + value if categorise else "node-" + value, label=value,
+                                              **({"category": column_b} if categorise else {})) for value in values_b]
 
-                    if node_b not in network.nodes():
-                        network.add_node(node_b, intervals={}, label=value_b, **({"category": column_a} if categorise else {}))
+            # edges and nodes are weighted per interval, so we can record in
+            # which interval(s) they occur and how often
+            cooccurrences.add_edges(nodes_a, nodes_b, interval)
 
-                    if interval not in network.nodes[node_a]["intervals"]:
-                        network.nodes[node_a]["intervals"][interval] = 0
-
-                    if interval not in network.nodes[node_b]["intervals"]:
-                        network.nodes[node_b]["intervals"][interval] = 0
-
-                    network.nodes[node_a]["intervals"][interval] += 1
-                    network.nodes[node_b]["intervals"][interval] += 1
+        if not cooccurrences.num_edges:
+            self.dataset.update_status("No edges could be created for the given parameters", is_final=True)
+            self.dataset.finish(0)
+            return
 
-                    # Use the same method to determine per-interval edge weight
-                    edge = (node_a, node_b)
-                    if edge not in network.edges():
-                        network.add_edge(node_a, node_b, intervals={})
+        # prune the network to keep large networks manageable
+        pruned = cooccurrences.prune(min_weight=self.parameters.get("min-weight"),
+                                     max_edges_per_node=self.parameters.get("max-edges"),
+                                     k_core=self.parameters.get("k-core"))
+        if not cooccurrences.num_edges:
+            self.dataset.update_status("No edges left after pruning the network, try less strict settings", is_final=True)
+            self.dataset.finish(0)
+            return
 
-                    if interval not in network.edges[edge]["intervals"]:
-                        network.edges[edge]["intervals"][interval] = 0
+        self.dataset.update_status("Writing network file (%i edges pruned)" % pruned)
 
-                    network.edges[edge]["intervals"][interval] += 1
+        # If the network is dynamic, the weights per interval are converted
+        # into spells for each node and edge while writing, see get_spells()
+        dynamic = interval_type != "overall"
+        num_nodes = cooccurrences.write(self.dataset.get_results_path(),
+                                        interval_attributes=(lambda intervals: self.get_spells(intervals, interval_type)) if dynamic else None,
+                                        **network_parameters)
+        self.dataset.finish(num_nodes)
 
-        if not network.edges():
-            self.dataset.update_status("No edges could be created for the given parameters", is_final=True)
-            self.dataset.finish(0)
-            return
+    def get_spells(self, intervals, interval_type):
+        """
+        Calculate spells for a node or edge from its weight per interval
+
+        This is a little complicated... but Gephi requires us to define
+        periods of activity rather than just the moment at which a given node
+        or edge was present. Since gexf can only handle per-day data, weights
+        are generated for each day in the interval at the required
+        resolution.
+
+        :param dict intervals:  Weight per interval
+        :param str interval_type:  One of `year`, `month`, `week`, `day`
+        :return dict:  Attributes to add to the node or edge: `spells`, the
+        continuous periods of existence, and `frequency`, the weight during
+        each period
+        """
+        daily_weights = {}
+        for interval, weight in intervals.items():
+            daily_weights.update(self.extrapolate_weights(interval, weight, interval_type))
+
+        daily_weights = dict(sorted(daily_weights.items(), key=lambda item: item[0]))
+
+        # now figure out the continuous periods of node existence
+        # as well as the period in which each weight was accurate
+        spells = []
+        weights = []
+        start = None
+        weight_start = None
+        previous = None
+        previous_weight = 0
+        for interval, weight in daily_weights.items():
+            if not start:
+                start = interval
+                weight_start = interval
+                previous = interval
+                previous_weight = weight
+                continue
 
-        # If the network is dynamic, now we calculate spells from the intervals
-        # This is a little complicated... but Gephi requires us to define
-        # periods of activity rather than just the moment at which a given node
-        # or edge was present
-        # since gexf can only handle per-day data, generate weights for each
-        # day in the interval at the required resolution
-        if interval_type != "overall":
-            num_items = len(network.nodes) + len(network.edges)
-            transformed = 1
-            for component in (network.nodes, network.edges):
-                for item in component:
-                    if transformed % 500 == 0:
-                        self.dataset.update_status("Transforming dynamic nodes and edges (%i/%i)" % (transformed, num_items))
-
-                    transformed += 1
-                    for interval, weight in component[item]["intervals"].copy().items():
-                        del component[item]["intervals"][interval]
-                        component[item]["intervals"].update(self.extrapolate_weights(interval, weight, interval_type))
-
-                    component[item]["intervals"] = dict(sorted(component[item]["intervals"].items(), key=lambda item: item[0]))
-
-                    # now figure out the continuous periods of node existence
-                    # as well as the period in which each weight was accurate
-                    spells = []
-                    weights = []
-                    start = None
-                    weight_start = None
-                    previous = None
-                    previous_weight = 0
-                    for interval, weight in component[item]["intervals"].items():
-                        if not start:
-                            start = interval
-                            weight_start = interval
-                            previous = interval
-                            previous_weight = weight
-                            continue
-
-                        # see if there is a gap of more than one day between
-                        # this occurrence and the previous one
-                        interval_datetime = datetime.datetime.strptime(interval, "%Y-%m-%d")
-                        previous_datetime = datetime.datetime.strptime(previous, "%Y-%m-%d")
-
-                        if interval_datetime > previous_datetime + datetime.timedelta(days=1):
-                            # if so, create a new spell
-                            spells.append((start, previous))
-                            weights.append([weight, weight_start, previous])
-                            start = interval
-                            weight_start = interval
-                        elif weight != previous_weight:
-                            # for weights, also do so if the weight changes
-                            weights.append([weight, weight_start, previous])
-                            weight_start = interval
-
-                        previous = interval
-                        previous_weight = weight
-
-                    # add final spells
-                    spells.append((start, [*component[item]["intervals"].keys()][-1]))
-                    weights.append([previous_weight, weight_start, [*component[item]["intervals"].keys()][-1]])
-
-                    component[item]["spells"] = spells
-                    component[item]["frequency"] = weights
-
-        # the "intervals" key is no longer needed since it has been gexf-ified
-        # in the 'spells' and 'frequency' keys
-        for component in (network.nodes, network.edges):
-            for item in component:
-                del component[item]["intervals"]
-
-        self.dataset.update_status("Writing network file")
-        
-        nx.write_gexf(network, self.dataset.get_results_path())
-        self.dataset.finish(len(network.nodes))
+            # see if there is a gap of more than one day between
+            # this occurrence and the previous one
+            interval_datetime = datetime.datetime.strptime(interval, "%Y-%m-%d")
+            previous_datetime = datetime.datetime.strptime(previous, "%Y-%m-%d")
+
+            if interval_datetime > previous_datetime + datetime.timedelta(days=1):
+                # if so, create a new spell
+                spells.append((start, previous))
+                weights.append([weight, weight_start, previous])
+                start = interval
+                weight_start = interval
+            elif weight != previous_weight:
+                # for weights, also do so if the weight changes
+                weights.append([weight, weight_start, previous])
+                weight_start = interval
+
+            previous = interval
+            previous_weight = weight
+
+        # add final spells
+        spells.append((start, [*daily_weights.keys()][-1]))
+        weights.append([previous_weight, weight_start, [*daily_weights.keys()][-1]])
+
+        return {"spells": spells, "frequency": weights}
 
     def extrapolate_weights(self, interval, weight, interval_type):
         """
@@ -1,7 +1,6 @@
 """
 Calculate word collocations from tokens
 """
-import json
 import pickle
 
 from pathlib import Path
@@ -9,7 +8,7 @@ from pathlib import Path
 import operator
 from nltk.collocations import *
 
-from common.lib.helpers import UserInput
+from common.lib.helpers import UserInput, iterate_json_list
 from backend.abstract.processor import BasicProcessor
 
 class GetCollocations(BasicProcessor):
@@ -129,96 +128,94 @@ class GetCollocations(BasicProcessor):
 		self.dataset.update_status("Processing token sets")
 		dirname = Path(self.dataset.get_results_path().parent, self.dataset.get_results_path().name.replace(".", ""))
 
-		# Dictionary to save queries from
-		results = []
-
-		# Go through all archived token sets and generate collocations for each
-		for token_file in self.iterate_archive_contents(self.source_file):
-			# we support both pickle and json dumps of vectors
-			token_unpacker = pickle if token_file.suffix == "pb" else json
-
-			with token_file.open("rb") as binary_tokens:
-				tokens = token_unpacker.load(binary_tokens)
-
-			# Get the date
-			date_string = token_file.stem
+		# Collocations are written per token set as they are found, rather
+		# than kept in memory until the end
+		fieldnames = ["word_" + str(n + 1) for n in range(n_size)] + ["value", "date"]
+		with self.write_items(fieldnames=fieldnames) as writer:
+			# Go through all archived token sets and generate collocations for each
+			for token_name, token_file in self.iterate_archive_members(self.source_file):
+				# we support both pickle and json dumps of vectors; json token
+				# lists are read one by one, straight from the archive
+				if token_name.suffix == ".pb":
+					tokens = pickle.load(token_file)
+				else:
+					tokens = iterate_json_list(token_file)
 
-			# Get the collocations. Returns a tuple.
-			self.dataset.update_status("Generating collocations for " + date_string)
+				# Get the date
+				date_string = token_name.stem
 
-			# Store all the collocations from this tokenset here.
-			collocations = []
+				# Get the collocations. Returns a tuple.
+				self.dataset.update_status("Generating collocations for " + date_string)
 
-			# The tokens are separated per posts, so we get collocations per post.
-			for post_tokens in tokens:
-				post_collocations = self.get_collocations(post_tokens, window_size, n_size, query_string=query_string, forbidden_words=forbidden_words, unique=unique)
-				collocations += post_collocations
+				# Store all the collocations from this tokenset here.
+				collocations = []
 
-			# Loop through the collocation per post, merge, and store in the results list
-			tokenset_results = {}
+				# The tokens are separated per posts, so we get collocations per post.
+				for post_tokens in tokens:
+					post_collocations = self.get_collocations(post_tokens, window_size, n_size, query_string=query_string, forbidden_words=forbidden_words, unique=unique)
+					collocations += post_collocations
 
-			for tpl in collocations:
+				# Loop through the collocation per post, merge, and store in the results list
+				tokenset_results = {}
 
-				collocation = tpl[0]
+				for tpl in collocations:
 
-				# Sort the words, if indicated.
-				# This can be handy to get rid of (almost) duplicate data.
-				if sort_words:
-					collocation = sorted(collocation)
+					collocation = tpl[0]
 
-					# If a query string is indicated, we're putting this
-					# at the front of the list. This is handy when co-located
-					# words ought to be used for another processor, e.g. a word cloud.
-					if query_string:
-						for qs in query_string:
-							if qs in collocation:
-								collocation = list(collocation)
-								collocation.insert(0, collocation.pop(collocation.index(qs)))
-				collocation = " ".join(collocation)
+					# Sort the words, if indicated.
+					# This can be handy to get rid of (almost) duplicate data.
+					if sort_words:
+						collocation = sorted(collocation)
 
-				# Check if this collocation already appeared
-				if collocation in tokenset_results:
-					# If so, just increase the frequency count
-					tokenset_results[collocation] += tpl[1]
-				else:
-					tokenset_results[collocation] = tpl[1]
+						# If a query string is indicated, we're putting this
+						# at the front of the list. This is handy when co-located
+						# words ought to be used for another processor, e.g. a word cloud.
+						if query_string:
+							for qs in query_string:
+								if qs in collocation:
+									collocation = list(collocation)
+									collocation.insert(0, collocation.pop(collocation.index(qs)))
+					collocation = " ".join(collocation)
 
-			# Add to the overall results
-			if tokenset_results:
+					# Check if this collocation already appeared
+					if collocation in tokenset_results:
+						# If so, just increase the frequency count
+						tokenset_results[collocation] += tpl[1]
+					else:
+						tokenset_results[collocation] = tpl[1]
 
-				sorted_results = sorted(tokenset_results.items(), key=operator.itemgetter(1), reverse=True)
+				# Add to the overall results
+				if tokenset_results:
 
-				# Filter out word pairs that appear less than the min frequency, if given.
-				if min_frequency:
-					sorted_results = [tpl for tpl in sorted_results if tpl[1] >= min_frequency]
+					sorted_results = sorted(tokenset_results.items(), key=operator.itemgetter(1), reverse=True)
 
-				# Save all results or just the most frequent ones.
-				# Also allow a smaller amount of results than the max.
-				output = max_output
-				if len(sorted_results) < max_output or max_output == 0:
-					output = len(sorted_results)
+					# Filter out word pairs that appear less than the min frequency, if given.
+					if min_frequency:
+						sorted_results = [tpl for tpl in sorted_results if tpl[1] >= min_frequency]
 
-				for i in range(output):
+					# Save all results or just the most frequent ones.
+					# Also allow a smaller amount of results than the max.
+					output = max_output
+					if len(sorted_results) < max_output or max_output == 0:
+						output = len(sorted_results)
 
-					# Write each word to a separate key
-					# so they will become separate columns.
-					result = {}
-					li_collocation = sorted_results[i][0].split(" ")
-					for n in range(n_size):
-						result["word_" + str(n + 1)] = li_collocation[n]
-					result["value"] = sorted_results[i][1]
-					result["date"] = date_string
+					for i in range(output):
 
-					results.append(result)
+						# Write each word to a separate key
+						# so they will become separate columns.
+						result = {}
+						li_collocation = sorted_results[i][0].split(" ")
+						for n in range(n_size):
+							result["word_" + str(n + 1)] = li_collocation[n]
+						result["value"] = sorted_results[i][1]
+						result["date"] = date_string
 
-				max_output = max_output
+						writer.write(result)
 
-		if not results:
-			return
+					max_output = max_output
 
-		# Generate csv and finish
-		self.dataset.update_status("Writing to csv and finishing")
-		self.write_csv_items_and_finish(results)
+		self.dataset.update_status("Finished")
+		self.dataset.finish(writer.num_rows)
 
 	def get_collocations(self, tokens, window_size, n_size, query_string=False, forbidden_words=False, unique=False):
 		""" Generates a tuple of word collocations (bigrams or trigrams).
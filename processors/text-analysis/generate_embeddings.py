@@ -1,15 +1,15 @@
 """
 Generate interval-based word embedding models for sentences
 """
+import zipfile
 import shutil
 import pickle
-import json
 
 from gensim.models import Word2Vec, FastText
 from gensim.models.phrases import Phrases, Phraser
 from pathlib import Path
 
-from common.lib.helpers import UserInput, convert_to_int
+from common.lib.helpers import UserInput, convert_to_int, iterate_json_list
 from backend.abstract.processor import BasicProcessor
 from common.lib.exceptions import ProcessorInterruptedException
 
@@ -133,18 +133,18 @@ class GenerateWordEmbeddings(BasicProcessor):
 
 		# go through all archived token sets and vectorise them
 		models = 0
-		for temp_file in self.iterate_archive_contents(self.source_file):
+		for token_set, _ in self.iterate_archive_members(self.source_file):
 			# use the "list of lists" as input for the word2vec model
 			# by default the tokeniser generates one list of tokens per
 			# post... which may actually be preferable for short
 			# 4chan-style posts. But alternatively it could generate one
 			# list per sentence - this processor is agnostic in that regard
-			token_set_name = temp_file.name
+			token_set_name = token_set.name
 			self.dataset.update_status("Extracting bigrams from token set %s..." % token_set_name)
 
 			try:
 				if detect_bigrams:
-					bigram_transformer = Phrases(self.tokens_from_file(temp_file, staging_area))
+					bigram_transformer = Phrases(self.tokens_from_archive(self.source_file, token_set, staging_area))
 					bigram_transformer = Phraser(bigram_transformer)
 				else:
 					bigram_transformer = None
@@ -157,8 +157,8 @@ class GenerateWordEmbeddings(BasicProcessor):
 					# because we are using a generator, which exhausts, while
 					# Word2Vec needs to iterate over the sentences twice
 					# https://stackoverflow.com/a/57632747
-					model.build_vocab(self.tokens_from_file(temp_file, staging_area, phraser=bigram_transformer))
-					model.train(self.tokens_from_file(temp_file, staging_area, phraser=bigram_transformer), epochs=model.iter, total_examples=model.corpus_count)
+					model.build_vocab(self.tokens_from_archive(self.source_file, token_set, staging_area, phraser=bigram_transformer))
+					model.train(self.tokens_from_archive(self.source_file, token_set, staging_area, phraser=bigram_transformer), epochs=model.iter, total_examples=model.corpus_count)
 
 				except RuntimeError as e:
 					if "you must first build vocabulary before training the model" in str(e):
@@ -194,55 +194,32 @@ class GenerateWordEmbeddings(BasicProcessor):
 		self.dataset.update_status("%s model(s) saved." % model_builder.__name__)
 		self.write_archive_and_finish(staging_area)
 
-	def tokens_from_file(self, file, staging_area, phraser=None):
+	def tokens_from_archive(self, path, token_set, staging_area, phraser=None):
 		"""
-		Read tokens from token dump
+		Read tokens from a token set in an archive
 
-		If the tokens were saved as JSON, take advantage of this and return
-		them as a generator, reducing memory usage and allowing interruption.
+		The token lists are read one by one, straight from the archive, which
+		reduces memory usage, avoids extracting the token set to disk, and
+		allows interruption. Since the tokens are yielded by a generator, a
+		new one is needed for every pass over the token set.
 
-		:param Path file:
+		:param Path path:  Path to the archive containing the token set
+		:param PurePosixPath token_set:  Name of the token set in the archive
 		:param Path staging_area:  Path to staging area, so it can be cleaned
 		up when the processor is interrupted
 		:param Phraser phraser:  Optional. If given, the yielded sentence is
 		passed through the phraser to detect (e.g.) bigrams.
-		:return list:  A set of tokens
+		:return generator:  Yields token lists
 		"""
+		with zipfile.ZipFile(path) as archive, archive.open(str(token_set)) as input:
+			if token_set.suffix == ".pb":
+				token_lists = pickle.load(input)
+			else:
+				token_lists = iterate_json_list(input)
 
-		if file.suffix == "pb":
-			with file.open("rb") as input:
-				return pickle.load(input)
-
-		with file.open("r") as input:
-			input.seek(1)
-			while True:
-				line = input.readline()
-				if line is None:
-					break
-
+			for token_list in token_lists:
 				if self.interrupted:
 					shutil.rmtree(staging_area)
 					raise ProcessorInterruptedException("Interrupted while reading tokens")
 
-				if line == "]":
-					# this marks the end of the file
-					return
-
-				try:
-					# the tokeniser dumps the json with one set of tokens per
-					# line, ending with a comma
-					line = line.strip()
-					if line[-1] == ",":
-						line = line[:-1]
-						
-					token_set = json.loads(line)
-					if phraser:
-						yield phraser[token_set]
-					else:
-						yield token_set
-				except json.JSONDecodeError:
-					# old-format json dumps are not suitable for the generator
-					# approach
-					input.seek(0)
-					everything = json.load(input)
-					return everything
+				yield phraser[token_list] if phraser else token_list
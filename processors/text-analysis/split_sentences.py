@@ -1,6 +1,7 @@
 """
 Split posts into separate sentences
 """
+import functools
 import csv
 from nltk.tokenize import sent_tokenize, word_tokenize
 
@@ -73,28 +74,47 @@ class SplitSentences(BasicProcessor):
 			writer = csv.DictWriter(output, fieldnames=("post_id", "sentence",))
 			writer.writeheader()
 
-			for post in self.iterate_items(self.source_file):
+			split = functools.partial(split_post, language=language, min_length=min_length)
+			for rows in self.iterate_items_parallel(self.source_file, split):
 				if num_posts % 100 == 0:
 					self.dataset.update_status("Processing post %i" % num_posts)
 
 				num_posts += 1
-				
-				if not post["body"]:
-					continue
-					
-				sentences = sent_tokenize(post.get("body", ""), language=language)
-
-				for sentence in sentences:
-					if min_length == 0:
-						num_sentences += 1
-						writer.writerow({"sentence": sentence})
-					else:
-						# use NLTK's tokeniser to determine word count
-						words = word_tokenize(sentence)
-						if len(words) >= min_length:
-							num_sentences += 1
-							writer.writerow({"post_id": post.get("id", ""), "sentence": sentence})
+
+				for row in rows:
+					num_sentences += 1
+					writer.writerow(row)
 
 		# done!
 		self.dataset.update_status("Finished")
 		self.dataset.finish(num_sentences)
+
+
+def split_post(post, language, min_length=0):
+	"""
+	Split a post into sentences
+
+	This is run in parallel, in separate processes.
+
+	:param dict post:  Post to split
+	:param str language:  Language of the post, for the sentence tokeniser
+	:param int min_length:  Only include sentences with at least this many
+	  words
+	:return list:  Rows to write to the output file
+	"""
+	if not post["body"]:
+		return []
+
+	rows = []
+	sentences = sent_tokenize(post.get("body", ""), language=language)
+
+	for sentence in sentences:
+		if min_length == 0:
+			rows.append({"sentence": sentence})
+		else:
+			# use NLTK's tokeniser to determine word count
+			words = word_tokenize(sentence)
+			if len(words) >= min_length:
+				rows.append({"post_id": post.get("id", ""), "sentence": sentence})
+
+	return rows
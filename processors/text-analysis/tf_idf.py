@@ -1,13 +1,12 @@
 """
 Create a csv with tf-idf ranked terms
 """
-import json
 import pickle
 import numpy as np
 import pandas as pd
 import itertools
 
-from common.lib.helpers import UserInput, convert_to_int
+from common.lib.helpers import UserInput, convert_to_int, iterate_json_list
 from backend.abstract.processor import BasicProcessor
 
 from sklearn.feature_extraction.text import TfidfVectorizer
@@ -123,24 +122,24 @@ class TfIdf(BasicProcessor):
 		dates = []
 
 		# Go through all archived token sets and generate collocations for each
-		for token_file in self.iterate_archive_contents(self.source_file):
+		for token_name, token_file in self.iterate_archive_members(self.source_file):
 			# Get the date
-			date_string = token_file.stem
+			date_string = token_name.stem
 			dates.append(date_string)
 
-			# we support both pickle and json dumps of vectors
-			token_unpacker = pickle if token_file.suffix == "pb" else json
-
 			try:
-				with token_file.open("rb") as binary_tokens:
-					# these were saved as pickle dumps so we need the binary mode
-					post_tokens = token_unpacker.load(binary_tokens)
+				# we support both pickle and json dumps of vectors; json token
+				# lists are read one by one, straight from the archive
+				if token_name.suffix == ".pb":
+					post_tokens = pickle.load(token_file)
+				else:
+					post_tokens = iterate_json_list(token_file)
 
-					# Flatten the list of list of tokens - we're treating the whole time series as one document.
-					post_tokens = list(itertools.chain.from_iterable(post_tokens))
+				# Flatten the list of list of tokens - we're treating the whole time series as one document.
+				post_tokens = list(itertools.chain.from_iterable(post_tokens))
 
-					# Add to all date's tokens
-					tokens.append(post_tokens)
+				# Add to all date's tokens
+				tokens.append(post_tokens)
 
 			except UnicodeDecodeError:
 				self.dataset.update_status("Error reading input data. If it was imported from outside 4CAT, make sure it is encoded as UTF-8.", is_final=True)
@@ -170,7 +169,7 @@ class TfIdf(BasicProcessor):
 			if results:
 				# Generate csv and finish
 				self.dataset.update_status("Writing to csv and finishing")
-				self.write_csv_items_and_finish(results)
+				self.write_items_and_finish(results, fieldnames=("item", "value", "date"))
 
 		except MemoryError:
 			self.dataset.update_status("Out of memory - dataset too large to run tf-idf analysis.")
@@ -185,7 +184,7 @@ class TfIdf(BasicProcessor):
 		:param top_n, int:			The amount of top weighted tf-idf terms to return per date.
 		:param smartirs, str:		Parameters for SMART Information Retrieval System.
 
-		:returns dict, results
+		:returns generator, results
 		"""
 
 		# Create a bag of words with words repsented as ints.
@@ -204,26 +203,22 @@ class TfIdf(BasicProcessor):
 		# Retrieve the words and their tf-idf weights.
 		vector = tfidf_model[corpus]
 
-		data = []
-		row = []
-		col = []
-		vocab = []
-
-		results = []
-
-		self.dataset.update_status("Extracting results")
-		for i, doc in enumerate(vector):
-			doc_results = [[dict_tokens[id], freq] for id, freq in doc]
-			doc_results.sort(key = lambda x: x[1], reverse=True) # Sort on score
-			
-			for word, score in doc_results[:top_n]:
-				result = {}
-				result["item"] = word
-				result["value"] = score
-				result["date"] = dates[i]
-				results.append(result)
-
-		return results
+		# results are generated document by document while they are written,
+		# rather than collected in memory first
+		def extract_results():
+			self.dataset.update_status("Extracting results")
+			for i, doc in enumerate(vector):
+				doc_results = [[dict_tokens[id], freq] for id, freq in doc]
+				doc_results.sort(key = lambda x: x[1], reverse=True) # Sort on score
+
+				for word, score in doc_results[:top_n]:
+					result = {}
+					result["item"] = word
+					result["value"] = score
+					result["date"] = dates[i]
+					yield result
+
+		return extract_results()
 
 	def get_tfidf_sklearn(self, tokens, dates, ngram_range=(1, 1), min_occurrences=0, max_occurrences=0, top_n=25):
 		"""
@@ -2,6 +2,7 @@
 Tokenize post bodies
 """
 import ahocorasick
+import functools
 import string
 import json
 import re
@@ -143,14 +144,7 @@ class Tokenise(BasicProcessor):
 		"""
 		self.dataset.update_status("Building filtering automaton")
 
-		link_regex = re.compile(r"https?://[^\s]+")
-		symbol = re.compile(r"[" + re.escape(string.punctuation) + "’‘“”" + "]")
-		numbers = re.compile(r"\b[0-9]+\b")
-
-		# Twitter tokenizer if indicated
 		language = self.parameters.get("language", "english")
-		tokenizer = TweetTokenizer(preserve_case=False).tokenize if self.parameters.get("tokenizer_type") == "twitter" else word_tokenize
-		tokenizer_args = {} if self.parameters.get("tokenizer_type") == "twitter" else {"language": language}
 
 		# load word filters - words to exclude from tokenisation
 		word_filter = set()
@@ -180,16 +174,6 @@ class Tokenise(BasicProcessor):
 				# the string occurs
 				automaton.add_word(word, 1)
 
-		# initialise pre-processors if needed
-		if self.parameters.get("stem"):
-			stemmer = SnowballStemmer(language)
-
-		if self.parameters.get("lemmatise"):
-			lemmatizer = WordNetLemmatizer()
-
-		# Only keep unique words?
-		only_unique = self.parameters.get("only_unique")
-
 		# prepare staging area
 		staging_area = self.dataset.get_staging_area()
 
@@ -197,92 +181,50 @@ class Tokenise(BasicProcessor):
 		self.dataset.update_status("Processing posts")
 		docs_per = self.parameters.get("docs_per")
 		grouping = "post" if self.parameters.get("grouping-per", "") == "post" else "sentence"
-
+		tokenise_post = PostTokeniser(automaton, docs_per=docs_per, grouping=grouping, language=language,
+									  twitter=self.parameters.get("tokenizer_type") == "twitter",
+									  stem=self.parameters.get("stem"), lemmatise=self.parameters.get("lemmatise"),
+									  only_unique=self.parameters.get("only_unique"))
 
 		# this is how we'll keep track of the subsets of tokens
 		output_files = {}
 		current_output_path = None
 		output_file_handle = None
 
-		document_descriptor = "overall"
-		for post in self.iterate_items(self.source_file):
-			if not post["body"]:
+		for result in self.iterate_items_parallel(self.source_file, tokenise_post, columns=("body", "thread_id", "timestamp")):
+			if not result:
 				continue
-				
-			# determine what output unit this post belongs to
-			if docs_per != "thread":
-				try:
-					document_descriptor = get_interval_descriptor(post, docs_per)
-				except ValueError as e:
-					self.dataset.update_status("%s, cannot count posts per %s" % (str(e), docs_per), is_final=True)
-					self.dataset.update_status(0)
-					return
-			else:
-				document_descriptor = post["thread_id"] if post["thread_id"] else "undefined"
-
-			# if told so, first split the post into separate sentences
-			if grouping == "sentence":
-				groupings = sent_tokenize(post["body"], language)
-			else:
-				groupings = [post["body"]]
-
-			# tokenise...
-			for document in groupings:
-				post_tokens = []
-
-				# clean up text and get tokens from it
-				body = link_regex.sub("", document)
-
-				# Use differing tokenizers depending on the user input
-				tokens = tokenizer(body, **tokenizer_args)
-
-				# stem, lemmatise and save tokens that are not in filter
-				for token in tokens:
-					token = token.lower()
-					token = numbers.sub("", symbol.sub("", token))
 
-					# skip empty and filtered tokens
-					if not token or token in automaton:
-						continue
-
-					if self.parameters["stem"]:
-						token = stemmer.stem(token)
-
-					if self.parameters["lemmatise"]:
-						token = lemmatizer.lemmatize(token)
-
-					# append tokens to the post's token list
-					post_tokens.append(token)
+			document_descriptor, documents = result
+			if document_descriptor is None:
+				self.dataset.update_status("%s, cannot count posts per %s" % (documents, docs_per), is_final=True)
+				self.dataset.update_status(0)
+				return
 
+			for post_tokens in documents:
 				# write tokens to file
 				# this writes lists of json lists, with the outer list serialised
 				# 'manually' and the token lists serialised by the json library
-				if post_tokens:
+				output_file = staging_area.joinpath(document_descriptor + ".json")
+				output_path = str(output_file)
 
-					# Only keep unique words, if desired
-					if only_unique:
-						post_tokens = list(set(post_tokens))
+				if current_output_path != output_path:
+					self.dataset.update_status("Processing posts (%s)" % document_descriptor)
+					if output_file_handle:
+						output_file_handle.close()
+					output_file_handle = output_file.open("a")
 
-					output_file = staging_area.joinpath(document_descriptor + ".json")
-					output_path = str(output_file)
+					if output_path not in output_files:
+						output_file_handle.write("[")
+						output_files[output_path] = 0
 
-					if current_output_path != output_path:
-						self.dataset.update_status("Processing posts (%s)" % document_descriptor)
-						if output_file_handle:
-							output_file_handle.close()
-						output_file_handle = output_file.open("a")
+					current_output_path = output_path
 
-						if output_path not in output_files:
-							output_file_handle.write("[")
-							output_files[output_path] = 0
+				if output_files[current_output_path] > 0:
+					output_file_handle.write(",\n")
 
-						current_output_path = output_path
-
-					if output_files[current_output_path] > 0:
-						output_file_handle.write(",\n")
-
-					output_file_handle.write(json.dumps(post_tokens))
-					output_files[output_path] += 1
+				output_file_handle.write(json.dumps(post_tokens))
+				output_files[output_path] += 1
 
 		if output_file_handle:
 			output_file_handle.close()
@@ -296,4 +238,138 @@ class Tokenise(BasicProcessor):
 				file_handle.write("\n]")
 
 		# create zip of archive and delete temporary files and folder
-		self.write_archive_and_finish(staging_area)
\ No newline at end of file
+		self.write_archive_and_finish(staging_area)
+
+
+class PostTokeniser:
+	"""
+	Tokenise posts
+
+	Instances are called for each post in parallel, in separate processes,
+	so they only hold settings and the word filter when they are created.
+	NLTK's tokenisers, stemmers and lemmatisers are only set up when first
+	needed in each process.
+	"""
+	link_regex = re.compile(r"https?://[^\s]+")
+	symbol = re.compile(r"[" + re.escape(string.punctuation) + "’‘“”" + "]")
+	numbers = re.compile(r"\b[0-9]+\b")
+
+	def __init__(self, word_filter, docs_per, grouping="sentence", language="english", twitter=False, stem=False,
+				 lemmatise=False, only_unique=False):
+		"""
+		Set up tokeniser
+
+		:param ahocorasick.Automaton word_filter:  Words to exclude
+		:param str docs_per:  Output unit to group posts by, e.g. 'month' or
+		  'thread'
+		:param str grouping:  Tokenise per 'post' or per 'sentence'
+		:param str language:  Language of the posts
+		:param bool twitter:  Use NLTK's Twitter tokeniser
+		:param bool stem:  Stem tokens
+		:param bool lemmatise:  Lemmatise tokens
+		:param bool only_unique:  Only keep unique tokens per post
+		"""
+		self.word_filter = word_filter
+		self.docs_per = docs_per
+		self.grouping = grouping
+		self.language = language
+		self.twitter = twitter
+		self.stem = stem
+		self.lemmatise = lemmatise
+		self.only_unique = only_unique
+
+		self.tokenizer = None
+		self.stemmer = None
+		self.lemmatizer = None
+
+	def __getstate__(self):
+		"""
+		Get state for pickling
+
+		The pre-processors are set up again in the process the tokeniser is
+		sent to.
+
+		:return dict:
+		"""
+		state = self.__dict__.copy()
+		state.update({"tokenizer": None, "stemmer": None, "lemmatizer": None})
+		return state
+
+	def __call__(self, post):
+		"""
+		Tokenise a post
+
+		:param dict post:  Post to tokenise
+		:return tuple|None:  `None` if the post has no body, else a tuple of
+		  the descriptor of the output unit the post belongs to and a list of
+		  token lists, one per grouping. If the output unit cannot be
+		  determined, the descriptor is `None` and the second item is an
+		  error message.
+		"""
+		if not post["body"]:
+			return None
+
+		# initialise pre-processors if needed
+		if not self.tokenizer:
+			# Twitter tokenizer if indicated
+			if self.twitter:
+				self.tokenizer = TweetTokenizer(preserve_case=False).tokenize
+			else:
+				self.tokenizer = functools.partial(word_tokenize, language=self.language)
+
+			if self.stem:
+				self.stemmer = SnowballStemmer(self.language)
+
+			if self.lemmatise:
+				self.lemmatizer = WordNetLemmatizer()
+
+		# determine what output unit this post belongs to
+		if self.docs_per != "thread":
+			try:
+				document_descriptor = get_interval_descriptor(post, self.docs_per)
+			except ValueError as e:
+				return None, str(e)
+		else:
+			document_descriptor = post["thread_id"] if post["thread_id"] else "undefined"
+
+		# if told so, first split the post into separate sentences
+		if self.grouping == "sentence":
+			groupings = sent_tokenize(post["body"], self.language)
+		else:
+			groupings = [post["body"]]
+
+		# tokenise...
+		documents = []
+		for document in groupings:
+			post_tokens = []
+
+			# clean up text and get tokens from it
+			body = self.link_regex.sub("", document)
+			tokens = self.tokenizer(body)
+
+			# stem, lemmatise and save tokens that are not in filter
+			for token in tokens:
+				token = token.lower()
+				token = self.numbers.sub("", self.symbol.sub("", token))
+
+				# skip empty and filtered tokens
+				if not token or token in self.word_filter:
+					continue
+
+				if self.stemmer:
+					token = self.stemmer.stem(token)
+
+				if self.lemmatizer:
+					token = self.lemmatizer.lemmatize(token)
+
+				# append tokens to the post's token list
+				post_tokens.append(token)
+
+			if post_tokens:
+				# Only keep unique words, if desired
+				if self.only_unique:
+					post_tokens = list(set(post_tokens))
+
+				documents.append(post_tokens)
+
+		return document_descriptor, documents
@@ -2,11 +2,11 @@
 Create topic clusters based on datasets
 """
 
-from common.lib.helpers import UserInput
+from common.lib.helpers import UserInput, iterate_json_list
 from backend.abstract.processor import BasicProcessor
 from common.lib.exceptions import ProcessorInterruptedException
 
-import json, pickle
+import pickle
 
 from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
 from sklearn.decomposition import LatentDirichletAllocation
@@ -94,17 +94,17 @@ class TopicModeler(BasicProcessor):
 
         # go through all archived token sets and vectorise them
         index = 0
-        for token_file in self.iterate_archive_contents(self.source_file):
+        for token_name, token_file in self.iterate_archive_members(self.source_file):
             index += 1
-            self.dataset.update_status("Processing token set %i (%s)" % (index, token_file.stem))
+            self.dataset.update_status("Processing token set %i (%s)" % (index, token_name.stem))
             if self.interrupted:
                 raise ProcessorInterruptedException("Interrupted while topic modeling")
 
-            # temporarily extract file (we cannot use ZipFile.open() as it doesn't support binary modes)
-            with token_file.open("rb") as binary_tokens:
-                tokens = json.load(binary_tokens)
+            # token lists are passed to the vectoriser one by one, straight
+            # from the archive
+            tokens = iterate_json_list(token_file)
 
-            self.dataset.update_status("Vectorising token set '%s'" % token_file.stem)
+            self.dataset.update_status("Vectorising token set '%s'" % token_name.stem)
             vectoriser = vectoriser_class(tokenizer=lambda token: token, lowercase=False, min_df=min_df, max_df=max_df)
 
             try:
@@ -117,7 +117,7 @@ class TopicModeler(BasicProcessor):
 
             features = vectoriser.get_feature_names()
 
-            self.dataset.update_status("Fitting token clusters for token set '%s'" % token_file.stem)
+            self.dataset.update_status("Fitting token clusters for token set '%s'" % token_name.stem)
             if self.interrupted:
                 raise ProcessorInterruptedException("Interrupted while fitting LDA model")
 
@@ -126,11 +126,11 @@ class TopicModeler(BasicProcessor):
 
             # store features too, because we need those to later know what
             # tokens the modeled weights correspond to
-            self.dataset.update_status("Storing model for token set '%s'" % token_file.stem)
-            with staging_area.joinpath("%s.features" % token_file.stem).open("wb") as outfile:
+            self.dataset.update_status("Storing model for token set '%s'" % token_name.stem)
+            with staging_area.joinpath("%s.features" % token_name.stem).open("wb") as outfile:
                 pickle.dump(features, outfile)
 
-            with staging_area.joinpath("%s.model" % token_file.stem).open("wb") as outfile:
+            with staging_area.joinpath("%s.model" % token_name.stem).open("wb") as outfile:
                 pickle.dump(model, outfile)
 
         self.dataset.update_status("Compressing generated model files")
@@ -6,6 +6,7 @@ import pickle
 import itertools
 
 from backend.abstract.processor import BasicProcessor
+from common.lib.helpers import iterate_json_list
 
 __author__ = "Stijn Peeters"
 __credits__ = ["Stijn Peeters"]
@@ -44,42 +45,41 @@ class Vectorise(BasicProcessor):
 
 		# go through all archived token sets and vectorise them
 		index = 0
-		for token_file in self.iterate_archive_contents(self.source_file):
+		for token_name, token_file in self.iterate_archive_members(self.source_file):
 			index += 1
-			vector_set_name = token_file.stem  # we don't need the full path
+			vector_set_name = token_name.stem  # we don't need the full path
 			self.dataset.update_status("Processing token set %i (%s)" % (index, vector_set_name))
 
 			# we support both pickle and json dumps of vectors
 			token_unpacker = pickle if vector_set_name.split(".")[-1] == "pb" else json
 			write_mode = "wb" if token_unpacker is pickle else "w"
 
-			# temporarily extract file (we cannot use ZipFile.open() as it doesn't support binary modes)
-			with token_file.open("rb") as binary_tokens:
-				# these were saved as pickle dumps so we need the binary mode
-				tokens = token_unpacker.load(binary_tokens)
+			# json token sets are read token list by token list, straight from
+			# the archive - we don't have to separate per post
+			if token_unpacker is pickle:
+				tokens = itertools.chain.from_iterable(pickle.load(token_file))
+			else:
+				tokens = itertools.chain.from_iterable(iterate_json_list(token_file))
 
-				# flatten token list first - we don't have to separate per post
-				tokens = list(itertools.chain.from_iterable(tokens))
+			# all we need is a pretty straightforward frequency count
+			vectors = {}
+			for token in tokens:
+				if token not in vectors:
+					vectors[token] = 0
+				vectors[token] += 1
 
-				# all we need is a pretty straightforward frequency count
-				vectors = {}
-				for token in tokens:
-					if token not in vectors:
-						vectors[token] = 0
-					vectors[token] += 1
+			# convert to vector list
+			vectors_list = [[token, vectors[token]] for token in vectors]
 
-				# convert to vector list
-				vectors_list = [[token, vectors[token]] for token in vectors]
+			# sort
+			vectors_list = sorted(vectors_list, key=lambda item: item[1], reverse=True)
 
-				# sort
-				vectors_list = sorted(vectors_list, key=lambda item: item[1], reverse=True)
+			# dump the resulting file via pickle
+			vector_path = staging_area.joinpath(vector_set_name)
+			vector_paths.append(vector_path)
 
-				# dump the resulting file via pickle
-				vector_path = staging_area.joinpath(vector_set_name)
-				vector_paths.append(vector_path)
-
-				with vector_path.open(write_mode) as output:
-					token_unpacker.dump(vectors_list, output)
+			with vector_path.open(write_mode) as output:
+				token_unpacker.dump(vectors_list, output)
 
 		# create zip of archive and delete temporary files and folder
 		self.write_archive_and_finish(staging_area)
@@ -6,12 +6,11 @@ import random
 import shutil
 import math
 
-from PIL import Image, ImageFile, ImageOps, ImageDraw, UnidentifiedImageError
-from sklearn.cluster import KMeans
+import numpy as np
+from PIL import Image, ImageFile, ImageOps, UnidentifiedImageError
 
 from common.lib.helpers import UserInput, convert_to_int
 from backend.abstract.processor import BasicProcessor
-from common.lib.exceptions import ProcessorInterruptedException
 
 __author__ = "Stijn Peeters"
 __credits__ = ["Stijn Peeters"]
@@ -94,14 +93,6 @@ class ImageWallGenerator(BasicProcessor):
 		ImageFile.LOAD_TRUNCATED_IMAGES = True
 		sample_max = 75  # image size for colour sampling
 
-		def numpy_to_rgb(numpy_array):
-			"""
-			Helper function to go from numpy array to list of RGB strings
-
-			Used in the K-Means clustering part
-			"""
-			return ",".join([str(int(value)) for value in numpy_array])
-
 		max_images = convert_to_int(self.parameters.get("amount"), 100)
 		sizing_mode = self.parameters.get("tile-size")
 		sort_mode = self.parameters.get("sort-mode")
@@ -116,113 +107,42 @@ class ImageWallGenerator(BasicProcessor):
 		if max_images == 0:
 			max_images = self.get_options()["amount"]["max"]
 
-		# we loop through the images twice - once to reduce them to a value
-		# that can be sorted, and another time to actually copy them to the
-		# canvas for the image wall
-
-		# we create a staging area manually here, so it is not automatically
-		# deleted after one loop, since we need two
+		# we create a staging area manually here, so the images are still
+		# there when rendering them
 		staging_area = self.dataset.get_staging_area()
-
-		# first, extract and reduce, and store the sortable value in a
-		# dictionary with the image file name as key
+		image_files = []
+		for path in self.iterate_archive_contents(self.source_file, staging_area):
+			image_files.append(path)
+			if len(image_files) % 100 == 0:
+				self.dataset.update_status("Extracted %i images" % len(image_files))
+
+		# images are analysed in the shared process pool. Only their
+		# dimensions and representative colour are kept; the images that end
+		# up on the wall are decoded again when rendering, at the size of
+		# their tile
+		tasks = [(path, sort_mode, sample_max) for path in image_files]
+
+		# store the sortable value in a dictionary with the image file name
+		# as key
 		image_colours = {}
 		dimensions = {}  # used to calculate optimal tile size later
-		index = 0
-		random_values = list(range(0, self.source_dataset.num_rows))
-		random.shuffle(random_values)
-
-		for path in self.iterate_archive_contents(self.source_file, staging_area):
-			if self.interrupted:
-				raise ProcessorInterruptedException("Interrupted while determining image wall order")
 
-			try:
-				picture = Image.open(str(path))
-			except UnidentifiedImageError:
-				self.dataset.update_status("Image %s could not be parsed. Skipping." % path)
+		for i, (name, size, value) in enumerate(self.map_parallel(analyse_image, tasks)):
+			if not size:
+				self.dataset.update_status("Image %s could not be parsed. Skipping." % name)
 				continue
 
-			self.dataset.update_status("Analysing %s (%i/%i)" % (path.name, len(dimensions), self.source_dataset.num_rows))
-
-			# these calculations can take ages for huge images, so resize if it is
-			# larger than the threshold
-			dimensions[path.name] = (picture.width, picture.height)
-			if sort_mode not in ("", "random") and (picture.height > sample_max or picture.width > sample_max):
-				sample_width = int(sample_max * picture.width / max(picture.width, picture.height))
-				sample_height = int(sample_max * picture.height / max(picture.width, picture.height))
-				picture = ImageOps.fit(picture, (sample_width, sample_height))
+			if i % 10 == 0:
+				self.dataset.update_status("Analysing %s (%i/%i)" % (name, i + 1, len(tasks)))
 
-			if sort_mode not in ("", "random"):
-				# ensure we get RGB values for pixels
-				picture = picture.convert("RGB")
+			dimensions[name] = size
 
-			# determine a 'representative colour'
 			if sort_mode == "random":
 				# just randomly sort it, don't even look at the colours
-				value = random_values.pop()
-
-			elif sort_mode in ("average-rgb", "average-hsv"):
-				# average colour, as RGB or HSV
-				pixels = picture.getdata()
-				if sort_mode == "average-hsv":
-					pixels = [colorsys.rgb_to_hsv(*pixel) for pixel in pixels]
-
-				sum_colour = (sum([p[0] for p in pixels]), sum([p[1] for p in pixels]), sum([p[2] for p in pixels]))
-				avg_colour = (sum_colour[0] / len(pixels), sum_colour[1] / len(pixels), sum_colour[2] / len(pixels))
-
-				# this is a bit dumb, but since all the other modes return rgb...
-				if sort_mode == "average-hsv":
-					avg_colour = colorsys.hsv_to_rgb(*avg_colour)
-
-				value = avg_colour
-
-			elif sort_mode == "dominant":
-				# most-occurring colour
-				colours = picture.getcolors(picture.width * picture.height)
-				colours = sorted(colours, key=lambda x: x[0], reverse=True)
-				value = colours[0][1]
-
-			elif sort_mode in ("kmeans-dominant", "kmeans-average"):
-				# use k-means clusters to determine the representative colour
-				# this is more computationally expensive but gives far better
-				# results.
-
-				# determine k-means clusters for this image, i.e. the n most
-				# dominant "average" colours, in this case n=3 (make parameter?)
-				pixels = picture.getdata()
-				clusters = KMeans(n_clusters=3, random_state=0)  # 0 so it is deterministic
-				predicted_centroids = clusters.fit_predict(pixels).tolist()
-
-				# now we have two options -
-				if sort_mode == "kmeans-dominant":
-					# the colour of the single most dominant k-means centroid
-					ranked_centroids = {}
-					for index in range(0, len(clusters.cluster_centers_)):
-						ranked_centroids[numpy_to_rgb(clusters.cluster_centers_[index])] = predicted_centroids.count(
-							index)
-
-					value = [int(v) for v in
-							 sorted(ranked_centroids, key=lambda k: ranked_centroids[k], reverse=True)[0].split(",")]
-
-				elif sort_mode == "kmeans-average":
-					# average colour of all k-means centroids, weighted by the
-					# dominance of each centroid
-					value = [0, 0, 0]
-					for index in clusters.labels_:
-						value[0] += clusters.cluster_centers_[index][0]
-						value[1] += clusters.cluster_centers_[index][1]
-						value[2] += clusters.cluster_centers_[index][2]
-
-					value[0] /= len(clusters.labels_)
-					value[1] /= len(clusters.labels_)
-					value[2] /= len(clusters.labels_)
-
+				image_colours[name] = (random.random(),)
 			else:
-				value = (0, 0, 0)
-
-			# converted to HSV, because RGB does not sort nicely
-			image_colours[path.name] = colorsys.rgb_to_hsv(*value)
-			index += 1
+				# converted to HSV, because RGB does not sort nicely
+				image_colours[name] = colorsys.rgb_to_hsv(*value)
 
 		# only retain the top n of the sorted list of images - this gives us
 		# our final image set
@@ -309,45 +229,47 @@ class ImageWallGenerator(BasicProcessor):
 		else:
 			raise NotImplementedError("Sizing mode '%s' not implemented" % sizing_mode)
 
-		self.dataset.log("Canvas size is %ix%i" % (size_x, size_y))
-		wall = Image.new("RGBA", (int(size_x), int(size_y)))
-		ImageDraw.floodfill(wall, (0, 0), (255, 255, 255, 0))  # transparent background
-		counter = 0
-		offset_x = 0
-		offset_y = 0
-
 		tile_x = int(tile_x)
 		tile_y = int(tile_y)
-
-		# now actually putting the images on a wall is relatively trivial
+		size_x = int(size_x)
+
+		# simply put the images side by side until the right edge is
+		# reached, then move to a new row. Doing this before rendering means
+		# we know how many rows there will be - in some edge cases, there is
+		# an extra row of images that we hadn't accounted for - so the
+		# canvas can be created at the right size straight away
+		tiles = []
+		offset_x = 0
+		offset_y = 0
 		for path in sorted_image_files:
-			counter += 1
-			self.dataset.update_status("Rendering %s (%i/%i) to image wall" % (path, counter, len(sorted_image_files)))
-			picture = Image.open(str(staging_area.joinpath(path)))
-
 			if tile_x == -1:
-				picture_x = max(1, int(picture.width * (tile_y / picture.height)))
-				picture = ImageOps.fit(picture, (picture_x, tile_y), method=Image.BILINEAR)
+				picture_x = max(1, int(dimensions[path][0] * (tile_y / dimensions[path][1])))
 			else:
-				picture = ImageOps.fit(picture, (tile_x, tile_y), method=Image.BILINEAR)
+				picture_x = tile_x
 
-			# simply put them side by side until the right edge is reached,
-			# then move to a new row
-			if offset_x + picture.width > wall.width:
+			if offset_x > 0 and offset_x + picture_x > size_x:
 				offset_x = 0
-				offset_y += picture.height
+				offset_y += tile_y
+
+			tiles.append((path, (offset_x, offset_y), (picture_x, tile_y)))
+			offset_x += picture_x
+
+		size_y = max(int(size_y), offset_y + tile_y)
+		self.dataset.log("Canvas size is %ix%i" % (size_x, size_y))
+		wall = Image.new("RGBA", (size_x, size_y), (255, 255, 255, 0))  # transparent background
 
-			# this can happen in some edge cases: there is an extra row of
-			# images we hadn't accounted for. In that case, simply enlarge the
-			# canvas.
-			if offset_y + picture.height > wall.height:
-				new_wall = Image.new("RGBA", (wall.width, offset_y + picture.height))
-				ImageDraw.floodfill(new_wall, (0, 0), (255, 255, 255, 0))  # transparent background
-				new_wall.paste(wall, (0, 0))
-				wall = new_wall
+		# now actually putting the images on a wall is relatively trivial;
+		# tiles are cut from the images in the process pool, so only images
+		# of (at most) the size of a tile are sent back
+		tasks = [(staging_area.joinpath(path), tile_size) for path, position, tile_size in tiles]
+		counter = 0
+		for (path, position, tile_size), tile in zip(tiles, self.map_parallel(render_tile, tasks)):
+			counter += 1
+			if counter % 10 == 0:
+				self.dataset.update_status("Rendering %s (%i/%i) to image wall" % (path, counter, len(sorted_image_files)))
 
-			wall.paste(picture, (offset_x, offset_y))
-			offset_x += picture.width
+			if tile:
+				wall.paste(tile, position)
 
 		# finish up
 		self.dataset.update_status("Saving result")
@@ -355,4 +277,183 @@ class ImageWallGenerator(BasicProcessor):
 		shutil.rmtree(staging_area)
 
 		self.dataset.update_status("Finished")
-		self.dataset.finish(counter)
\ No newline at end of file
+		self.dataset.finish(counter)
+
+
+def analyse_image(task):
+	"""
+	Determine the dimensions and representative colour of an image
+
+	Run in a child process of the image wall processor. The colour is
+	determined from a downscaled version of the image; for JPEGs, the
+	decoder can do most of the downscaling itself, which is much faster than
+	decoding the full image.
+
+	:param tuple task:  Path to the image, sort mode, and size of the image
+	  to determine the representative colour with
+	:return tuple:  File name, original dimensions, and representative colour
+	  as an RGB tuple. Dimensions and colour are `None` if the image could
+	  not be read.
+	"""
+	path, sort_mode, sample_max = task
+	ImageFile.LOAD_TRUNCATED_IMAGES = True
+
+	try:
+		picture = Image.open(str(path))
+		dimensions = (picture.width, picture.height)
+		if sort_mode in ("", "random"):
+			return path.name, dimensions, (0, 0, 0)
+
+		picture.draft("RGB", (sample_max, sample_max))
+		picture.load()
+	except (UnidentifiedImageError, OSError):
+		return path.name, None, None
+
+	# these calculations can take ages for huge images, so resize if it is
+	# larger than the threshold
+	picture = picture.convert("RGB")
+	if picture.height > sample_max or picture.width > sample_max:
+		sample_width = max(1, int(sample_max * picture.width / max(picture.width, picture.height)))
+		sample_height = max(1, int(sample_max * picture.height / max(picture.width, picture.height)))
+		picture = picture.resize((sample_width, sample_height), resample=Image.BILINEAR)
+
+	pixels = np.asarray(picture, dtype=np.uint8).reshape(-1, 3)
+
+	# determine a 'representative colour'
+	if sort_mode == "average-rgb":
+		value = tuple(pixels.mean(axis=0))
+
+	elif sort_mode == "average-hsv":
+		# this is a bit dumb, but since all the other modes return rgb...
+		value = colorsys.hsv_to_rgb(*rgb_to_hsv(pixels.astype(np.float64)).mean(axis=0))
+
+	elif sort_mode == "dominant":
+		# most-occurring colour
+		colours, counts = count_colours(pixels)
+		value = tuple(colours[counts.argmax()])
+
+	elif sort_mode in ("kmeans-dominant", "kmeans-average"):
+		# use k-means clusters to determine the representative colour
+		# this is more computationally expensive but gives far better
+		# results. Determine k-means clusters for this image, i.e. the n
+		# most dominant "average" colours, in this case n=3 (make parameter?)
+		centroids, weights = kmeans(*count_colours(pixels), clusters=3)
+
+		if sort_mode == "kmeans-dominant":
+			# the colour of the single most dominant k-means centroid
+			value = tuple(int(v) for v in centroids[weights.argmax()])
+		else:
+			# average colour of all k-means centroids, weighted by the
+			# dominance of each centroid
+			value = tuple((centroids * weights[:, None]).sum(axis=0) / weights.sum())
+
+	else:
+		value = (0, 0, 0)
+
+	return path.name, dimensions, tuple(float(v) for v in value)
+
+
+def render_tile(task):
+	"""
+	Cut an image wall tile from an image
+
+	Run in a child process of the image wall processor. The image is decoded
+	at (about) the smallest size that still covers the tile.
+
+	:param tuple task:  Path to the image, and width and height of the tile
+	:return Image|None:  The tile as an RGBA image, or `None` if the image
+	  could not be read
+	"""
+	path, tile_size = task
+	ImageFile.LOAD_TRUNCATED_IMAGES = True
+
+	try:
+		picture = Image.open(str(path))
+		picture.draft("RGB", tile_size)
+		picture.load()
+	except (UnidentifiedImageError, OSError):
+		return None
+
+	return ImageOps.fit(picture.convert("RGBA"), tile_size, method=Image.BILINEAR)
+
+
+def count_colours(pixels):
+	"""
+	Count the occurrences of colours
+
+	:param np.ndarray pixels:  Array of RGB values, one row per pixel
+	:return tuple:  Array of unique colours, and array with the amount of
+	  pixels per colour
+	"""
+	packed = (pixels[:, 0].astype(np.uint32) << 16) | (pixels[:, 1].astype(np.uint32) << 8) | pixels[:, 2]
+	packed, counts = np.unique(packed, return_counts=True)
+	colours = np.stack(((packed >> 16) & 255, (packed >> 8) & 255, packed & 255), axis=1)
+
+	return colours, counts
+
+
+def rgb_to_hsv(pixels):
+	"""
+	Convert RGB values to HSV
+
+	Works like `colorsys.rgb_to_hsv()`, but for an array of values at once.
+
+	:param np.ndarray pixels:  Array of RGB values, one row per pixel
+	:return np.ndarray:  Array of HSV values
+	"""
+	maxc = pixels.max(axis=1)
+	minc = pixels.min(axis=1)
+	spread = maxc - minc
+	grey = spread == 0
+	safe_spread = np.where(grey, 1, spread)
+
+	saturation = np.where(grey, 0, spread / np.where(maxc == 0, 1, maxc))
+	rc, gc, bc = [(maxc - pixels[:, channel]) / safe_spread for channel in range(3)]
+	hue = np.where(pixels[:, 0] == maxc, bc - gc, np.where(pixels[:, 1] == maxc, 2.0 + rc - bc, 4.0 + gc - rc))
+	hue = np.where(grey, 0, (hue / 6.0) % 1.0)
+
+	return np.stack((hue, saturation, maxc), axis=1)
+
+
+def kmeans(colours, counts, clusters=3, iterations=50):
+	"""
+	Find clusters of colours with k-means
+
+	Colours are weighted by the amount of pixels they occur in, so each
+	unique colour only needs to be compared to the centroids once. Centroids
+	are initialised with k-means++, with a fixed seed so results are
+	deterministic.
+
+	:param np.ndarray colours:  Unique RGB values, one row per colour
+	:param np.ndarray counts:  Amount of pixels per colour
+	:param int clusters:  Amount of clusters to find
+	:param int iterations:  Maximum amount of iterations
+	:return tuple:  Array of centroids, and array with the amount of pixels
+	  per centroid
+	"""
+	colours = colours.astype(np.float64)
+	weights = counts.astype(np.float64)
+	if len(colours) <= clusters:
+		return colours, weights
+
+	random_state = np.random.RandomState(0)
+	centroids = [colours[random_state.choice(len(colours), p=weights / weights.sum())]]
+	for i in range(1, clusters):
+		distances = ((colours[:, None, :] - np.array(centroids)[None, :, :]) ** 2).sum(axis=2).min(axis=1)
+		centroids.append(colours[random_state.choice(len(colours), p=weights * distances / (weights * distances).sum())])
+	centroids = np.array(centroids)
+
+	labels = None
+	for i in range(0, iterations):
+		new_labels = ((colours[:, None, :] - centroids[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+		if labels is not None and np.array_equal(labels, new_labels):
+			break
+
+		labels = new_labels
+		cluster_weights = np.bincount(labels, weights=weights, minlength=clusters)
+		for channel in range(0, 3):
+			sums = np.bincount(labels, weights=colours[:, channel] * weights, minlength=clusters)
+			# clusters without colours keep their old centroid
+			centroids[:, channel] = np.where(cluster_weights > 0, sums / np.maximum(cluster_weights, 1), centroids[:, channel])
+
+	return centroids, np.bincount(labels, weights=weights, minlength=clusters)
@@ -73,33 +73,40 @@ class SigmaNetwork(BasicProcessor):
 	def render_gexf_sigma_compatible(self):
 		"""
 		Unfortunately sigma js does not unequivocally accept any gexf file.
-		The gexf 1.2draft produced by networkx does not work by default./
-		Luckily we only need to change one small thing: XXX
-		"""
+		The gexf 1.2draft produced by networkx does not work by default, since
+		sigma js needs the nodes to have a size and a position.
+
+		Networks written by 4CAT's own network writer already have these, with
+		positions from a precomputed layout, and can be used as-is. Other
+		files are converted line by line, giving each node a random position.
 
+		:return Path:  Path to sigma-compatible gexf file
+		"""
 		with open(self.source_file, encoding="utf-8") as f:
-			file_str = f.read()
-
-		# A bit hacky: change gexf version from 1.2 to 1.3
-		file_str = file_str.replace(
-			'<gexf xmlns="http://www.gexf.net/1.2draft" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:schemaLocation="http://www.gexf.net/1.2draft http://www.gexf.net/1.2draft/gexf.xsd" version="1.2">',
-			'<gexf xmlns="http://www.gexf.net/1.3" version="1.3" xmlns:viz="http://www.gexf.net/1.3/viz" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:schemaLocation="http://www.gexf.net/1.3 http://www.gexf.net/1.3/gexf.xsd">')
-
-		# To make the gexf file sigma compatible, we need to add these viz tags
-		file_str = file_str.replace("</node>", "<viz:size></viz:size>\n      <viz:position></viz:position>\n      </node>")
-			
-		# Give the nodes a random position by hard-coding it into the XML
-		file_str = file_str.replace("{", "#!#_!#!").replace("}", "#@#_@#@")
-		file_str = file_str.replace('<viz:position>', '<viz:position x="{}" y="{}">')
-		position_count = file_str.count("{}")
-		file_str = file_str.format(*(random.randint(-200, 200) for _ in range(position_count)))
-		file_str = file_str.replace("#!#_!#!", "{").replace("#@#_@#@", "}")
+			header = f.read(65536)
+
+		if "<viz:position" in header:
+			# the html page refers to the file via the /result/ route, which
+			# serves files from the same folder as our own result file
+			return self.source_file
 
 		# Write HTML file
 		sigma_gexf = self.dataset.get_results_path().with_suffix(".gexf")
 
-		with open(sigma_gexf, "w", encoding="utf-8") as output_file:
-			output_file.write(file_str)
+		with open(self.source_file, encoding="utf-8") as infile, open(sigma_gexf, "w", encoding="utf-8") as output_file:
+			for line in infile:
+				# A bit hacky: change gexf version from 1.2 to 1.3
+				line = line.replace(
+					'<gexf xmlns="http://www.gexf.net/1.2draft" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:schemaLocation="http://www.gexf.net/1.2draft http://www.gexf.net/1.2draft/gexf.xsd" version="1.2">',
+					'<gexf xmlns="http://www.gexf.net/1.3" version="1.3" xmlns:viz="http://www.gexf.net/1.3/viz" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:schemaLocation="http://www.gexf.net/1.3 http://www.gexf.net/1.3/gexf.xsd">')
+
+				# To make the gexf file sigma compatible, we need to add these
+				# viz tags, giving the nodes a random position
+				if "</node>" in line:
+					line = line.replace("</node>", "<viz:size></viz:size>\n      <viz:position x=\"%i\" y=\"%i\"></viz:position>\n      </node>" % (
+						random.randint(-200, 200), random.randint(-200, 200)))
+
+				output_file.write(line)
 
 		return sigma_gexf
 
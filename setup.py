@@ -63,6 +63,11 @@ unix_packages = [
 if os.name != "nt":
 	packages = packages + unix_packages
 
+# Optional features; install with e.g. `pip install -e .[parquet]`
+extra_packages = {
+	"parquet": ["pyarrow>=7.0.0,<16"]
+}
+
 setup(
 	name='fourcat',
 	version=version,
@@ -75,4 +80,5 @@ setup(
 	packages=['backend', 'webtool', 'datasources'],
 	python_requires='>=3.7',
 	install_requires=packages,
+	extras_require=extra_packages,
 )
@@ -0,0 +1,51 @@
+"""
+Tests for common.lib.helpers
+"""
+import random
+import json
+import io
+
+import pytest
+
+from common.lib.helpers import iterate_json_list
+
+
+@pytest.mark.parametrize("chunk_size", range(1, 12))
+def test_iterate_json_list_numbers(chunk_size):
+	"""
+	Numbers split over multiple chunks are parsed as a whole
+	"""
+	document = "[1.5, -20, 3e4,1E-2 ,0.125,true,null, 1000000]"
+	items = list(iterate_json_list(io.StringIO(document), chunk_size=chunk_size))
+
+	assert items == json.loads(document)
+
+
+def test_iterate_json_list_fuzz():
+	"""
+	Any JSON list is read correctly, regardless of chunk size
+	"""
+	generator = random.Random(4)
+
+	def random_item(depth=0):
+		kind = generator.choice(("int", "float", "string", "bool", "null", "list") if depth < 2 else ("int", "string"))
+		if kind == "int":
+			return generator.randint(-10 ** 6, 10 ** 6)
+		elif kind == "float":
+			return generator.uniform(-1000, 1000)
+		elif kind == "string":
+			return "".join(generator.choice("ab, ]\"\\é€🐈") for i in range(generator.randint(0, 8)))
+		elif kind == "bool":
+			return generator.random() > 0.5
+		elif kind == "null":
+			return None
+		else:
+			return [random_item(depth + 1) for i in range(generator.randint(0, 4))]
+
+	for i in range(200):
+		items = [random_item() for j in range(generator.randint(0, 20))]
+		document = json.dumps(items, indent=generator.choice((None, 1)), ensure_ascii=generator.random() > 0.5)
+
+		for chunk_size in (1, 2, 3, 5, 7, 64):
+			assert list(iterate_json_list(io.StringIO(document), chunk_size=chunk_size)) == items
+			assert list(iterate_json_list(io.BytesIO(document.encode("utf-8")), chunk_size=chunk_size)) == items
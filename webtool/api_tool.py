@@ -4,16 +4,12 @@
 
 import importlib
 import hashlib
-import psutil
 import config
 import json
 import time
 import csv
-import os
 import re
 
-from pathlib import Path
-
 import backend
 
 from flask import jsonify, request, render_template, render_template_string, redirect, send_file, url_for, flash, \
@@ -25,7 +21,6 @@ from webtool import app, db, log, openapi, limiter, queue
 from webtool.lib.helpers import error
 
 from common.lib.exceptions import QueryParametersException, JobNotFoundException
-from common.lib.queue import JobQueue
 from common.lib.job import Job
 from common.lib.dataset import DataSet
 from common.lib.helpers import UserInput, call_api
@@ -36,6 +31,15 @@ api_ratelimit = limiter.shared_limit("3 per second", scope="api")
 API_SUCCESS = 200
 API_FAIL = 404
 
+# the status endpoint is polled frequently by monitoring tools, so its
+# response is cached for a few seconds
+STATUS_CACHE_TTL = 5
+status_cache = {"response": None, "timestamp": 0}
+
+# the backend is considered to be down if it has not updated its heartbeat
+# for this many seconds
+BACKEND_HEARTBEAT_TIMEOUT = 60
+
 csv.field_size_limit(1024 * 1024 * 1024)
 
 @app.route("/api/")
@@ -72,29 +76,30 @@ def api_status():
 	:return: Flask JSON response
 	"""
 
+	now = time.time()
+	if status_cache["response"] and status_cache["timestamp"] > now - STATUS_CACHE_TTL:
+		return jsonify(status_cache["response"])
+
 	# get job stats
-	queue = JobQueue(logger=log, database=db)
-	jobs = queue.get_all_jobs()
-	jobs_count = len(jobs)
-	jobs_types = set([job.data["jobtype"] for job in jobs])
-	jobs_sorted = {jobtype: len([job for job in jobs if job.data["jobtype"] == jobtype]) for jobtype in jobs_types}
-	jobs_sorted["total"] = jobs_count
-
-	# determine if backend is live by checking if the process is running
-	lockfile = Path(config.PATH_ROOT, config.PATH_LOCKFILE, "4cat.pid")
-	if os.path.isfile(lockfile):
-		with lockfile.open() as pidfile:
-			pid = pidfile.read()
-			backend_live = int(pid) in psutil.pids()
-	else:
-		backend_live = False
+	stats = queue.get_job_stats()
+	jobs_sorted = {jobtype: stats[jobtype]["queued"] for jobtype in stats}
+	jobs_sorted["total"] = sum(jobs_sorted.values())
+
+	# age of the oldest non-recurring job, in seconds
+	jobs_oldest = {jobtype: int(now - stats[jobtype]["oldest"]) for jobtype in stats if stats[jobtype]["oldest"]}
+	jobs_oldest["total"] = max(jobs_oldest.values()) if jobs_oldest else 0
+
+	# determine if backend is live by checking if it recently reported in
+	heartbeat = db.fetchone("SELECT timestamp FROM heartbeat WHERE component = 'backend'")
+	backend_live = bool(heartbeat) and heartbeat["timestamp"] > now - BACKEND_HEARTBEAT_TIMEOUT
 
 	response = {
 		"code": API_SUCCESS,
 		"items": {
 			"backend": {
 				"live": backend_live,
-				"queued": jobs_sorted
+				"queued": jobs_sorted,
+				"oldest": jobs_oldest
 			},
 			"frontend": {
 				"live": True  # duh
@@ -102,6 +107,9 @@ def api_status():
 		}
 	}
 
+	status_cache["response"] = response
+	status_cache["timestamp"] = now
+
 	return jsonify(response)
 
 
@@ -398,6 +406,98 @@ def check_dataset():
 
 	return jsonify(status)
 
+@app.route("/api/dataset/<string:key>/rows/")
+@login_required
+@openapi.endpoint("tool")
+def get_dataset_rows(key):
+	"""
+	Get a range of rows from a dataset
+
+	Rows are read from the dataset's result file via its index, so rows at
+	any position in the dataset can be retrieved without reading the file up
+	to that position. Items in NDJSON files are mapped to flat rows, as they
+	would be in the CSV version of the dataset, if possible.
+
+	:param str key:  Dataset key
+
+	:request-param int offset:  Row to start at; the first row is 0
+	:request-param int limit:  Amount of rows to return, at most 1000
+	:request-param str columns:  Comma-separated list of columns to include;
+	all columns are included if not given
+
+	:return: The requested rows, and the total amount of rows in the dataset.
+
+	:return-schema: {
+		type=object,
+		properties={
+			key={type=string},
+			offset={type=integer},
+			limit={type=integer},
+			num_rows={type=integer},
+			columns={type=array,items={type=string}},
+			rows={type=array,items={type=object}}
+		}
+	}
+
+	:return-error 202:  If the dataset is being indexed; rows can be
+	retrieved once that is done.
+	:return-error 404:  If the dataset does not exist or has no results.
+	:return-error 406:  If the dataset's results cannot be read per row.
+	"""
+	try:
+		dataset = DataSet(key=key, db=db)
+	except TypeError:
+		return error(404, error="Dataset does not exist.")
+
+	try:
+		offset = max(0, int(request.args.get("offset", 0)))
+		limit = min(1000, max(0, int(request.args.get("limit", 100))))
+	except ValueError:
+		return error(406, error="Offset and limit should be integers.")
+
+	if not dataset.is_finished() or not dataset.get_results_path().exists():
+		return error(404, error="Dataset has no results.")
+
+	# indexes are built when a dataset is finished, but small and older
+	# datasets may not have one yet. Small files can be indexed right away;
+	# larger ones are indexed by the backend, so the request does not need
+	# to wait for the whole file to be read
+	index = dataset.get_index()
+	if not index and dataset.can_index():
+		if dataset.get_results_path().stat().st_size >= dataset.index_min_size:
+			queue.add_job("index-dataset", remote_id=dataset.key)
+			return error(202, error="Dataset is being indexed. Try again later.")
+
+		index = dataset.build_index()
+
+	if not index:
+		return error(406, error="Rows cannot be retrieved for this type of dataset.")
+
+	columns = [column.strip() for column in request.args.get("columns", "").split(",") if column.strip()]
+
+	processor = dataset.get_own_processor()
+	mapper = processor.map_item if index.data["format"] == "ndjson" and hasattr(processor, "map_item") else None
+
+	rows = []
+	for row in index.iterate_rows(offset=offset, limit=limit, columns=columns if columns else None):
+		if mapper:
+			row = mapper(row)
+
+		if columns:
+			row = {column: row.get(column) for column in columns}
+
+		rows.append(row)
+
+	return jsonify({
+		"key": dataset.key,
+		"offset": offset,
+		"limit": limit,
+		"num_rows": index.num_rows,
+		"columns": columns if columns else index.columns,
+		"rows": rows
+	})
+
+
 @app.route("/api/edit-dataset-label/<string:key>/", methods=["POST"])
 @api_ratelimit
 @login_required
@@ -800,6 +900,7 @@ def check_processor():
 		genealogy = dataset.get_genealogy()
 		parent = genealogy[-2]
 		top_parent = genealogy[0]
+		DataSet.preload_children([dataset], db)
 
 		children.append({
 			"key": dataset.key,
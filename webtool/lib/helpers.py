@@ -25,7 +25,8 @@ class Pagination(object):
 	Provide pagination
 	"""
 
-	def __init__(self, page, per_page, total_count, route="show_results"):
+	def __init__(self, page, per_page, total_count, route="show_results", has_next=None, next_cursor=None,
+				 prev_cursor=None, is_estimate=False):
 		"""
 		Set up pagination object
 
@@ -33,11 +34,23 @@ class Pagination(object):
 		:param int per_page:  Items per page
 		:param int total_count:  Total number of items
 		:param str route:  Route to call url_for for to prepend to page links
+		:param bool has_next:  Whether there is a next page. If `None`, this
+		is determined based on the total number of items.
+		:param str next_cursor:  Cursor to continue from when requesting the
+		next page, for keyset pagination
+		:param str prev_cursor:  Cursor to continue from when requesting the
+		previous page, for keyset pagination
+		:param bool is_estimate:  Whether the total number of items is an
+		estimate rather than an exact count
 		"""
 		self.page = page
 		self.per_page = per_page
 		self.total_count = total_count
 		self.route = route
+		self.next_cursor = next_cursor
+		self.prev_cursor = prev_cursor
+		self.is_estimate = is_estimate
+		self._has_next = has_next
 
 	@property
 	def pages(self):
@@ -58,6 +71,9 @@ class Pagination(object):
 		"""
 		:return bool:  Is there a next page?
 		"""
+		if self._has_next is not None:
+			return self._has_next
+
 		return self.page < self.pages
 
 	def iter_pages(self, left_edge=2, left_current=2, right_current=5, right_edge=2):
@@ -73,11 +89,16 @@ class Pagination(object):
 		:return:  A page number, or None
 		"""
 		last = 0
-		for num in range(1, self.pages + 1):
+		pages = self.pages
+		if self.has_next:
+			# if the total is an estimate, the amount of pages may be too low
+			pages = max(pages, self.page + 1)
+
+		for num in range(1, pages + 1):
 			if num <= left_edge or \
 					(num > self.page - left_current - 1 and \
 					 num < self.page + right_current) or \
-					num > self.pages - right_edge:
+					num > pages - right_edge:
 				if last + 1 != num:
 					yield None
 				yield num
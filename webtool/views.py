@@ -1,7 +1,6 @@
 """
 4CAT Web Tool views - pages to be viewed by the user
 """
-import io
 import os
 import re
 import csv
@@ -262,7 +261,9 @@ def get_mapped_result(key):
 	Some result files are not CSV files. CSV is such a central file format that
 	it is worth having a generic 'download as CSV' function for these. If the
 	processor of the dataset has a method for mapping its data to CSV, then this
-	route uses that to convert the data to CSV on the fly and serve it as such.
+	route uses that to convert the data to CSV and serve it as such. The CSV
+	file is streamed while it is generated, and kept, so later downloads can
+	be served from that file.
 
 	:param str key:  Dataset key
 	"""
@@ -271,43 +272,45 @@ def get_mapped_result(key):
 	except TypeError:
 		abort(404)
 
-	if dataset.get_extension() == ".csv":
+	if dataset.get_extension() == "csv":
 		# if it's already a csv, just return the existing file
-		return url_for(get_result, query_file=dataset.get_results_path().name)
+		return redirect(url_for("get_result", query_file=dataset.get_results_path().name))
 
 	if not hasattr(dataset.get_own_processor(), "map_item"):
 		# cannot map without a mapping method
 		abort(404)
 
-	mapper = dataset.get_own_processor().map_item
-
-	def map_response():
-		"""
-		Yield a CSV file line by line
-
-		Pythons built-in csv library, which we use, has no real concept of
-		this, so we cheat by using a StringIO buffer that we flush and clear
-		after each CSV line is written to it.
-		"""
-		writer = None
-		buffer = io.StringIO()
-		with dataset.get_results_path().open() as infile:
-			for line in infile:
-				mapped_item = mapper(json.loads(line))
-				if not writer:
-					writer = csv.DictWriter(buffer, fieldnames=tuple(mapped_item.keys()))
-					writer.writeheader()
-					yield buffer.getvalue()
-					buffer.truncate(0)
-					buffer.seek(0)
-
-				writer.writerow(mapped_item)
-				yield buffer.getvalue()
-				buffer.truncate(0)
-				buffer.seek(0)
-
-	disposition = 'attachment; filename="%s"' % dataset.get_results_path().with_suffix(".csv").name
-	return app.response_class(stream_with_context(map_response()), mimetype="text/csv", headers={"Content-Disposition": disposition})
+	if not dataset.can_map_csv():
+		abort(404)
+
+	# the mapped file is generated once, and then reused for later downloads
+	filename = dataset.get_results_path().with_suffix(".csv").name
+	mapped_path = dataset.get_mapped_csv(generate=False)
+	if mapped_path:
+		return send_from_directory(directory=str(mapped_path.parent), filename=mapped_path.name, as_attachment=True,
+								   attachment_filename=filename, mimetype="text/csv")
+
+	disposition = 'attachment; filename="%s"' % filename
+	return app.response_class(stream_with_context(dataset.iterate_mapped_csv()), mimetype="text/csv",
+							  headers={"Content-Disposition": disposition})
+
+
+def parse_cursor(cursor):
+	"""
+	Parse a pagination cursor
+
+	Cursors identify a dataset by its timestamp and ID, to continue listing
+	datasets from for keyset pagination.
+
+	:param str cursor:  Cursor, as `timestamp-id`
+	:return tuple|None:  Timestamp and ID, or `None` if the cursor is invalid
+	"""
+	try:
+		timestamp, id = cursor.split("-")
+		return (int(timestamp), int(id))
+	except ValueError:
+		return None
+
 
 @app.route('/results/', defaults={'page': 1})
 @app.route('/results/page/<int:page>/')
@@ -322,8 +325,9 @@ def show_results(page):
 	"""
 	page_size = 20
 	offset = (page - 1) * page_size
+	exact_count_threshold = 10000
 
-	where = ["(key_parent = '' OR key_parent IS NULL)"]
+	where = ["key_parent = ''"]
 	replacements = []
 
 	query_filter = request.args.get("filter", "")
@@ -333,7 +337,7 @@ def show_results(page):
 		depth = "own"
 
 	if depth == "own":
-		where.append("parameters::json->>'user' = %s")
+		where.append("owner = %s")
 		replacements.append(current_user.get_id())
 
 	if depth == "favourites":
@@ -344,23 +348,62 @@ def show_results(page):
 		where.append("query LIKE %s")
 		replacements.append("%" + query_filter + "%")
 
-	where = " AND ".join(where)
+	# counting all matching datasets gets slow for large amounts of
+	# datasets, so use the query planner's estimate if there are many
+	count_query = "SELECT * FROM datasets WHERE " + " AND ".join(where)
+	num_datasets = db.count_estimate(count_query, tuple(replacements))
+	is_estimate = num_datasets >= exact_count_threshold
+	if not is_estimate:
+		num_datasets = db.fetchone("SELECT COUNT(*) AS num FROM datasets WHERE " + " AND ".join(where), tuple(replacements))["num"]
+
+	# keyset pagination: rather than skipping all datasets on earlier pages,
+	# which gets slower for each page, continue from the last (or first)
+	# dataset on the page the user came from, if known
+	before = parse_cursor(request.args.get("before", ""))
+	after = parse_cursor(request.args.get("after", "")) if not before else None
+	order = "DESC"
+	if before:
+		where.append("(timestamp, id) < (%s, %s)")
+		replacements.extend(before)
+	elif after:
+		where.append("(timestamp, id) > (%s, %s)")
+		replacements.extend(after)
+		order = "ASC"
 
-	num_datasets = db.fetchone("SELECT COUNT(*) AS num FROM datasets WHERE " + where, tuple(replacements))["num"]
-
-	replacements.append(page_size)
-	replacements.append(offset)
-	datasets = db.fetchall("SELECT key FROM datasets WHERE " + where + " ORDER BY timestamp DESC LIMIT %s OFFSET %s",
-						   tuple(replacements))
+	where = " AND ".join(where)
+	query = "SELECT * FROM datasets WHERE " + where + " ORDER BY timestamp " + order + ", id " + order + " LIMIT %s"
+	replacements.append(page_size + 1)
+	if not before and not after:
+		query += " OFFSET %s"
+		replacements.append(offset)
+
+	datasets = db.fetchall(query, tuple(replacements))
+
+	# one more dataset than fits on the page was requested, to determine if
+	# there are any further datasets
+	has_more = len(datasets) > page_size
+	datasets = datasets[:page_size]
+	if after:
+		datasets.reverse()
+		if not has_more:
+			# no more datasets before these, so this is the first page
+			page = 1
 
 	if not datasets and page != 1:
 		abort(404)
 
-	pagination = Pagination(page, page_size, num_datasets)
 	filtered = []
-
 	for dataset in datasets:
-		filtered.append(DataSet(key=dataset["key"], db=db))
+		filtered.append(DataSet(data=dataset, db=db))
+
+	# only the amount of direct children is shown, so no need to load the
+	# full trees
+	DataSet.preload_children(filtered, db, recursive=False)
+
+	pagination = Pagination(page, page_size, num_datasets, has_next=has_more or bool(after),
+							next_cursor="%i-%i" % (datasets[-1]["timestamp"], datasets[-1]["id"]) if datasets else None,
+							prev_cursor="%i-%i" % (datasets[0]["timestamp"], datasets[0]["id"]) if datasets else None,
+							is_estimate=is_estimate)
 
 	favourites = [row["key"] for row in
 				  db.fetchall("SELECT key FROM users_favourites WHERE name = %s", (current_user.get_id(),))]
@@ -393,6 +436,9 @@ def show_result(key):
 		url = "/results/%s/#nav=%s" % (genealogy[0].key, nav)
 		return redirect(url)
 
+	# the page shows the full tree of processors run on this dataset
+	DataSet.preload_children([dataset], db)
+
 	# load list of processors compatible with this dataset
 	is_processor_running = False
 
@@ -423,8 +469,10 @@ def preview_csv(key):
 	"""
 	Preview a CSV file
 
-	Simply passes the first 25 rows of a dataset's csv result file to the
-	template renderer.
+	Simply passes 25 rows of a dataset's csv result file to the template
+	renderer. By default these are the first rows; an `offset` query
+	parameter can be given to show later rows. If the dataset has been
+	indexed, the index is used to skip to the requested rows directly.
 
 	:param str key:  Dataset key
 	:return:  HTML preview
@@ -434,10 +482,57 @@ def preview_csv(key):
 	except TypeError:
 		return error(404, "Dataset not found.")
 
+	try:
+		offset = max(0, int(request.args.get("offset", 0)))
+	except ValueError:
+		offset = 0
+
+	try:
+		index = dataset.get_index()
+		if index and index.columns is not None and index.data["format"] in ("csv", "parquet"):
+			header = index.columns
+			rows = [header]
+			rows.extend([[row.get(column) for column in header] for row in index.iterate_rows(offset=offset, limit=24)])
+
+			return render_template("result-csv-preview.html", rows=rows, offset=offset, filename=dataset.get_results_path().name)
+
+		if dataset.get_results_path().suffix.lower() == ".parquet":
+			# columnar file; read the requested rows only, and display them as
+			# if they were a CSV file
+			import pyarrow.parquet as pq
+			parquet_file = pq.ParquetFile(str(dataset.get_results_path()))
+
+			rows = [parquet_file.schema_arrow.names]
+			skip = offset
+			for batch in parquet_file.iter_batches(batch_size=24):
+				if skip >= batch.num_rows:
+					skip -= batch.num_rows
+					continue
+
+				rows.extend([list(row.values()) for row in batch.slice(skip).to_pylist()][:25 - len(rows)])
+				skip = 0
+				if len(rows) >= 25:
+					break
+
+			return render_template("result-csv-preview.html", rows=rows, offset=offset, filename=dataset.get_results_path().name)
+
+	except FileNotFoundError:
+		abort(404)
+	except (ImportError, OSError, ValueError):
+		# pyarrow is not installed (it is optional), or the file is corrupt
+		return error(400, error="This dataset cannot be previewed.")
+
 	try:
 		with dataset.get_results_path().open(encoding="utf-8") as csvfile:
 			rows = []
 			reader = csv.reader(csvfile)
+			try:
+				rows.append(next(reader))
+				for i in range(0, offset):
+					next(reader)
+			except StopIteration:
+				pass
+
 			while len(rows) < 25:
 				try:
 					row = next(reader)
@@ -447,7 +542,7 @@ def preview_csv(key):
 	except FileNotFoundError:
 		abort(404)
 
-	return render_template("result-csv-preview.html", rows=rows, filename=dataset.get_results_path().name)
+	return render_template("result-csv-preview.html", rows=rows, offset=offset, filename=dataset.get_results_path().name)
 
 
 @app.route("/result/<string:key>/toggle-favourite/")